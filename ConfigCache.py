@@ -0,0 +1,87 @@
+"""process wide cache for parsed configuration files (state machine graphs, state mappings and config sections)
+
+entries are keyed by absolute path and modification time; a changed file is parsed again on its next use
+cached values are read-only and shared, callers must not modify them
+"""
+import csv
+import os
+import sys
+import threading
+import configparser
+from types import MappingProxyType
+
+cache = {}
+cacheLock = threading.Lock()
+#number of parsed files and cache hits
+loads = 0
+hits = 0
+
+def fileVersion(path):
+    """modification time and size of a file or None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns,stat.st_size)
+
+def cached(path,kind,parser):
+    """get the value of parser(path) from the cache; kind distinguishes different parsers for the same file"""
+    global loads,hits
+    path = os.path.abspath(path)
+    version = fileVersion(path)
+    key = (path,kind)
+    with cacheLock:
+        entry = cache.get(key)
+        if entry and version != None and entry[0] == version:
+            hits += 1
+            return entry[1]
+    #parse outside of the lock; two threads might parse the same file once at startup which is harmless
+    value = parser(path)
+    with cacheLock:
+        loads += 1
+        if version != None:
+            cache[key] = (version,value)
+    return value
+
+def parseGraph(path):
+    """read Graph from csv file ---- | state | transition | next State |"""
+    graph = {}
+    with open(path, 'r') as file:
+        reader = csv.reader(file, delimiter=',')
+        for row in reader:
+            if len(row) == 3:
+                state,transition,nextState = map(sys.intern,row)
+                graph.setdefault(state,{})[transition] = nextState
+    return MappingProxyType({state:MappingProxyType(transitions) for state,transitions in graph.items()})
+
+def parseMapping(path):
+    """read mapping from csv file ---- | state | mapped state |"""
+    mapping = {}
+    with open(path, 'r') as file:
+        reader = csv.reader(file, delimiter=',')
+        for row in reader:
+            if len(row) == 2:
+                mapping[sys.intern(row[0])] = sys.intern(row[1])
+    return MappingProxyType(mapping)
+
+def parseConfig(path):
+    """read a config file; the parser is kept so that option names stay case-insensitive"""
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    return parser
+
+def getGraph(path):
+    """compiled state machine graph {state:{transition:next state}}"""
+    return cached(path,"graph",parseGraph)
+
+def getMapping(path):
+    """state mapping {state:mapped state}"""
+    return cached(path,"mapping",parseMapping)
+
+def getConfigSection(path,section):
+    """section of a config file (shared, don't modify); raises KeyError for unknown sections"""
+    return cached(path,"config",parseConfig)[section]
+
+def clear():
+    with cacheLock:
+        cache.clear()
@@ -0,0 +1,104 @@
+"""versioned schema changes for the ECS database
+
+the schema version is stored in PRAGMA user_version; each migration is a list of statements (or functions taking the connection) which is applied once in one transaction
+append new migrations at the end and never change an applied one
+"""
+import sqlite3
+import sys
+
+#partitions and tags which are compatible: the systems of the tag are exactly the detectors of the partition and the global systems
+#(number of systems of the tag = number of systems of the partition = number of systems they share)
+#the filters restrict the query to some partitions or tags e.g. "WHERE m.PartitionId IN (?)", "WHERE p.id IN (?)" and "WHERE ct.TagName IN (?)"
+tagCompatibilityQuery = """
+    WITH
+      tagSystems AS (SELECT DISTINCT ct.TagName, c.systemId FROM ConfigurationTag ct JOIN Configurations c ON ct.configId = c.configId {tagFilter}),
+      partitionSystems AS (SELECT m.PartitionId, m.DetectorId AS systemId FROM Mapping m {mappingFilter}
+                           UNION SELECT p.id, g.id FROM Partition p, GlobalSystems g {partitionFilter}),
+      partitionSizes AS (SELECT PartitionId, count(*) AS n FROM partitionSystems GROUP BY PartitionId),
+      tagSizes AS (SELECT TagName, count(*) AS n FROM tagSystems GROUP BY TagName),
+      shared AS (SELECT ps.PartitionId, ts.TagName, count(*) AS n FROM partitionSystems ps JOIN tagSystems ts ON ps.systemId = ts.systemId GROUP BY ps.PartitionId, ts.TagName)
+    SELECT s.PartitionId, s.TagName FROM shared s
+      JOIN partitionSizes p ON p.PartitionId = s.PartitionId
+      JOIN tagSizes t ON t.TagName = s.TagName
+    WHERE s.n = p.n AND s.n = t.n
+    """
+
+def tagCompatibilitySelect(partitions=None,tags=None):
+    """tagCompatibilityQuery for the given partitions and tags (all if None); returns (query,parameters)"""
+    parameters = []
+    filters = {"tagFilter":"", "mappingFilter":"", "partitionFilter":""}
+    if tags != None:
+        filters["tagFilter"] = "WHERE ct.TagName IN (%s)" % ",".join("?"*len(tags))
+        parameters.extend(tags)
+    if partitions != None:
+        filters["mappingFilter"] = "WHERE m.PartitionId IN (%s)" % ",".join("?"*len(partitions))
+        filters["partitionFilter"] = "WHERE p.id IN (%s)" % ",".join("?"*len(partitions))
+        parameters.extend(partitions)
+        parameters.extend(partitions)
+    return tagCompatibilityQuery.format(**filters),parameters
+
+def createTagCompatibility(connection):
+    connection.execute("CREATE TABLE IF NOT EXISTS TagCompatibility ( `PartitionId` TEXT NOT NULL, `TagName` TEXT NOT NULL, PRIMARY KEY(`PartitionId`,`TagName`) ) WITHOUT ROWID")
+    connection.execute("CREATE INDEX IF NOT EXISTS TagCompatibility_TagName ON TagCompatibility(TagName)")
+    query,parameters = tagCompatibilitySelect()
+    connection.execute("INSERT OR IGNORE INTO TagCompatibility "+query,parameters)
+
+migrations = [
+    (1, "indexes for the lookups of DataBaseWrapper and the triggers", [
+        #detectors of a partition (getDetectorsForPartition, getConfigsForPCA, tag compatibility); DetectorId is the primary key
+        "CREATE INDEX IF NOT EXISTS Mapping_PartitionId ON Mapping(PartitionId, DetectorId)",
+        #configurations of a system and the deleteConfigOnDetectorDelete trigger
+        "CREATE INDEX IF NOT EXISTS Configurations_systemId ON Configurations(systemId)",
+        #tags of a configuration and the deleteTagOnConfigDelete trigger; TagName is the first column of the primary key
+        "CREATE INDEX IF NOT EXISTS ConfigurationTag_configId ON ConfigurationTag(configId, TagName)",
+        #port checks of the blockDuplicatePorts triggers
+        "CREATE INDEX IF NOT EXISTS Detector_address ON Detector(address)",
+        "CREATE INDEX IF NOT EXISTS Partition_address ON Partition(address)",
+    ]),
+    (2, "materialised compatibility of partitions and configuration tags", [
+        createTagCompatibility,
+    ]),
+]
+
+latestVersion = migrations[-1][0]
+
+def schemaVersion(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(connection,log=None):
+    """apply all migrations newer than the schema version of the database; returns the new version"""
+    version = schemaVersion(connection)
+    for migrationVersion,description,statements in migrations:
+        if migrationVersion <= version:
+            continue
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            #another process might have migrated the database in the meantime
+            if schemaVersion(connection) >= migrationVersion:
+                connection.rollback()
+                continue
+            for statement in statements:
+                #a statement or a function for steps which need more than one statement
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(statement)
+            #PRAGMA doesn't accept parameters
+            connection.execute("PRAGMA user_version = %d" % migrationVersion)
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
+        if log:
+            log("database migrated to schema version %d: %s" % (migrationVersion,description))
+        version = migrationVersion
+    return version
+
+if __name__ == "__main__":
+    #usage: python DataBaseMigrations.py [database file]
+    dataBaseFile = sys.argv[1] if len(sys.argv) > 1 else "ECS_database.db"
+    connection = sqlite3.connect(dataBaseFile)
+    try:
+        print("schema version %d" % migrate(connection,print))
+    finally:
+        connection.close()
@@ -1,8 +1,12 @@
 import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
 from DataObjects import DataObjectCollection, DataObject, detectorDataObject, partitionDataObject, globalSystemDataObject, mappingDataObject, configObject
 from ECSCodes import ECSCodes
 codes = ECSCodes()
 import json
+import DataBaseMigrations
 try:
     from django.core.exceptions import ImproperlyConfigured
     #when executed from Django
@@ -13,6 +17,136 @@ except ModuleNotFoundError:
 except ImproperlyConfigured:
     dataBaseFile = "ECS_database.db"
 
+#queries which have to stay index driven for large installations (see DataBaseWrapper.checkQueryPlans)
+detectorsForPartitionQuery = "SELECT d.* FROM Mapping m JOIN Detector d ON d.id = m.DetectorId WHERE m.PartitionId=?"
+
+configsForPCAQuery = """
+    SELECT configid,detectorid,parameters FROM ((Partition Join Mapping on Partition.id = Mapping.PartitionId) join Detector on detectorId=Detector.id) left join Configurations on detectorid = Configurations.systemId  Where Partitionid=?
+    union
+    select configid,id,parameters FROM GlobalSystems left join Configurations on GlobalSystems.id = Configurations.systemId
+    """.replace("\n"," ")
+
+pcaCompatibleTagsQuery = "SELECT TagName FROM TagCompatibility WHERE PartitionId=?"
+
+#tables which may be read completely by these queries: global systems are few
+fullScanAllowed = {
+    detectorsForPartitionQuery: set(),
+    configsForPCAQuery: {"GlobalSystems"},
+    pcaCompatibleTagsQuery: set(),
+}
+
+def chunks(ids,size=900):
+    """split a list of ids for IN (...) queries (older SQLite versions allow only 999 parameters per query)"""
+    ids = list(ids)
+    return [ids[i:i+size] for i in range(0,len(ids),size)]
+
+class ConnectionPool:
+    """long lived connections to a database file; a connection is used by one thread at a time"""
+    def __init__(self,dataBaseFile,maxIdle=8,busyTimeout=10,cachedStatements=256):
+        self.dataBaseFile = dataBaseFile
+        self.maxIdle = maxIdle
+        self.busyTimeout = busyTimeout
+        self.cachedStatements = cachedStatements
+        #idle connections, the most recently used one is reused first
+        self.idle = []
+        self.lock = threading.Lock()
+        #connection of a thread during a transaction
+        self.local = threading.local()
+        self.opened = 0
+        self.reused = 0
+        #schema version after the migrations ran (once per pool)
+        self.schemaVersion = None
+
+    def open(self):
+        connection = sqlite3.connect(self.dataBaseFile,timeout=self.busyTimeout,check_same_thread=False,cached_statements=self.cachedStatements)
+        #with a write ahead log readers don't block on a writer and vice versa
+        connection.execute("PRAGMA journal_mode=WAL")
+        #in WAL mode a sync on checkpoints is enough to keep the database consistent
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA temp_store=MEMORY")
+        connection.execute("PRAGMA cache_size=-8000")
+        with self.lock:
+            self.opened += 1
+        return connection
+
+    def acquire(self):
+        """get a connection; inside a transaction this is always the connection of the transaction"""
+        connection = getattr(self.local,"connection",None)
+        if connection:
+            return connection
+        with self.lock:
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop()
+        return self.open()
+
+    def release(self,connection):
+        if connection is getattr(self.local,"connection",None):
+            return
+        if connection.in_transaction:
+            #don't hand out a connection with uncommitted changes
+            connection.rollback()
+        with self.lock:
+            if len(self.idle) < self.maxIdle:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def inTransaction(self):
+        return getattr(self.local,"connection",None) != None
+
+    @contextmanager
+    def transaction(self):
+        """all database operations of the thread within the block share one transaction; nested blocks join the outer transaction"""
+        if self.inTransaction():
+            self.local.depth += 1
+            try:
+                yield self.local.connection
+            finally:
+                self.local.depth -= 1
+            return
+        connection = self.acquire()
+        self.local.connection = connection
+        self.local.depth = 1
+        self.local.failed = False
+        try:
+            yield connection
+        except:
+            self.local.failed = True
+            raise
+        finally:
+            failed = self.local.failed
+            self.local.connection = None
+            try:
+                if failed:
+                    connection.rollback()
+                else:
+                    connection.commit()
+            finally:
+                self.release(connection)
+
+    def markFailed(self):
+        """the transaction of the thread will be rolled back at its end"""
+        self.local.failed = True
+
+    def close(self):
+        """close all idle connections"""
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for connection in idle:
+            connection.close()
+
+pools = {}
+poolsLock = threading.Lock()
+
+def getConnectionPool(dataBaseFile):
+    """one pool per database file and process"""
+    with poolsLock:
+        if dataBaseFile not in pools:
+            pools[dataBaseFile] = ConnectionPool(dataBaseFile)
+        return pools[dataBaseFile]
+
 
 class DataBaseWrapper:
     """Handler for the ECS Database"""
@@ -21,6 +155,65 @@ class DataBaseWrapper:
     def __init__(self,logfunction):
         self.log = logfunction
         self.dataBaseFile = dataBaseFile
+        self.pool = getConnectionPool(self.dataBaseFile)
+        if self.pool.schemaVersion == None:
+            self.migrate()
+
+    def migrate(self):
+        """bring the database schema to the latest version"""
+        connection = self.connect()
+        try:
+            self.pool.schemaVersion = DataBaseMigrations.migrate(connection,self.log)
+        except Exception as e:
+            self.handleError(e,"error migrating database schema")
+        finally:
+            self.release(connection)
+
+    def checkQueryPlans(self):
+        """returns a list of (query,plan step) for every full table scan in the plans of the critical queries; empty if all of them use indexes"""
+        connection = self.connect()
+        try:
+            problems = []
+            for query,allowed in fullScanAllowed.items():
+                parameters = (None,) * query.count("?")
+                for row in connection.execute("EXPLAIN QUERY PLAN "+query,parameters).fetchall():
+                    step = row[3]
+                    if not step.startswith("SCAN "):
+                        continue
+                    #e.g. "SCAN x USING COVERING INDEX ...", "SCAN Detector" or "SCAN (subquery-2)" for an already filtered subquery result
+                    table = step.split()[1]
+                    if table not in allowed and not table.startswith("(") and "INDEX" not in step:
+                        problems.append((query,step))
+            return problems
+        finally:
+            self.release(connection)
+
+    def connect(self):
+        """get a pooled connection; give it back with release"""
+        return self.pool.acquire()
+
+    def release(self,connection):
+        self.pool.release(connection)
+
+    def commit(self,connection):
+        """commit unless the operation is part of a transaction"""
+        if not self.pool.inTransaction():
+            connection.commit()
+
+    def rollback(self,connection):
+        """rollback; inside a transaction the whole transaction is rolled back at its end"""
+        if self.pool.inTransaction():
+            self.pool.markFailed()
+        else:
+            connection.rollback()
+
+    def transaction(self):
+        """context manager for several operations in one transaction e.g. with database.transaction(): ..."""
+        return self.pool.transaction()
+
+    def jsonReply(self,dataObject):
+        """a DataObject or DataObjectCollection encoded as reply to a request"""
+        return dataObject.asJsonString().encode()
 
     def handleError(self, exception, errorMessage):
         #full exception to log
@@ -30,7 +223,7 @@ class DataBaseWrapper:
 
     def getAllDetectors(self):
         """Get All Detectors in Detector Table; returns empty DataObjectCollection if there are now Detectors"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             c.execute("SELECT * FROM Detector")
@@ -39,11 +232,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting detectors")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getDetector(self,id):
         """get Detector with given id; returns ErrorCode if it does not exist"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
@@ -54,11 +247,60 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting detector")
         finally:
-            connection.close()
+            self.release(connection)
+
+    def getDetectorsForIds(self,ids):
+        """get the Detectors for a list of ids in one query; unknown ids are left out"""
+        connection = self.connect()
+        c = connection.cursor()
+        try:
+            res = []
+            for chunk in chunks(ids):
+                res.extend(c.execute("SELECT * FROM Detector WHERE id IN (%s)" % ",".join("?"*len(chunk)),chunk).fetchall())
+            return DataObjectCollection(res,detectorDataObject)
+        except Exception as e:
+            return self.handleError(e,"error getting detectors")
+        finally:
+            self.release(connection)
+
+    def getPartitionsForDetectors(self,ids):
+        """get the Partitions of a list of Detectors in one query; returns a dictionary detector id -> partitionDataObject without unmapped detectors"""
+        connection = self.connect()
+        c = connection.cursor()
+        try:
+            ret = {}
+            for chunk in chunks(ids):
+                res = c.execute("SELECT Mapping.DetectorId, Partition.* FROM Mapping JOIN Partition ON Mapping.PartitionId = Partition.id WHERE Mapping.DetectorId IN (%s)" % ",".join("?"*len(chunk)),chunk).fetchall()
+                for row in res:
+                    ret[row[0]] = partitionDataObject(row[1:])
+            return ret
+        except Exception as e:
+            return self.handleError(e,"error getting partitions for detectors")
+        finally:
+            self.release(connection)
+
+    def getDetectorsWithPartitions(self,ids):
+        """get the Detectors for a list of ids and their Partitions in one query; returns a dictionary detector id -> (detectorDataObject,partitionDataObject or None for unmapped detectors) without unknown ids"""
+        connection = self.connect()
+        c = connection.cursor()
+        try:
+            ret = {}
+            for chunk in chunks(ids):
+                res = c.execute("SELECT Detector.*, Partition.* FROM Detector LEFT JOIN Mapping ON Mapping.DetectorId = Detector.id LEFT JOIN Partition ON Partition.id = Mapping.PartitionId WHERE Detector.id IN (%s)" % ",".join("?"*len(chunk)),chunk).fetchall()
+                for row in res:
+                    detector = detectorDataObject(row[:4])
+                    #columns of Partition are NULL for unmapped detectors
+                    partition = partitionDataObject(row[4:]) if row[4] != None else None
+                    ret[detector.id] = (detector,partition)
+            return ret
+        except Exception as e:
+            return self.handleError(e,"error getting detectors with partitions")
+        finally:
+            self.release(connection)
 
     def getAllUnmappedDetectors(self):
         """gets all Detectors which are currently unmmaped"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             res = c.execute("SELECT * FROM Detector Where Detector.id not in (select DetectorId From Mapping)").fetchall()
@@ -66,40 +308,45 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting unmapped detectors")
         finally:
-            connection.close()
+            self.release(connection)
 
     def addDetector(self,dataObject):
         """add a Detector to Database;accepts json String or DataObject"""
         if not isinstance(dataObject,detectorDataObject):
             dataObject = detectorDataObject(json.loads(dataObject))
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             c.execute("INSERT INTO Detector VALUES (?,?,?,?)", dataObject.asArray())
-            connection.commit()
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error inserting values into Detector Table")
         finally:
-            connection.close()
+            self.release(connection)
 
     def removeDetector(self,id):
         """delete a Detector from Database"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
+            #triggers remove the mapping, configurations and tag entries of the detector
+            partitions = self.partitionsOfDetector(c,id)
+            tags = self.tagsOfSystem(c,id)
             c.execute("DELETE FROM Detector WHERE id = ?", val)
-            connection.commit()
+            self.refreshTagCompatibility(c,partitions,tags)
+            self.commit(connection)
             return codes.ok
         except Exception as e:
+            self.rollback(connection)
             return self.handleError(e,"error removing values from Detector Table")
         finally:
-            connection.close()
+            self.release(connection)
     def getPartition(self,id):
         """Get Partition with given id from Database; returns None if it does not exist"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
@@ -110,11 +357,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting partition")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getPartitionForDetector(self,id):
         """gets the Partition of a Detector; returns DataObject or ErrorCode"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
@@ -125,11 +372,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting partition for Detector")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getAllPartitions(self):
         """Get All Detectors in Detector Table"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             c.execute("SELECT * FROM Partition")
@@ -138,57 +385,59 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting partitions")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getDetectorsForPartition(self,pcaId):
         """get all Mapped Detectors for a given PCA Id"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (pcaId,)
         try:
-            c.execute("SELECT * From Detector WHERE Detector.id in (SELECT d.id FROM Detector d JOIN Mapping m ON d.id = m.DetectorId WHERE PartitionId=?)",val)
+            c.execute(detectorsForPartitionQuery,val)
             res = c.fetchall()
             return DataObjectCollection(res, detectorDataObject)
         except Exception as e:
             return self.handleError(e,"error getting detectors for Partition")
         finally:
-            connection.close()
+            self.release(connection)
 
     def addPartition(self,dataObject):
         """create new Partition"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         data = dataObject.asArray()
         try:
             c.execute("INSERT INTO Partition VALUES (?,?,?,?,?,?,?)", data)
-            connection.commit()
+            self.refreshTagCompatibility(c,partitions=(dataObject.id,))
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error inserting values into Partition Table")
         finally:
-            connection.close()
+            self.release(connection)
 
     def removePartition(self,id):
         """delete a Partition with given id"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
             c.execute("DELETE FROM Partition WHERE id = ?", val)
             #Free the Detectors
             c.execute("DELETE FROM Mapping WHERE PartitionId = ?", val)
-            connection.commit()
+            c.execute("DELETE FROM TagCompatibility WHERE PartitionId = ?", val)
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error removing values from Partition Table")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getDetectorMapping(self):
         """get entire PCA Detector Mapping Table"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             c.execute("SELECT * From Mapping")
@@ -197,57 +446,82 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Mapping Table")
         finally:
-            connection.close()
+            self.release(connection)
 
     def mapDetectorToPCA(self,detId,pcaId):
         """map a Detector to a Partition"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         vals = (detId,pcaId)
         try:
             c.execute("INSERT INTO Mapping VALUES (?,?)", vals)
-            connection.commit()
+            self.refreshTagCompatibility(c,partitions=(pcaId,))
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error mapping %s to %s" % (str(detId),str(pcaId),))
         finally:
-            connection.close()
+            self.release(connection)
 
     def remapDetector(self,detId,newPcaId,oldPcaID):
         """assign Detector to a different Partition"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         vals = (detId,newPcaId)
         try:
+            partitions = self.partitionsOfDetector(c,detId)
             c.execute("DELETE FROM Mapping WHERE DetectorId = ?", (detId,))
             c.execute("INSERT INTO Mapping VALUES (?,?)", vals)
-            connection.commit()
+            self.refreshTagCompatibility(c,partitions=partitions+[newPcaId])
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error remapping %s from %s to %s" % (str(detId),str(oldPcaID),str(newPcaId),))
         finally:
-            connection.close()
+            self.release(connection)
+
+    def moveDetectors(self,moves):
+        """change the Partitions of many Detectors in one transaction; moves is a dictionary detector id -> partition id (None to unmap the detector)"""
+        connection = self.connect()
+        c = connection.cursor()
+        try:
+            partitions = set(pcaId for pcaId in moves.values() if pcaId != None)
+            for chunk in chunks(moves):
+                placeholders = ",".join("?"*len(chunk))
+                partitions.update(row[0] for row in c.execute("SELECT DISTINCT PartitionId FROM Mapping WHERE DetectorId IN (%s)" % placeholders,chunk).fetchall())
+                c.execute("DELETE FROM Mapping WHERE DetectorId IN (%s)" % placeholders,chunk)
+            c.executemany("INSERT INTO Mapping VALUES (?,?)",[(detId,pcaId) for detId,pcaId in moves.items() if pcaId != None])
+            self.refreshTagCompatibility(c,partitions=partitions)
+            self.commit(connection)
+            return codes.ok
+        except Exception as e:
+            self.rollback(connection)
+            return self.handleError(e,"error moving %d detectors" % len(moves))
+        finally:
+            self.release(connection)
 
     def unmapDetectorFromPCA(self,detId):
         """unmap a Detector from a Partition"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (detId,)
         try:
+            partitions = self.partitionsOfDetector(c,detId)
             c.execute("DELETE FROM Mapping WHERE DetectorId = ?", val)
-            connection.commit()
+            self.refreshTagCompatibility(c,partitions=partitions)
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error unmapping %s" % str(detId))
         finally:
-            connection.close()
+            self.release(connection)
 
     def usedPortsForAddress(self,address):
         """get all used Ports for an Ip-Address returns List of Ports or ErrorCode """
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (address,)
         try:
@@ -266,11 +540,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Ports for Address %s" % address)
         finally:
-            connection.close()
+            self.release(connection)
 
     def getGlobalSystem(self,id):
         """get global System for Id"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (id,)
         try:
@@ -281,11 +555,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Global System")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getAllGlobalSystems(self):
         """get all global systems"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             c.execute("SELECT * FROM GlobalSystems")
@@ -294,30 +568,15 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Global Systems")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getPcaCompatibleTags(self,pcaId):
         """get all tags for a pca which are compatible with the current Detector Assignment"""
-        connection = sqlite3.connect(self.dataBaseFile)
-        c = connection.cursor()
-        val = (pcaId,pcaId)
-        try:
-            res =c.execute("""
-            SELECT distinct tagname FROM ConfigurationTag as x WHERE
-              NOT EXISTS
-               (SELECT detectorId FROM
-            					  (SELECT detectorId FROM Partition join Mapping on Partition.id = Mapping.PartitionId WHERE partitionId = ?
-            						union
-            					  SELECT id FROM GlobalSystems)
-                WHERE detectorId NOT in (SELECT systemId FROM ConfigurationTag Join Configurations on ConfigurationTag.configId = Configurations.configId WHERE tagname=x.tagname))
-              and NOT EXISTS
-                (SELECT systemId FROM
-                      ConfigurationTag Join Configurations on ConfigurationTag.configId = Configurations.configId
-                 WHERE tagname=x.tagname and systemId NOT in
-                (SELECT detectorId FROM ( SELECT detectorId FROM Partition join Mapping on Partition.id = Mapping.PartitionId WHERE partitionId = ?
-                 union
-            	   SELECT id FROM GlobalSystems)))
-            """.replace("\n",""),val).fetchall()
+        connection = self.connect()
+        c = connection.cursor()
+        val = (pcaId,)
+        try:
+            res =c.execute(pcaCompatibleTagsQuery,val).fetchall()
             if not res:
                 return None
             #result elements have only one entry so no need for nestet arrays
@@ -325,11 +584,52 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting pca %s tags" % pcaId)
         finally:
-            connection.close()
+            self.release(connection)
+
+    def refreshTagCompatibility(self,cursor,partitions=None,tags=None):
+        """recalculate the compatibility of the given partitions and tags (all if both are None) after a change within the transaction of cursor"""
+        if partitions == None and tags == None:
+            cursor.execute("DELETE FROM TagCompatibility")
+            query,parameters = DataBaseMigrations.tagCompatibilitySelect()
+            cursor.execute("INSERT OR IGNORE INTO TagCompatibility "+query,parameters)
+            return
+        if partitions:
+            partitions = list(set(partitions))
+            cursor.execute("DELETE FROM TagCompatibility WHERE PartitionId IN (%s)" % ",".join("?"*len(partitions)),partitions)
+            query,parameters = DataBaseMigrations.tagCompatibilitySelect(partitions=partitions)
+            cursor.execute("INSERT OR IGNORE INTO TagCompatibility "+query,parameters)
+        if tags:
+            tags = list(set(tags))
+            cursor.execute("DELETE FROM TagCompatibility WHERE TagName IN (%s)" % ",".join("?"*len(tags)),tags)
+            query,parameters = DataBaseMigrations.tagCompatibilitySelect(tags=tags)
+            cursor.execute("INSERT OR IGNORE INTO TagCompatibility "+query,parameters)
+
+    def rebuildTagCompatibility(self):
+        """recalculate the whole compatibility table e.g. after the Global Systems were changed outside of the ECS"""
+        connection = self.connect()
+        c = connection.cursor()
+        try:
+            self.refreshTagCompatibility(c)
+            self.commit(connection)
+            return codes.ok
+        except Exception as e:
+            self.rollback(connection)
+            return self.handleError(e,"error rebuilding tag compatibility")
+        finally:
+            self.release(connection)
+
+    def partitionsOfDetector(self,cursor,detId):
+        return [row[0] for row in cursor.execute("SELECT PartitionId FROM Mapping WHERE DetectorId = ?",(detId,)).fetchall()]
+
+    def tagsOfConfig(self,cursor,configId):
+        return [row[0] for row in cursor.execute("SELECT DISTINCT TagName FROM ConfigurationTag WHERE configId = ?",(configId,)).fetchall()]
+
+    def tagsOfSystem(self,cursor,systemId):
+        return [row[0] for row in cursor.execute("SELECT DISTINCT TagName FROM ConfigurationTag JOIN Configurations ON ConfigurationTag.configId = Configurations.configId WHERE systemId = ?",(systemId,)).fetchall()]
 
     def getAllConfigTags(self):
         """gets all config tags"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             res = c.execute("SELECT distinct TagName FROM ConfigurationTag").fetchall()
@@ -339,11 +639,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting tags")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getConfigsForTag(self,tag):
         """get the subsystem configurations for a tag"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (tag,)
         try:
@@ -356,11 +656,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting configurations for tag %s" % tag)
         finally:
-            connection.close()
+            self.release(connection)
 
     def getConfigsForSystem(self,systemId):
         """get all possible Configurations for a System"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (systemId,)
         try:
@@ -373,11 +673,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting configurations for %s" % systemId)
         finally:
-            connection.close()
+            self.release(connection)
 
     def getConfigsForManySystems(self,systemList):
         """get all possible Configurations for a List of Systems"""
-        connection = sqlite3.connect("ECS_database.db")
+        connection = self.connect()
         c = connection.cursor()
         try:
             res =c.execute("SELECT * from Configurations where systemId in (%s)" % " ,".join(list(map(lambda x:"?",systemList))),systemList).fetchall()
@@ -389,18 +689,15 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Configurations")
         finally:
-            connection.close()
+            self.release(connection)
 
     def getConfigsForPCA(self,pcaId):
         """get all possible Configs for Partition Systems"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (pcaId,)
         try:
-            res =c.execute("""SELECT configid,detectorid,parameters FROM ((Partition Join Mapping on Partition.id = Mapping.PartitionId) join Detector on detectorId=Detector.id) left join Configurations on detectorid = Configurations.systemId  Where Partitionid=?
-                              union
-                              select configid,id,parameters FROM GlobalSystems left join Configurations on GlobalSystems.id = Configurations.systemId
-                           """.replace("\n",""),val).fetchall()
+            res =c.execute(configsForPCAQuery,val).fetchall()
             if not res:
                 return codes.idUnknown
             #parameters(res[2]) are stored as a json string in the database; there could be no config for a system
@@ -409,11 +706,11 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting Configurations for %s" % pcaId)
         finally:
-            connection.close()
+            self.release(connection)
 
     def getCustomConfig(self,configList):
         """get Configs for a list of ConfigIds"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         try:
             res =c.execute("SELECT * from Configurations where Configurations.configId in (%s)" % " ,".join(list(map(lambda x:"?",configList))),configList).fetchall()
@@ -423,64 +720,275 @@ class DataBaseWrapper:
         except Exception as e:
             return self.handleError(e,"error getting All Costum Configurations")
         finally:
-            connection.close()
+            self.release(connection)
 
     def saveConfigTag(self,tagName,configList):
         """saves the configList in the database under the name tagName"""
-        connection = sqlite3.connect(self.dataBaseFile)
-        c = connection.cursor()
-        try:
-            self.deleteConfigTag(tagName)
-            res =c.execute("INSERT INTO ConfigurationTag VALUES %s" % " ,".join(list(map(lambda x:"('%s',?)" % tagName,configList))),configList)
-            connection.commit()
-            return codes.ok
-        except Exception as e:
-            connection.rollback()
-            return self.handleError(e,"error saving config tag")
-        finally:
-            connection.close()
+        #replacing the old tag and inserting the new one is one transaction
+        with self.transaction() as connection:
+            c = connection.cursor()
+            try:
+                self.deleteConfigTag(tagName)
+                res =c.execute("INSERT INTO ConfigurationTag VALUES %s" % " ,".join(list(map(lambda x:"('%s',?)" % tagName,configList))),configList)
+                self.refreshTagCompatibility(c,tags=(tagName,))
+                return codes.ok
+            except Exception as e:
+                self.rollback(connection)
+                return self.handleError(e,"error saving config tag")
 
     def deleteConfigTag(self,tagName):
         """delete a configuration tag in the database"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (tagName,)
         try:
             res =c.execute("DELETE FROM ConfigurationTag WHERE ConfigurationTag.TagName=?",val)
-            connection.commit()
+            c.execute("DELETE FROM TagCompatibility WHERE TagName=?",val)
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error deleting configuration tag")
         finally:
-            connection.close()
+            self.release(connection)
 
     def saveConfig(self,configId,systemId,params):
         """save or alter a configuration in the database"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         vals = (configId,systemId,params)
         try:
             res =c.execute("INSERT OR REPLACE INTO Configurations VALUES (?,?,?)",vals)
-            connection.commit()
+            #the configuration might now belong to a different system
+            self.refreshTagCompatibility(c,tags=self.tagsOfConfig(c,configId))
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error saving configuration")
         finally:
-            connection.close()
+            self.release(connection)
 
     def deleteConfig(self,configId):
         """delete a configuration in the database"""
-        connection = sqlite3.connect(self.dataBaseFile)
+        connection = self.connect()
         c = connection.cursor()
         val = (configId,)
         try:
+            #trigger removes the tag entries of the configuration
+            tags = self.tagsOfConfig(c,configId)
             res =c.execute("DELETE FROM Configurations WHERE configId=?",val)
-            connection.commit()
+            self.refreshTagCompatibility(c,tags=tags)
+            self.commit(connection)
             return codes.ok
         except Exception as e:
-            connection.rollback()
+            self.rollback(connection)
             return self.handleError(e,"error deleting configuration")
         finally:
-            connection.close()
+            self.release(connection)
+
+class CachingDataBaseWrapper(DataBaseWrapper):
+    """DataBaseWrapper which keeps the results of frequent lookups in memory; the changing methods invalidate the affected entries
+    cached objects are shared by all callers and must not be modified"""
+    #cached lookups
+    cachedMethods = ("getPartition","getDetector","getDetectorsForPartition","getGlobalSystem","getPartitionForDetector","getAllPartitions","getAllUnmappedDetectors","getDetectorMapping")
+
+    def __init__(self,logfunction,maxEntries=100000):
+        super().__init__(logfunction)
+        #(method name,argument) -> result, least recently used first; arguments come from clients so the size is bounded
+        self.cache = OrderedDict()
+        self.maxEntries = maxEntries
+        #id of a cached result -> [result,encoded reply or None]
+        self.replies = {}
+        self.cacheLock = threading.Lock()
+        #incremented on every invalidation; results loaded during an invalidation are not stored
+        self.generation = 0
+        self.hits = dict((name,0) for name in self.cachedMethods)
+        self.misses = dict((name,0) for name in self.cachedMethods)
+        self.invalidations = 0
+        #invalidations within a transaction of a thread, repeated when it ends
+        self.local = threading.local()
+
+    def lookup(self,name,arg,load):
+        key = (name,arg)
+        with self.cacheLock:
+            if key in self.cache:
+                self.hits[name] += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+            self.misses[name] += 1
+            generation = self.generation
+        ret = load()
+        #don't cache errors and unknown ids(clients could ask for any number of them)
+        if isinstance(ret,Exception) or ret == codes.idUnknown:
+            return ret
+        with self.cacheLock:
+            if generation == self.generation:
+                self.cache[key] = ret
+                if isinstance(ret,DataObject) or isinstance(ret,DataObjectCollection):
+                    self.replies[id(ret)] = [ret,None]
+                while len(self.cache) > self.maxEntries:
+                    evicted = self.cache.popitem(last=False)[1]
+                    self.replies.pop(id(evicted),None)
+        return ret
+
+    def invalidate(self,keys=(),names=(),match=None):
+        """remove the given (method name,argument) keys, all entries of the given methods and all entries for which match(key,value) is True"""
+        with self.cacheLock:
+            self.generation += 1
+            self.invalidations += 1
+            remove = [key for key in keys if key in self.cache]
+            if names or match:
+                for key,value in self.cache.items():
+                    if key[0] in names or (match and match(key,value)):
+                        remove.append(key)
+            for key in remove:
+                value = self.cache.pop(key,None)
+                self.replies.pop(id(value),None)
+        pending = getattr(self.local,"pending",None)
+        if pending != None:
+            pending.append((keys,names,match))
+
+    def clearCache(self):
+        with self.cacheLock:
+            self.generation += 1
+            self.cache = OrderedDict()
+            self.replies = {}
+
+    @contextmanager
+    def transaction(self):
+        """other threads could cache values read before the commit; invalidate again after the transaction"""
+        if self.pool.inTransaction():
+            with super().transaction() as connection:
+                yield connection
+            return
+        self.local.pending = []
+        try:
+            with super().transaction() as connection:
+                yield connection
+        finally:
+            pending = self.local.pending
+            self.local.pending = None
+            for keys,names,match in pending:
+                self.invalidate(keys,names,match)
+
+    def jsonReply(self,dataObject):
+        """encoded replies of cached results are only created once"""
+        with self.cacheLock:
+            entry = self.replies.get(id(dataObject))
+            if entry and entry[0] is dataObject and entry[1] != None:
+                return entry[1]
+        reply = super().jsonReply(dataObject)
+        with self.cacheLock:
+            entry = self.replies.get(id(dataObject))
+            if entry and entry[0] is dataObject:
+                entry[1] = reply
+        return reply
+
+    def cacheStatistics(self):
+        """hits, misses and hit rate per cached method"""
+        with self.cacheLock:
+            statistics = {}
+            for name in self.cachedMethods:
+                hits = self.hits[name]
+                misses = self.misses[name]
+                statistics[name] = {"hits":hits, "misses":misses, "hitRate":hits/(hits+misses) if hits+misses else None}
+            statistics["entries"] = len(self.cache)
+            statistics["invalidations"] = self.invalidations
+            return statistics
+
+    #cached lookups
+    def getPartition(self,id):
+        return self.lookup("getPartition",id,lambda: super(CachingDataBaseWrapper,self).getPartition(id))
+
+    def getDetector(self,id):
+        return self.lookup("getDetector",id,lambda: super(CachingDataBaseWrapper,self).getDetector(id))
+
+    def getDetectorsForPartition(self,pcaId):
+        return self.lookup("getDetectorsForPartition",pcaId,lambda: super(CachingDataBaseWrapper,self).getDetectorsForPartition(pcaId))
+
+    def getGlobalSystem(self,id):
+        return self.lookup("getGlobalSystem",id,lambda: super(CachingDataBaseWrapper,self).getGlobalSystem(id))
+
+    def getPartitionForDetector(self,id):
+        return self.lookup("getPartitionForDetector",id,lambda: super(CachingDataBaseWrapper,self).getPartitionForDetector(id))
+
+    def getAllPartitions(self):
+        return self.lookup("getAllPartitions",None,lambda: super(CachingDataBaseWrapper,self).getAllPartitions())
+
+    def getAllUnmappedDetectors(self):
+        return self.lookup("getAllUnmappedDetectors",None,lambda: super(CachingDataBaseWrapper,self).getAllUnmappedDetectors())
+
+    def getDetectorMapping(self):
+        return self.lookup("getDetectorMapping",None,lambda: super(CachingDataBaseWrapper,self).getDetectorMapping())
+
+    #changes
+    def detectorListContains(self,detId):
+        """match for detector lists of partitions which contain a detector"""
+        def match(key,value):
+            return key[0] == "getDetectorsForPartition" and isinstance(value,DataObjectCollection) and any(d.id == detId for d in value)
+        return match
+
+    def detectorMappingChanged(self,detId,partitionIds):
+        """invalidate everything that depends on the partition of a detector"""
+        keys = [("getPartitionForDetector",detId)] + [("getDetectorsForPartition",p) for p in partitionIds]
+        self.invalidate(keys,("getAllUnmappedDetectors","getDetectorMapping"),self.detectorListContains(detId))
+
+    def addDetector(self,dataObject):
+        if not isinstance(dataObject,detectorDataObject):
+            dataObject = detectorDataObject(json.loads(dataObject))
+        ret = super().addDetector(dataObject)
+        if ret == codes.ok:
+            self.invalidate([("getDetector",dataObject.id),("getPartitionForDetector",dataObject.id)],("getAllUnmappedDetectors",))
+        return ret
+
+    def removeDetector(self,id):
+        ret = super().removeDetector(id)
+        if ret == codes.ok:
+            #triggers remove the mapping of the detector
+            self.invalidate([("getDetector",id)])
+            self.detectorMappingChanged(id,())
+        return ret
+
+    def addPartition(self,dataObject):
+        ret = super().addPartition(dataObject)
+        if ret == codes.ok:
+            self.invalidate([("getPartition",dataObject.id),("getDetectorsForPartition",dataObject.id)],("getAllPartitions",))
+        return ret
+
+    def removePartition(self,id):
+        ret = super().removePartition(id)
+        if ret == codes.ok:
+            #detectors of the partition are unmapped
+            def match(key,value):
+                return key[0] == "getPartitionForDetector" and isinstance(value,partitionDataObject) and value.id == id
+            self.invalidate([("getPartition",id),("getDetectorsForPartition",id)],("getAllPartitions","getAllUnmappedDetectors","getDetectorMapping"),match)
+        return ret
+
+    def mapDetectorToPCA(self,detId,pcaId):
+        ret = super().mapDetectorToPCA(detId,pcaId)
+        if ret == codes.ok:
+            self.detectorMappingChanged(detId,(pcaId,))
+        return ret
+
+    def remapDetector(self,detId,newPcaId,oldPcaID):
+        ret = super().remapDetector(detId,newPcaId,oldPcaID)
+        if ret == codes.ok:
+            self.detectorMappingChanged(detId,(newPcaId,oldPcaID))
+        return ret
+
+    def moveDetectors(self,moves):
+        ret = super().moveDetectors(moves)
+        if ret == codes.ok:
+            detIds = set(moves)
+            def match(key,value):
+                return key[0] == "getDetectorsForPartition" and isinstance(value,DataObjectCollection) and any(d.id in detIds for d in value)
+            keys = [("getPartitionForDetector",detId) for detId in detIds] + [("getDetectorsForPartition",pcaId) for pcaId in set(moves.values()) if pcaId != None]
+            self.invalidate(keys,("getAllUnmappedDetectors","getDetectorMapping"),match)
+        return ret
+
+    def unmapDetectorFromPCA(self,detId):
+        ret = super().unmapDetectorFromPCA(detId)
+        if ret == codes.ok:
+            self.detectorMappingChanged(detId,())
+        return ret
@@ -1,5 +1,6 @@
 
 import json
+from sys import intern
 
 class DataObjectCollection:
     """class for storing a list of several database entrys"""
@@ -48,42 +49,57 @@ class DataObjectCollection:
         return self.dataArray[index]
 
 class DataObject:
-    """Base class for data objects"""
+    """Base class for data objects; subclasses list their fields in fields (in database column order) and in __slots__"""
+    __slots__ = ()
+    fields = ()
+
     def asArray(self):
         """returns data in an array"""
-        ret = []
-        for k,v in self.__dict__.items():
-            ret.append(v)
-        return ret
+        return [getattr(self,field) for field in self.fields]
 
     def asJsonString(self):
         """returns data as an json string"""
-        return json.dumps(self.__dict__)
+        return json.dumps(self.asJson())
 
     def asJson(self):
         """returns data as a dictionary"""
-        return self.__dict__
+        return {field:getattr(self,field) for field in self.fields}
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.asJson())
+
+class CachedDataObject(DataObject):
+    """data object which caches its json string; treat it as immutable (create a new one for new data)"""
+    __slots__ = ("jsonString",)
 
-class detectorDataObject(DataObject):
+    def asJsonString(self):
+        if self.jsonString == None:
+            self.jsonString = json.dumps(self.asJson())
+        return self.jsonString
+
+class detectorDataObject(CachedDataObject):
     """class for storing a detector database entry"""
+    fields = ("id","address","type","portCommand")
+    __slots__ = fields
     def __init__(self,queryResult):
+        self.jsonString = None
         if isinstance(queryResult,dict):
             self.id = queryResult["id"]
             self.address = queryResult["address"]
-            self.type = queryResult["type"]
+            self.type = intern(queryResult["type"])
             self.portCommand = queryResult["portCommand"]
         else:
             self.id = queryResult[0]
             self.address = queryResult[1]
-            self.type = queryResult[2]
+            self.type = intern(queryResult[2])
             self.portCommand = queryResult[3]
 
-class partitionDataObject(DataObject):
+class partitionDataObject(CachedDataObject):
     """class for storing a Partition database entry"""
+    fields = ("id","address","portPublish","portLog","portUpdates","portCurrentState","portCommand")
+    __slots__ = fields
     def __init__(self,queryResult):
+        self.jsonString = None
         if isinstance(queryResult,dict):
             self.id = queryResult["id"]
             self.address = queryResult["address"]
@@ -102,6 +118,8 @@ class partitionDataObject(DataObject):
             self.portCommand = queryResult[6]
 
 class mappingDataObject(DataObject):
+    fields = ("detectorId","partitionId")
+    __slots__ = fields
     def __init__(self,queryResult):
         if isinstance(queryResult,dict):
             self.detectorId = queryResult["detectorId"]
@@ -111,6 +129,8 @@ class mappingDataObject(DataObject):
             self.partitionId = queryResult[1]
 
 class globalSystemDataObject(DataObject):
+    fields = ("id","address","portCommand")
+    __slots__ = fields
     def __init__(self,queryResult):
         if isinstance(queryResult,dict):
             self.id = queryResult["id"]
@@ -122,34 +142,55 @@ class globalSystemDataObject(DataObject):
             self.portCommand = queryResult[2]
 
 
+def internState(value):
+    """state names repeat in every stateObject; keep one string object of each"""
+    if value.__class__ is str:
+        return intern(value)
+    return value
+
 class stateObject(DataObject):
+    """state of a system; treat it as immutable (create a new one for a new state) since the json string is cached"""
+    __slots__ = ("state","unmappedState","configTag","comment","jsonString")
+
+    def asArray(self):
+        return [self.state,self.unmappedState,self.configTag,self.comment]
+
+    def asJson(self):
+        return {"state":self.state, "unmappedState":self.unmappedState, "configTag":self.configTag, "comment":self.comment}
+
     def asJsonString(self):
-        return json.dumps(self.asJson())
+        if self.jsonString == None:
+            self.jsonString = json.dumps(self.asJson())
+        return self.jsonString
 
     def __init__(self,data):
         self.unmappedState = None
         self.configTag = None
         self.comment = None
+        self.jsonString = None
         if isinstance(data,dict):
             #from json
-            self.state = data["state"]
+            self.state = internState(data["state"])
             if len(data) > 1:
-                self.unmappedState = data["unmappedState"]
+                self.unmappedState = internState(data["unmappedState"])
                 self.configTag = data["configTag"]
                 self.comment = data["comment"]
         elif isinstance(data,list):
-            self.state = data[0]
-            self.unmappedState = data[1]
+            self.state = internState(data[0])
+            self.unmappedState = internState(data[1])
             if len(data) > 2:
                 self.configTag = data[2]
                 self.comment = data[3]
         elif isinstance(data,str):
-            self.state = data
+            self.state = internState(data)
         else:
             raise TypeError("Expected dictionary or list")
 
-class configObject(DataObject):
+class configObject(CachedDataObject):
+    fields = ("configId","systemId","parameters")
+    __slots__ = fields
     def __init__(self,queryResult):
+        self.jsonString = None
         if isinstance(queryResult,dict):
             self.configId = queryResult["configId"]
             self.systemId = queryResult["systemId"]
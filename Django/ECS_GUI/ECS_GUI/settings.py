@@ -139,6 +139,18 @@ PINGINTERVAL = 2
 TIMEOUT = 2000
 #timeout for Pings to PCA in ms
 PINGTIMEOUT = 2000
+#number of zmq I/O threads of the ECA process
+ZMQ_IO_THREADS = 1
+#number of threads answering requests to the ECA
+ECA_REQUEST_WORKERS = 8
+#number of threads sending messages to many clients at once e.g. when moving detectors
+ECA_FANOUT_WORKERS = 32
+#number of threads running ssh commands for starting, stopping and checking clients
+SSH_WORKERS = 32
+#commands running at once over the ssh connection to one host (sshd allows 10 sessions per connection by default)
+SSH_SESSIONS_PER_HOST = 8
+#timeout for ssh commands in seconds
+SSH_TIMEOUT = 20
 
 #address and port for ECS
 ECS_ADDRESS = "localhost"
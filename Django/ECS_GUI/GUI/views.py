@@ -235,12 +235,10 @@ class delete_pca(ecsMixin,ecsPermissionMixin,TemplateView):
                 self.forceDelete = True
             #unmap detectors
             self.failedDetectors = False
-            for d in detectors:
-                ret = eca.moveDetector(d.id,"unmapped",self.forceDelete)
-                if ret != True:
-                    if not self.failedDetectors:
-                        self.failedDetectors = {}
-                    self.failedDetectors[d.id] = ret
+            #all detectors are unmapped or none
+            ret = eca.moveDetectors([d.id for d in detectors],"unmapped",self.forceDelete)
+            if ret != True:
+                self.failedDetectors = dict((d.id,ret) for d in detectors)
             if self.failedDetectors:
                 if not self.failedPartitions:
                     self.failedPartitions = {}
@@ -296,12 +294,10 @@ class moveDetectors(ecsMixin,ecsPermissionMixin,TemplateView):
             if "forceMove" in request.POST:
                 self.forceMove = True
             self.failedDetectors = False
-            for dId in detectors:
-                ret = eca.moveDetector(dId,self.toPcaId,self.forceMove)
-                if ret != True:
-                    if not self.failedDetectors:
-                        self.failedDetectors = {}
-                    self.failedDetectors[dId] = ret
+            #all detectors are moved or none
+            ret = eca.moveDetectors(detectors,self.toPcaId,self.forceMove)
+            if ret != True:
+                self.failedDetectors = dict((dId,ret) for dId in detectors)
             if self.failedDetectors:
                 return self.get(request, *args, **kwargs)
             return HttpResponseRedirect('/')
@@ -409,15 +405,16 @@ class clientPage(ecsMixin,ecsPermissionMixin,TemplateView):
     raise_exception = True
 
     def get(self, request, *args, **kwargs):
-        self.pcas = {}
-        self.detectors = {}
-        for pca in eca.pcaHandlers.items():
-            self.pcas[pca[0]] = eca.checkIfRunning(eca.partitions[pca[0]])
-            for d in eca.database.getDetectorsForPartition(pca[0]):
-                self.detectors[d.id] = eca.checkIfRunning(d)
-        self.globalSystems = {}
-        for gs in eca.globalSystems.items():
-            self.globalSystems[gs[0]] = eca.checkIfRunning(eca.globalSystems[gs[0]])
+        pcas = [eca.partitions[pcaId] for pcaId in eca.pcaHandlers.keys()]
+        detectors = []
+        for pca in pcas:
+            detectors.extend(eca.database.getDetectorsForPartition(pca.id))
+        globalSystems = list(eca.globalSystems.values())
+        #check all clients at once
+        pids = eca.forClients(eca.checkIfRunning,pcas+detectors+globalSystems)
+        self.pcas = dict(zip([pca.id for pca in pcas],pids[:len(pcas)]))
+        self.detectors = dict(zip([d.id for d in detectors],pids[len(pcas):len(pcas)+len(detectors)]))
+        self.globalSystems = dict(zip([gs.id for gs in globalSystems],pids[len(pcas)+len(detectors):]))
         return super().get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
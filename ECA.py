@@ -10,7 +10,7 @@ from multiprocessing import Queue
 import time
 import ECS_tools
 from datetime import datetime
-import paramiko
+from SSHPool import SSHPool
 from  UnmappedDetectorController import UnmappedDetectorController
 from GUI.models import pcaModel, ecsModel
 from django.conf import settings
@@ -21,14 +21,14 @@ import asyncio
 import signal
 from states import PCAStates
 PCAStates = PCAStates()
-from DataBaseWrapper import DataBaseWrapper
+from DataBaseWrapper import CachingDataBaseWrapper
 from WebSocket import WebSocket
 
 class ECA:
     """The Experiment Control Agent"""
     def __init__(self):
         #data stuff
-        self.database = DataBaseWrapper(self.log)
+        self.database = CachingDataBaseWrapper(self.log)
         self.partitions = ECS_tools.MapWrapper()
         self.disconnectedDetectors = ECS_tools.MapWrapper()
         self.stateMap = ECS_tools.MapWrapper()
@@ -46,22 +46,30 @@ class ECA:
         self.globalSystemFileName = settings.GLOBALSYSTEM_CODE_FILE
         self.checkIfRunningScript = settings.CHECK_IF_RUNNING_SCRIPT
         self.virtenvFile =  settings.PYTHON_VIRTENV_ACTIVATE_FILE
+        self.sshTimeout = settings.SSH_TIMEOUT
 
-        #zmq context with timeouts
-        self.zmqContext = zmq.Context()
-        self.zmqContext.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-        self.zmqContext.setsockopt(zmq.LINGER,0)
+        #one ssh connection per client computer shared by all commands and a pool for running them in parallel
+        self.ssh = SSHPool(settings.SSH_SESSIONS_PER_HOST)
+        self.sshFanOut = ECS_tools.FanOutPool(settings.SSH_WORKERS,"ssh")
+        #pool for sending a message to many clients at once
+        self.fanOut = ECS_tools.FanOutPool(settings.ECA_FANOUT_WORKERS,"fanout")
 
-        #zmq context without timeouts
-        self.zmqContextNoTimeout = zmq.Context()
-        self.zmqContextNoTimeout.setsockopt(zmq.LINGER,0)
+        #one zmq context for the ECA, the PCAHandlers and the UnmappedDetectorController
+        ECS_tools.getContext(settings.ZMQ_IO_THREADS)
+        #sockets with timeouts
+        self.sockets = ECS_tools.SocketFactory({zmq.RCVTIMEO:self.receive_timeout, zmq.LINGER:0})
 
-        #socket for receiving requests
-        self.replySocket = self.zmqContextNoTimeout.socket(zmq.REP)
+        #sockets without timeouts
+        self.socketsNoTimeout = ECS_tools.SocketFactory({zmq.LINGER:0})
+
+        #socket for receiving requests; a ROUTER socket is wire compatible with the REQ sockets of the clients
+        self.replySocket = self.socketsNoTimeout.socket(zmq.ROUTER)
         self.replySocket.bind("tcp://*:%s" % settings.ECA_REQUEST_PORT)
+        #requests are answered by a pool of worker threads
+        self.requestBroker = ECS_tools.RequestBroker(self.replySocket,self.handleRequest,settings.ECA_REQUEST_WORKERS,self.socketsNoTimeout,self.log)
 
         #log publish socket
-        self.socketLogPublish = self.zmqContext.socket(zmq.PUB)
+        self.socketLogPublish = self.sockets.socket(zmq.PUB)
         self.socketLogPublish.bind("tcp://*:%s" % settings.ECA_LOG_PORT)
 
         #init logger
@@ -125,8 +133,10 @@ class ECA:
             self.partitions[p.id] = p
         #start PCA clients via ssh
         if settings.START_CLIENTS:
-            for p in self.partitions:
-                ret = self.startClient(p)
+            pids = self.startClients(list(self.partitions))
+            for id,pid in pids.items():
+                if not pid:
+                    self.log("PCA Client for %s could not be startet" % id,True)
 
         #clear permissions in database from previous runs
         pcaModel.objects.all().delete()
@@ -180,23 +190,14 @@ class ECA:
         id = clientObject.id
         address = clientObject.address
         fileName = self.checkIfRunningScript
-        ssh = None
         try:
-            ssh = paramiko.SSHClient()
-            ssh.load_system_host_keys()
-            #login on pca computer needs a rsa key
-            ssh.connect(address)
             #python script returns -1 if not running or the pid otherwise
-            stdin, stdout, stderr = ssh.exec_command("pid=$(cd %s;source %s; python %s %s); echo $pid" % (path,self.virtenvFile,fileName,id))
-            pid = stdout.readline()
-            pid = pid.strip()
-            ssh.close()
-            if pid == "-1":
+            returnValue, output = self.ssh.run(address,"pid=$(cd %s;source %s; python %s %s); echo $pid" % (path,self.virtenvFile,fileName,id),self.sshTimeout)
+            pid = output.strip()
+            if pid == "-1" or not pid:
                 return False
             return pid
         except Exception as e:
-            if ssh:
-                ssh.close()
             self.log("Exception executing ssh command: %s" % str(e))
             return False
 
@@ -215,25 +216,16 @@ class ECA:
             raise Exception("Expected detector, partition or globalSystem Object but got %s" % type(clientObject))
         id = clientObject.id
         address = clientObject.address
-        ssh = None
         try:
             pid = self.checkIfRunning(clientObject)
             if not pid:
-                ssh = paramiko.SSHClient()
-                ssh.load_system_host_keys()
-                #login on pca computer needs a rsa key
-                ssh.connect(address)
-                #start Client and get its pid
-                stdin, stdout, stderr = ssh.exec_command("cd %s;source %s;python %s %s > /dev/null & echo $!" % (path,self.virtenvFile,fileName,id))
-                pid = stdout.readline()
-                pid = pid.strip()
-                ssh.close()
+                #start Client and get its pid; all output of the client is redirected so that the ssh session ends right away
+                returnValue, output = self.ssh.run(address,"cd %s;source %s;nohup python %s %s > /dev/null 2>&1 & echo $!" % (path,self.virtenvFile,fileName,id),self.sshTimeout)
+                pid = output.strip()
             else:
                 self.log("Client %s is already Running with PID %s" % (id,pid))
             return pid
         except Exception as e:
-            if ssh:
-                ssh.close()
             self.log("Exception executing ssh command: %s" % str(e))
             return False
 
@@ -247,62 +239,48 @@ class ECA:
         if not pid:
             self.log("tried to stop %s Client but it wasn't running" % id)
             return True
-        ssh = None
         try:
-            ssh = paramiko.SSHClient()
-            ssh.load_system_host_keys()
-            ssh.connect(address)
-            stdin, stdout, stderr = ssh.exec_command("kill %s" % (pid,))
-            returnValue = stdout.channel.recv_exit_status()
-            ssh.close()
+            returnValue, output = self.ssh.run(address,"kill %s" % (pid,),self.sshTimeout)
             if returnValue == 0:
                 return True
             else:
                 self.log("error stopping Client for %s" % id)
                 return False
         except Exception as e:
-            if ssh:
-                ssh.close()
             self.log("Exception executing ssh command: %s" % str(e))
             return False
 
+    def forClients(self,function,clientObjects):
+        """call function for a list of clients in parallel; returns the return values in the order of the clients (False on timeout)"""
+        calls = [(i,lambda c=c: function(c)) for i,c in enumerate(clientObjects)]
+        #commands are queued per host, the timeout covers a full queue on one host
+        queued = len(calls)//self.ssh.maxPerHost + 1
+        report = self.sshFanOut.run(calls,self.sshTimeout*2*queued)
+        for i in report.timeouts:
+            self.log("ssh command for Client %s timed out" % clientObjects[i].id)
+        return [report.results.get(i,False) for i in range(len(clientObjects))]
+
+    def checkClientsRunning(self,clientObjects):
+        """pids of running clients for a list of clients {id:pid or False}"""
+        return dict(zip([c.id for c in clientObjects],self.forClients(self.checkIfRunning,clientObjects)))
+
+    def startClients(self,clientObjects):
+        """start a list of clients; returns {id:pid or False}"""
+        return dict(zip([c.id for c in clientObjects],self.forClients(self.startClient,clientObjects)))
+
+    def stopClients(self,clientObjects):
+        """stop a list of clients; returns {id:True if stopped}"""
+        return dict(zip([c.id for c in clientObjects],self.forClients(self.stopClient,clientObjects)))
+
     def createPartition(self,partition):
         """ Create a new Partition and start it's PCA Client"""
         ret = self.database.addPartition(partition)
         if ret == codes.ok:
-            #inform GlobalSystems
-            informedSystems = []
-            for gsID in self.globalSystems:
-                try:
-                    gs = self.globalSystems[gsID]
-                    requestSocket = self.zmqContext.socket(zmq.REQ)
-                    requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                    requestSocket.send_multipart([codes.addPartition,partition.asJsonString().encode()])
-                    ret = requestSocket.recv()
-                    if ret != codes.ok:
-                        raise Exception("Global System returned ErrorCode")
-                    informedSystems.append(gsID)
-                except Exception as e:
-                    #start rollback(tell all informed Global Systems to remove the new partition)
-                    ret = self.database.removePartition(partition.id)
-                    requestSocket.close()
-                    for gsIDRolback in informedSystems:
-                        gs = self.globalSystems[gsIDRolback]
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                        requestSocket.send_multipart([codes.deletePartition,partition.id.encode()])
-                        ret = requestSocket.recv()
-                        if ret != codes.ok:
-                            raise Exception("Global System returned ErrorCode during rollback")
-                    if isinstance(e,zmq.Again):
-                        self.log("timeout informing Global System %s" % (gsID),True)
-                        return "timeout informing Global System %s" % (gsID)
-                    else:
-                        self.log("error informing Global System %s: %s" % (gsID),str(e),True)
-                        return "error informing Global System %s: %s " % (gsID,str(e))
-                finally:
-                    requestSocket.close()
-
+            #inform all GlobalSystems at once; the ones which added the partition remove it again if one fails
+            error = self.informGlobalSystems(self.globalSystemCommit(),[codes.addPartition,partition.asJsonString().encode()],[codes.deletePartition,partition.id.encode()])
+            if error:
+                self.database.removePartition(partition.id)
+                return error
 
             #start PCA if Not Running
             if settings.START_CLIENTS:
@@ -341,40 +319,11 @@ class ECA:
             if isinstance(ret,Exception):
                 return str(ret)
 
-            #inform Global Systems
-            informedSystems=[]
-            for gsID in self.globalSystems:
-                try:
-                    gs = self.globalSystems[gsID]
-                    requestSocket = self.zmqContext.socket(zmq.REQ)
-                    requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                    requestSocket.send_multipart([codes.deletePartition,partition.id.encode()])
-                    ret = requestSocket.recv()
-                    if ret != codes.ok:
-                        raise Exception("Global System returned ErrorCode")
-                    informedSystems.append(gsID)
-                except Exception as e:
-                    #start rollback
-                    self.database.addPartition(partition)
-                    requestSocket.close()
-                    for gsIDRolback in informedSystems:
-                        gs = self.globalSystems[gsIDRolback]
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                        requestSocket.send_multipart([codes.addPartition,partition.asJsonString().encode()])
-                        ret = requestSocket.recv()
-                        if ret != codes.ok:
-                            raise Exception("Global System returned ErrorCode during rollback")
-                    if isinstance(e,zmq.Again):
-                        self.log("timeout informing Global System %s" % (gsID),True)
-                        if not forceDelete:
-                            return "timeout informing Global System %s" % (gsID)
-                    else:
-                        self.log("error informing Global System %s: %s" % (gsID),str(e),True)
-                        if not forceDelete:
-                            return "error informing Global System %s: %s " % (gsID,str(e))
-                finally:
-                    requestSocket.close()
+            #inform all Global Systems at once; with forceDelete the partition is deleted even if some of them fail
+            error = self.informGlobalSystems(self.globalSystemCommit(),[codes.deletePartition,partition.id.encode()],[codes.addPartition,partition.asJsonString().encode()],not forceDelete)
+            if error and not forceDelete:
+                self.database.addPartition(partition)
+                return error
             #try to stop pca Client
             self.stopClient(partition)
             #remove from Maps
@@ -451,310 +400,282 @@ class ECA:
         }
         return ret
 
+    def sendCommand(self,system,message):
+        """send a command to the command port of a PCA, Detector or Global System and return the reply; raises zmq.Again on timeout"""
+        requestSocket = self.sockets.socket(zmq.REQ)
+        try:
+            requestSocket.connect("tcp://%s:%s"  % (system.address,system.portCommand))
+            requestSocket.send_multipart(message)
+            return requestSocket.recv()
+        finally:
+            requestSocket.close()
+
+    def commandSystem(self,system,message,action):
+        """send a command to a PCA or Global System; raises an Exception unless it returns codes.ok"""
+        try:
+            ret = self.sendCommand(system,message)
+        except zmq.Again:
+            self.log("timeout %s %s" % (action,system.id),True)
+            raise Exception("timeout %s %s" % (action,system.id))
+        if ret == codes.busy:
+            self.log("%s is not in Idle State" % (system.id),True)
+            raise Exception("%s is not in Idle State" % (system.id))
+        elif ret != codes.ok:
+            self.log("%s returned error for %s" % (system.id,action),True)
+            raise Exception("error %s %s" % (action,system.id))
+
+    def informDetectors(self,assignments):
+        """send the new Partition to a list of (detector,partition) in parallel; returns a FanOutReport"""
+        def inform(detector,partition):
+            ret = self.sendCommand(detector,[codes.detectorChangePartition,partition.asJsonString().encode()])
+            if ret != codes.ok:
+                self.log("%s returned error for changing PCA" % (detector.id),True)
+                return False
+            return True
+        calls = [(d.id,lambda d=d,p=p: inform(d,p)) for d,p in assignments]
+        #every call waits at most receive_timeout
+        return self.fanOut.run(calls,self.fanOut.timeoutFor(len(calls),self.receive_timeout/1000)+1)
+
+    def globalSystemCommit(self):
+        """coordinator for a change on all Global Systems; they share one deadline"""
+        return ECS_tools.TwoPhaseCommit(self.fanOut,self.receive_timeout/1000+1,self.log)
+
+    def informGlobalSystems(self,commit,message,undoMessage,rollbackOnFailure=True):
+        """send message to all Global Systems in parallel; undoMessage reverts it on the ones which accepted it on a rollback of commit
+        returns None on success or an error message"""
+        def send(message):
+            return lambda gs: self.sendCommand(gs,message) == codes.ok
+        report = commit.run(dict(self.globalSystems),send(message),send(undoMessage),rollbackOnFailure)
+        errors = []
+        for gsID in report.failures+report.timeouts:
+            error = report.errors.get(gsID)
+            if error == None and gsID in report.failures:
+                errors.append("Global System %s returned ErrorCode" % gsID)
+            elif error == None or isinstance(error,zmq.Again):
+                errors.append("timeout informing Global System %s" % gsID)
+            else:
+                errors.append("error informing Global System %s: %s" % (gsID,str(error)))
+        for error in errors:
+            self.log(error,True)
+        if errors:
+            return "; ".join(errors)
+        return None
+
+    def unlockPartitions(self,partitions):
+        for p in partitions:
+            try:
+                self.commandSystem(p,[codes.unlock],"unlocking Partition")
+            except Exception as e:
+                self.log("error unlocking Partition %s: %s " % (p.id,str(e)),True)
+
     def moveDetector(self,detectorId,partitionId,forceMove=False):
         """moves a Detector between Partitions"""
-        removed = False
-        added = False
-        dbChanged = False
-        #is not assigned to any partition(unmapped)
-        unused = False
-        informedSystems=[]
+        return self.moveDetectors([detectorId],partitionId,forceMove)
 
-        skipUnmap = False
-        skipAdd = False
-
-        oldPartition = self.database.getPartitionForDetector(detectorId)
-        if oldPartition == codes.idUnknown:
-            unused = True
-        else:
-            if not self.pcaHandlers[oldPartition.id].PCAConnection:
-                #skip informing PCA if its not connected and forceMove is True
-                if forceMove:
-                    skipUnmap = True
-                else:
-                    return "Partition %s is not connected" % oldPartition.id
+    def moveDetectors(self,detectorIds,partitionId,forceMove=False):
+        """moves a list of Detectors to a Partition ("unmapped" to unmap them) as one unit; returns True or an error message"""
+        detectorIds = list(dict.fromkeys(detectorIds))
+        detectors = self.database.getDetectorsForIds(detectorIds)
+        if isinstance(detectors,Exception):
+            return str(detectors)
+        detectors = dict((d.id,d) for d in detectors)
+        for id in detectorIds:
+            if id not in detectors:
+                return "Detector %s is not in Database" % id
+        oldPartitions = self.database.getPartitionsForDetectors(detectorIds)
+        if isinstance(oldPartitions,Exception):
+            return str(oldPartitions)
         if partitionId == "unmapped":
-            #detector will be unmapped
+            #detectors will be unmapped
             newPartition = False
+            newPcaId = None
         else:
-            if not self.pcaHandlers[partitionId].PCAConnection:
-                if forceMove:
-                    skipAdd = True
-                else:
-                    return "Partition %s is not connected" % partitionId
             newPartition = self.partitions[partitionId]
+            if not newPartition:
+                return "Partition %s is not in Database" % partitionId
+            newPcaId = newPartition.id
+
+        #detectors for each old partition; None for unmapped detectors
+        removals = {}
+        partitionObjects = {None:self.unmappedDetectorControllerData}
+        for id in detectorIds:
+            oldPcaId = oldPartitions[id].id if id in oldPartitions else None
+            if oldPcaId == newPcaId:
+                continue
+            removals.setdefault(oldPcaId,[]).append(detectors[id])
+            if oldPcaId not in partitionObjects:
+                partitionObjects[oldPcaId] = self.partitions[oldPcaId] or oldPartitions[id]
+        if not removals:
+            return True
+        moved = [d for ds in removals.values() for d in ds]
+        moves = dict((d.id,newPcaId) for d in moved)
+        oldMapping = dict((d.id,oldPcaId) for oldPcaId,ds in removals.items() for d in ds)
+
+        partitionsToChange = [partitionObjects[pcaId] for pcaId in removals if pcaId != None]
+        if newPartition:
+            partitionsToChange.append(newPartition)
+        #skip informing PCAs which are not connected if forceMove is True
+        skipped = set()
+        for p in partitionsToChange:
+            handler = self.pcaHandlers.get(p.id)
+            if not handler or not handler.PCAConnection:
+                if not forceMove:
+                    return "Partition %s is not connected" % p.id
+                skipped.add(p.id)
+        partitionsToChange = [p for p in partitionsToChange if p.id not in skipped]
 
+        dbChanged = False
+        lockedPartitions = []
+        removedFrom = []
+        added = False
+        globalSystemCommit = self.globalSystemCommit()
+        informedDetectors = []
         try:
-            lockedPartitions = []
-            detector = self.database.getDetector(detectorId)
-            #change Database
-            if unused:
-                if self.database.mapDetectorToPCA(detectorId,newPartition.id) != codes.ok:
-                    raise Exception("Error during changing Database")
-            elif not newPartition:
-                if self.database.unmapDetectorFromPCA(detectorId) != codes.ok:
-                    raise Exception("Error during changing Database")
-            else:
-                if self.database.remapDetector(detectorId,newPartition.id,oldPartition.id) != codes.ok:
-                    raise Exception("Error during changing Database")
+            #change Database in one transaction
+            if self.database.moveDetectors(moves) != codes.ok:
+                raise Exception("Error during changing Database")
             dbChanged = True
 
-            #lock partitions(PCAs don't accept commands while locked)
-            partitionsToLock = []
-            if not unused:
-                partitionsToLock.append(oldPartition)
-            if newPartition:
-                partitionsToLock.append(newPartition)
-            for p in partitionsToLock:
-                try:
-                    requestSocket = self.zmqContext.socket(zmq.REQ)
-                    requestSocket.connect("tcp://%s:%s"  % (p.address,p.portCommand))
-                    requestSocket.send_multipart([codes.lock])
-                    ret = requestSocket.recv()
-                    if ret != codes.ok:
-                        self.log("%s returned error for locking Partition" % (p.id),True)
-                        raise Exception("%s returned error for locking Partition" % (p.id))
-                    lockedPartitions.append(p)
-                except zmq.Again:
-                    self.log("timeout locking Partition %s" % (p.id),True)
-                    raise Exception("timeout locking Partition %s" % (p.id))
-                except Exception as e:
-                    self.log("error locking Partition %s: %s " % (p.id,str(e)),True)
-                    raise Exception("error locking Partition %s: %s " % (p.id,str(e)))
-                finally:
-                    requestSocket.close()
-
-            if not unused:
-                if not skipUnmap:
-                    #remove from Old Partition
-                    try:
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (oldPartition.address,oldPartition.portCommand))
-                        requestSocket.send_multipart([codes.removeDetector,detectorId.encode()])
-                        ret = requestSocket.recv()
-                        if ret == codes.busy:
-                            self.log("%s is not in Idle State" % (oldPartition.id),True)
-                            raise Exception("%s is not in Idle State" % (oldPartition.id))
-                        elif ret != codes.ok:
-                            self.log("%s returned error for removing Detector" % (oldPartition.id),True)
-                            raise Exception("%s returned error for removing Detector" % (oldPartition.id))
-                    except zmq.Again:
-                        self.log("timeout removing Detector from %s" % (oldPartition.id),True)
-                        raise Exception("timeout removing Detector from %s" % (oldPartition.id))
-                    except Exception as e:
-                        self.log("error removing Detector from %s: %s " % (oldPartition.id,str(e)),True)
-                        raise Exception("error removing Detector from %s: %s " % (oldPartition.id,str(e)))
-                    finally:
-                        requestSocket.close()
-            else:
-                #remove from Unused Detectors
-                self.unmappedDetectorController.removeDetector(detectorId)
-            removed = True
-
-            if newPartition:
-                if not skipAdd:
-                    try:
-                        #add to new Partition
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (newPartition.address,newPartition.portCommand))
-                        requestSocket.send_multipart([codes.addDetector,detector.asJsonString().encode()])
-                        ret = requestSocket.recv()
-                        if ret == codes.busy:
-                            self.log("%s is not in Idle State" % (newPartition.id),True)
-                            raise Exception("%s is not in Idle State" % (newPartition.id))
-                        elif ret != codes.ok:
-                            self.log("%s returned error for adding Detector" % (newPartition.id),True)
-                            raise Exception("%s returned error for adding Detector" % (newPartition.id))
-                    except zmq.Again:
-                        self.log("timeout adding Detector to %s" % (newPartition.id),True)
-                        raise Exception("timeout adding Detector to %s" % (newPartition.id))
-                    except Exception as e:
-                        self.log("error adding Detector to %s: %s " % (newPartition.id,str(e)),True)
-                        raise Exception("error adding Detector to %s: %s " % (newPartition.id,str(e)))
-                    finally:
-                        requestSocket.close()
-            else:
-                #add to unused detectors
-                self.unmappedDetectorController.addDetector(detector)
+            #lock every partition once (PCAs don't accept commands while locked)
+            for p in partitionsToChange:
+                self.commandSystem(p,[codes.lock],"locking Partition")
+                lockedPartitions.append(p)
+
+            #remove from old partitions
+            for oldPcaId,ds in removals.items():
+                if oldPcaId == None:
+                    for d in ds:
+                        self.unmappedDetectorController.removeDetector(d.id)
+                elif oldPcaId not in skipped:
+                    self.commandSystem(partitionObjects[oldPcaId],[codes.removeDetectors,json.dumps([d.id for d in ds]).encode()],"removing Detectors from")
+                removedFrom.append(oldPcaId)
+
+            #add to new partition
+            if not newPartition:
+                for d in moved:
+                    self.unmappedDetectorController.addDetector(d)
+            elif newPcaId not in skipped:
+                self.commandSystem(newPartition,[codes.addDetectors,json.dumps([d.asJson() for d in moved]).encode()],"adding Detectors to")
             added = True
 
-            #inform GlobalSystems
-            for gsID in self.globalSystems:
-                try:
-                    gs = self.globalSystems[gsID]
-                    requestSocket = self.zmqContext.socket(zmq.REQ)
-                    requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                    if newPartition:
-                        requestSocket.send_multipart([codes.remapDetector,newPartition.id.encode(),detector.id.encode()])
-                    else:
-                        requestSocket.send_multipart([codes.remapDetector,codes.removed,detector.id.encode()])
-                    ret = requestSocket.recv()
-                    if ret != codes.ok:
-                        raise Exception("Global System returned ErrorCode")
-                    informedSystems.append(gsID)
-                except zmq.Again:
-                    self.log("timeout informing Global System %s" % (gsID),True)
-                    raise Exception("timeout informing Global System %s" % (gsID))
-                except Exception as e:
-                    self.log("error informing Global System %s: %s " % (gsID,str(e)),True)
-                    raise Exception("error informing Global System %s: %s " % (gsID,str(e)))
-                finally:
-                    requestSocket.close()
-
-            #inform DetectorController
-            requestSocket = self.zmqContext.socket(zmq.REQ)
-            requestSocket.connect("tcp://%s:%s"  % (detector.address,detector.portCommand))
-            if newPartition:
-                requestSocket.send_multipart([codes.detectorChangePartition,newPartition.asJsonString().encode()])
-            else:
-                requestSocket.send_multipart([codes.detectorChangePartition,self.unmappedDetectorControllerData.asJsonString().encode()])
-            try:
-                ret = requestSocket.recv()
-                if ret != codes.ok:
-                    self.log("%s returned error for changing PCA" % (detector.id),True)
-                    raise Exception("%s returned error for changing PCA" % (detector.id,))
-            except zmq.Again:
-                self.log("timeout informing Detector %s" % (detector.id),True)
-                if not forceMove:
-                    raise Exception("timeout informing Detector %s" % (detector.id))
-            except Exception as e:
-                self.log("error changing Detector %s PCA: %s " % (detector.id),str(e),True)
-                raise Exception("error changing Detector %s PCA: %s " % (detector.id),str(e))
-            finally:
-                requestSocket.close()
-            #unlock partitions
-            for p in lockedPartitions:
-                try:
-                    requestSocket = self.zmqContext.socket(zmq.REQ)
-                    requestSocket.connect("tcp://%s:%s"  % (p.address,p.portCommand))
-                    requestSocket.send_multipart([codes.unlock])
-                    ret = requestSocket.recv()
-                    if ret != codes.ok:
-                        self.log("%s returned error for unlocking Partition" % (p.id),True)
-                        raise Exception("%s returned unlocking Partition" % (p.id))
-                except zmq.Again:
-                    self.log("timeout unlocking Partition %s" % (p.id),True)
-                    raise Exception("timeout unlocking Partition %s" % (p.id))
-                except Exception as e:
-                    self.log("error unlocking Partition %s: %s " % (p.id,str(e)),True)
-                    raise Exception("error unlocking Partition %s: %s " % (p.id,str(e)))
-                finally:
-                    requestSocket.close()
-
+            #inform all GlobalSystems at once with one message each
+            error = self.informGlobalSystems(globalSystemCommit,[codes.remapDetectors,json.dumps(moves).encode()],[codes.remapDetectors,json.dumps(oldMapping).encode()])
+            if error:
+                raise Exception(error)
+
+            #inform DetectorControllers
+            partition = newPartition if newPartition else self.unmappedDetectorControllerData
+            report = self.informDetectors([(d,partition) for d in moved])
+            informedDetectors = report.successes
+            for id in report.failures+report.timeouts:
+                error = report.errors.get(id)
+                if error == None or isinstance(error,zmq.Again):
+                    self.log("timeout informing Detector %s" % (id),True)
+                    if not forceMove:
+                        raise Exception("timeout informing Detector %s" % (id))
+                else:
+                    raise Exception("error changing Detector %s PCA: %s " % (id,str(error)))
             return True
         except Exception as e:
-            self.log("error during remapping:%s ;starting rollback for remapping Detector" % str(e),True)
-            #rollback
+            self.log("error during remapping:%s ;starting rollback for moving %d Detectors" % (str(e),len(moved)),True)
             try:
                 if dbChanged:
-                    if unused:
-                        if self.database.unmapDetectorFromPCA(detectorId) != codes.ok:
-                            raise Exception("Error during changing Database")
-                    elif not newPartition:
-                        if self.database.mapDetectorToPCA(detectorId,oldPartition.id) != codes.ok:
-                            raise Exception("Error during changing Database")
-                    else:
-                        if self.database.remapDetector(detectorId,oldPartition.id,newPartition.id) != codes.ok:
-                            raise Exception("Error during changing Database")
-
-                #inform GlobalSystems
-                for gsID in informedSystems:
-                    try:
-                        gs = self.globalSystems[gsID]
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (gs.address,gs.portCommand))
-                        if not unused:
-                            requestSocket.send_multipart([codes.remapDetector,oldPartition.id.encode(),detector.id.encode()])
-                        else:
-                            requestSocket.send_multipart([codes.remapDetector,codes.removed,detector.id.encode()])
-                        ret = requestSocket.recv()
-                        if ret != codes.ok:
-                            raise Exception("Global System returned ErrorCode")
-                    except zmq.Again:
-                        self.log("timeout informing Global System %s" % (gsID),True)
-                        raise Exception("timeout informing Global System %s" % (gsID))
-                    except Exception as e:
-                        self.log("error informing Global System %s: %s " % (gsID,str(e)),True)
-                        raise Exception("error informing Global System %s: %s " % (gsID,str(e)))
-                    finally:
-                        requestSocket.close()
-
-                if removed:
-                    if not unused:
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (oldPartition.address,oldPartition.portCommand))
-                        requestSocket.send_multipart([codes.addDetector,detector.asJsonString().encode()])
-                        try:
-                            ret = requestSocket.recv()
-                            requestSocket.close()
-                        except zmq.Again as e:
-                            self.log("timeout adding Detector to %s" % (oldPartition.id),True)
-                            requestSocket.close()
-                            raise Exception("timeout during adding for pca:%s" % oldPartition.id )
-                        except Exception as e:
-                            self.log("error adding Detector to %s: %s " % (oldPartition.id,str(e)),True)
-                            requestSocket.close()
-                            raise Exception("Error during adding :%s" % str(e) )
-                        if ret == codes.busy:
-                            self.log("%s is not in Idle State" % (oldPartition.id),True)
-                            raise Exception("%s is not in Idle State" % (oldPartition.id))
-                        elif ret != codes.ok:
-                            self.log("%s returned error for adding Detector" % (oldPartition.id),True)
-                            requestSocket.close()
-                            raise Exception("pca returned error code during adding Detector")
-                        requestSocket.close()
-                    else:
-                        #add to unused detectors
-                        self.unmappedDetectorController.addDetector(detector)
+                    if self.database.moveDetectors(oldMapping) != codes.ok:
+                        raise Exception("Error during changing Database")
+                globalSystemCommit.rollback()
+                if informedDetectors:
+                    self.informDetectors([(detectors[id],partitionObjects[oldMapping[id]]) for id in informedDetectors])
                 if added:
-                    if newPartition:
-                        try:
-                            requestSocket = self.zmqContext.socket(zmq.REQ)
-                            requestSocket.connect("tcp://%s:%s"  % (newPartition.address,newPartition.portCommand))
-                            requestSocket.send_multipart([codes.removeDetector,detectorId.encode()])
-                            ret = requestSocket.recv()
-                        except zmq.Again:
-                            self.log("timeout removing Detector from %s" % (newPartition.id),True)
-                            requestSocket.close()
-                            raise Exception("timeout removing Detector from %s" % (newPartition.id))
-                        except Exception:
-                            self.log("error removing Detector from %s: %s " % (newPartition.id,str(e)),True)
-                            requestSocket.close()
-                            raise Exception("error removing Detector from %s: %s " % (newPartition.id,str(e)))
-                        finally:
-                            requestSocket.close()
-                        if ret == codes.busy:
-                            self.log("%s is not in Idle State" % (newPartition.id),True)
-                            raise Exception("%s is not in Idle State" % (newPartition.id))
-                        elif ret != codes.ok:
-                                self.log("%s returned error for removing Detector" % (newPartition.id),True)
-                                raise Exception("%s returned error for removing Detector" % (oldPartition.id))
-                    else:
-                        #remove from Unused Detectors
-                        self.unmappedDetectorController.removeDetector(detectorId)
-
-                #unlock partitions
-                for p in lockedPartitions:
-                    try:
-                        requestSocket = self.zmqContext.socket(zmq.REQ)
-                        requestSocket.connect("tcp://%s:%s"  % (p.address,p.portCommand))
-                        requestSocket.send_multipart([codes.unlock])
-                        ret = requestSocket.recv()
-                        if ret != codes.ok:
-                            self.log("%s returned error for unlocking Partition" % (p.id),True)
-                            raise Exception("%s returned unlocking Partition" % (p.id))
-                    except zmq.Again:
-                        self.log("timeout unlocking Partition %s" % (p.id),True)
-                        raise Exception("timeout unlocking Partition %s" % (p.id))
-                    except Exception as e:
-                        self.log("error unlocking Partition %s: %s " % (p.id,str(e)),True)
-                        raise Exception("error unlocking Partition %s: %s " % (p.id,str(e)))
-                    finally:
-                        requestSocket.close()
-                    return str(e)
-            except Exception as e:
-                self.log("Exception during roll back %s" %str(e),True)
-                return str(e)
+                    if not newPartition:
+                        for d in moved:
+                            self.unmappedDetectorController.removeDetector(d.id)
+                    elif newPcaId not in skipped:
+                        self.commandSystem(newPartition,[codes.removeDetectors,json.dumps(list(moves)).encode()],"removing Detectors from")
+                for oldPcaId in removedFrom:
+                    if oldPcaId == None:
+                        for d in removals[oldPcaId]:
+                            self.unmappedDetectorController.addDetector(d)
+                    elif oldPcaId not in skipped:
+                        self.commandSystem(partitionObjects[oldPcaId],[codes.addDetectors,json.dumps([d.asJson() for d in removals[oldPcaId]]).encode()],"adding Detectors to")
+            except Exception as rollbackError:
+                self.log("Exception during roll back %s" % str(rollbackError),True)
+            return str(e)
+        finally:
+            self.unlockPartitions(lockedPartitions)
+
+    def bootstrapForPartition(self,pcaId):
+        """everything a starting PCA needs (config, detector list and global systems) as one json reply"""
+        partition = self.database.getPartition(pcaId)
+        if partition == codes.idUnknown or isinstance(partition,Exception):
+            return partition
+        detectors = self.database.getDetectorsForPartition(pcaId)
+        if isinstance(detectors,Exception):
+            return detectors
+        globalSystems = {}
+        for name,system in self.globalSystems.items():
+            if isinstance(system,Exception):
+                return system
+            globalSystems[name] = system.asJson()
+        data = {
+            "partition" : partition.asJson(),
+            "detectors" : detectors.asDictionary(),
+            "globalSystems" : globalSystems,
+        }
+        return json.dumps(data).encode()
+
+    def detectorsForIds(self,arg):
+        """detector data for a json list of ids as one json reply (null for unknown ids)"""
+        ids = json.loads(arg)
+        detectors = self.database.getDetectorsForIds(ids)
+        if isinstance(detectors,Exception):
+            return detectors
+        data = dict((id,None) for id in ids)
+        for d in detectors:
+            data[d.id] = d.asJson()
+        return json.dumps(data).encode()
+
+    def partitionsForDetectors(self,arg):
+        """partition data for a json list of detector ids as one json reply (null for unknown ids); like partitionForDetector unassigned detectors get the UnmappedDetectorController"""
+        ids = json.loads(arg)
+        detectors = self.database.getDetectorsWithPartitions(ids)
+        if isinstance(detectors,Exception):
+            return detectors
+        data = dict((id,None) for id in ids)
+        for id,(detector,partition) in detectors.items():
+            data[id] = (partition or self.unmappedDetectorControllerData).asJson()
+        return json.dumps(data).encode()
+
+    def bootstrapForDetectors(self,arg):
+        """detector and partition data for a json list of detector ids as one json reply (null for unknown ids)"""
+        ids = json.loads(arg)
+        detectors = self.database.getDetectorsWithPartitions(ids)
+        if isinstance(detectors,Exception):
+            return detectors
+        data = dict((id,None) for id in ids)
+        for id,(detector,partition) in detectors.items():
+            data[id] = {
+                "detector" : detector.asJson(),
+                "partition" : (partition or self.unmappedDetectorControllerData).asJson(),
+            }
+        return json.dumps(data).encode()
+
+    def bootstrapForGlobalSystem(self,systemId):
+        """everything a starting global system needs (partitions, own info and detector mapping) as one json reply"""
+        globalSystem = self.database.getGlobalSystem(systemId)
+        if globalSystem == codes.idUnknown or isinstance(globalSystem,Exception):
+            return globalSystem
+        partitions = self.database.getAllPartitions()
+        if isinstance(partitions,Exception):
+            return partitions
+        mapping = self.database.getDetectorMapping()
+        if isinstance(mapping,Exception):
+            return mapping
+        data = {
+            "partitions" : partitions.asDictionary(),
+            "globalSystem" : globalSystem.asJson(),
+            "mapping" : mapping.asDictionary(),
+        }
+        return json.dumps(data).encode()
 
     def partitionForDetector(self,detId):
         """returns partition data for detector or data of UnmappedDetectorController if it's unassigned"""
@@ -766,64 +687,57 @@ class ECA:
 
     def waitForRequests(self):
         """waits for client Requests"""
-        while True:
-            try:
-                m = self.replySocket.recv_multipart()
-            except zmq.error.ContextTerminated:
-                self.replySocket.close()
-                break
-            arg = None
-            if len(m) == 2:
-                code, arg = m
-                arg = arg.decode()
-            elif len(m) == 1:
-                code = m[0]
-            else:
-                self.log("received malformed request message: %s", str(m),True)
-                continue
-
-            def switcher(code,arg=None):
-                #functions for codes
-                dbFunctionDictionary = {
-                    codes.pcaAsksForConfig: self.database.getPartition,
-                    codes.detectorAsksForPCA: self.partitionForDetector,
-                    codes.getDetectorForId: self.database.getDetector,
-                    codes.pcaAsksForDetectorList: self.database.getDetectorsForPartition,
-                    codes.getPartitionForId: self.database.getPartition,
-                    codes.getAllPCAs: self.database.getAllPartitions,
-                    codes.getUnmappedDetectors: self.database.getAllUnmappedDetectors,
-                    codes.GlobalSystemAsksForInfo: self.database.getGlobalSystem,
-                    codes.getDetectorMapping: self.database.getDetectorMapping,
-                }
-                #returns function for Code or None if the received code is unknown
-                f = dbFunctionDictionary.get(code,None)
-                try:
-                    if not f:
-                        self.log("received unknown command",True)
-                        self.replySocket.send(codes.unknownCommand)
-                        return
-                    if arg:
-                        ret = f(arg)
-                    else:
-                        ret = f()
-                    #is result a Dataobject?
-                    if isinstance(ret,DataObject) or isinstance(ret,DataObjectCollection):
-                        #encode Dataobject
-                        ret = ret.asJsonString().encode()
-                        self.replySocket.send(ret)
-                    elif isinstance(ret,Exception):
-                        #it's an error message
-                        self.replySocket.send(codes.error)
-                    else:
-                        #it's just a returncode
-                        self.replySocket.send(ret)
-                except zmq.error.ContextTerminated:
-                    self.replySocket.close()
-                    return
-            if arg:
-                switcher(code,arg)
-            else:
-                switcher(code)
+        self.requestBroker.run()
+
+    def handleRequest(self,m):
+        """handles a client request (called by the request workers); returns the reply"""
+        arg = None
+        if len(m) == 2:
+            code, arg = m
+            arg = arg.decode()
+        elif len(m) == 1:
+            code = m[0]
+        else:
+            self.log("received malformed request message: %s" % str(m),True)
+            return codes.unknownCommand
+
+        #functions for codes
+        dbFunctionDictionary = {
+            codes.pcaAsksForConfig: self.database.getPartition,
+            codes.pcaAsksForBootstrap: self.bootstrapForPartition,
+            codes.detectorAsksForPCA: self.partitionForDetector,
+            codes.getDetectorForId: self.database.getDetector,
+            codes.pcaAsksForDetectorList: self.database.getDetectorsForPartition,
+            codes.getPartitionForId: self.database.getPartition,
+            codes.getAllPCAs: self.database.getAllPartitions,
+            codes.getUnmappedDetectors: self.database.getAllUnmappedDetectors,
+            codes.GlobalSystemAsksForInfo: self.database.getGlobalSystem,
+            codes.getDetectorMapping: self.database.getDetectorMapping,
+            codes.GlobalSystemAsksForBootstrap: self.bootstrapForGlobalSystem,
+            #batch requests
+            codes.getDetectorsForIds: self.detectorsForIds,
+            codes.detectorsAskForPCA: self.partitionsForDetectors,
+            codes.detectorsAskForBootstrap: self.bootstrapForDetectors,
+        }
+        #returns function for Code or None if the received code is unknown
+        f = dbFunctionDictionary.get(code,None)
+        if not f:
+            self.log("received unknown command",True)
+            return codes.unknownCommand
+        if arg:
+            ret = f(arg)
+        else:
+            ret = f()
+        #is result a Dataobject?
+        if isinstance(ret,DataObject) or isinstance(ret,DataObjectCollection):
+            #encode Dataobject (cached results are only encoded once)
+            return self.database.jsonReply(ret)
+        elif isinstance(ret,Exception):
+            #it's an error message
+            return codes.error
+        else:
+            #it's just a returncode
+            return ret
 
     def checkPartition(self,partition):
         """checks is Partition has the corrent DetectorList"""
@@ -834,7 +748,7 @@ class ECA:
             Raise(Exception("Partition %s is not in database") % partition.id)
         try:
             #for whatever reason this raises a different Exception for ContextTerminated than send or recv
-            requestSocket = self.zmqContext.socket(zmq.REQ)
+            requestSocket = self.sockets.socket(zmq.REQ)
         except zmq.error.ZMQError:
             return
         try:
@@ -860,11 +774,11 @@ class ECA:
             partition = self.unmappedDetectorControllerData
         try:
             #for whatever reason this raises a different Exception for ContextTerminated than send or recv
-            requestSocket = self.zmqContext.socket(zmq.REQ)
+            requestSocket = self.sockets.socket(zmq.REQ)
         except zmq.error.ZMQError:
             return
         try:
-            requestSocket = self.zmqContext.socket(zmq.REQ)
+            requestSocket = self.sockets.socket(zmq.REQ)
             requestSocket.connect("tcp://%s:%s"  % (detector.address,detector.portCommand ))
             requestSocket.send_multipart([codes.check,partition.asJsonString().encode()])
             ret = requestSocket.recv()
@@ -918,18 +832,26 @@ class ECA:
 
     def terminateECS(self):
         """cleanup on shutdown"""
-        for p in self.partitions:
-            self.stopClient(p)
+        self.stopClients(list(self.partitions))
+        self.ssh.close()
+        self.sshFanOut.shutdown()
+        self.fanOut.shutdown()
         self.terminate = True
         #to make get stop Blocking
         self.disconnectedPCAQueue.put(False)
         self.socketLogPublish.close()
         self.unmappedDetectorController.terminateContoller()
-        self.zmqContext.term()
-        self.zmqContextNoTimeout.term()
+        for handler in self.pcaHandlers.values():
+            handler.terminatePCAHandler()
+        self.sockets.term()
+        self.socketsNoTimeout.term()
+        #closes the sockets of the PCAHandlers
+        ECS_tools.terminateReactor()
+        #wakes up all threads still blocking on a socket
+        ECS_tools.terminateContext()
 
 class PCAHandler:
-    """Handler Object for Partition Agents"""
+    """Handler Object for Partition Agents; the subscriptions and heartbeats of all handlers are served by the process wide reactor thread"""
     def __init__(self,partitionInfo,ecsLogfunction,globalSystems,webSocket):
         #settings
         self.id = partitionInfo.id
@@ -942,7 +864,8 @@ class PCAHandler:
         self.globalSystems = globalSystems
         self.webSocket = webSocket
 
-        self.context = zmq.Context()
+        #the handler's sockets
+        self.sockets = ECS_tools.SocketFactory({zmq.RCVTIMEO:settings.TIMEOUT, zmq.LINGER:0})
         self.stateMap = ECS_tools.MapWrapper()
         self.logQueue = deque(maxlen=settings.BUFFERED_LOG_ENTRIES)
 
@@ -952,63 +875,102 @@ class PCAHandler:
         self.pingInterval = settings.PINGINTERVAL
 
         self.commandSocketAddress = "tcp://%s:%s" % (self.address,self.portCommand)
+        self.reactor = ECS_tools.getReactor(ecsLogfunction)
+        self.terminated = False
+        #heartbeat socket and the timer for the next ping or the timeout of the current one (reactor thread only)
+        self.pingSocket = None
+        self.pingTimer = None
+        #a state table synchronisation is running in the background
+        self.synchronising = False
 
         #state Change subscription
-        self.socketSubscription = self.context.socket(zmq.SUB)
+        self.socketSubscription = self.sockets.socket(zmq.SUB)
         self.socketSubscription.connect("tcp://%s:%s" % (self.address, self.portPublish))
-        #subscribe to everything
-        self.socketSubscription.setsockopt(zmq.SUBSCRIBE, b'')
+        #subscribe to batched state updates in the binary format of this codec version(a PCA with another version sends json on this topic)
+        self.socketSubscription.setsockopt(zmq.SUBSCRIBE, ECS_tools.binaryBatchTopic)
 
         #logsubscription
-        self.socketSubLog = self.context.socket(zmq.SUB)
+        self.socketSubLog = self.sockets.socket(zmq.SUB)
         self.socketSubLog.connect("tcp://%s:%s" % (self.address,self.portLog))
         self.socketSubLog.setsockopt(zmq.SUBSCRIBE, b'')
 
-        t = threading.Thread(name="updater", target=self.waitForUpdates)
-        r = ECS_tools.getStateSnapshot(self.stateMap,partitionInfo.address,partitionInfo.portCurrentState,timeout=self.receive_timeout,pcaid=self.id)
-        if r:
+        #(epoch,sequence) the stateMap is synchronised to; after a reconnect only later changes are requested
+        self.syncedSequence = ECS_tools.syncStateTable(self.stateMap,partitionInfo.address,partitionInfo.portCurrentState,timeout=self.receive_timeout,pcaid=self.id)
+        if self.syncedSequence != None:
             self.PCAConnection = True
-        t.start()
-
-        t = threading.Thread(name="logUpdater", target=self.waitForLogUpdates)
-        t.start()
-        t = threading.Thread(name="heartbeat", target=self.pingHandler)
-        t.start()
+        #updates received during the synchronisation wait in the subscription socket
+        self.reactor.callSoon(self.start)
+
+    def start(self):
+        """hand the sockets over to the reactor and start the heartbeat"""
+        if self.terminated:
+            self.socketSubscription.close()
+            self.socketSubLog.close()
+            return
+        self.reactor.register(self.socketSubscription,self.receiveUpdates)
+        self.reactor.register(self.socketSubLog,self.receiveLogUpdates)
+        self.sendPing()
 
     def createCommandSocket(self):
         """creates and returns a command socket"""
-        socket = self.context.socket(zmq.REQ)
+        socket = self.sockets.socket(zmq.REQ)
         socket.connect(self.commandSocketAddress)
-        socket.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-        socket.setsockopt(zmq.LINGER,0)
         return socket
 
-    def pingHandler(self):
-        """send heartbeat/ping"""
-        socket = self.createCommandSocket()
-        while True:
-            try:
-                socket.send(codes.ping)
-                r = socket.recv()
-                if not self.PCAConnection:
-                    r = ECS_tools.getStateSnapshot(self.stateMap,self.address,self.portCurrentState,timeout=self.receive_timeout,pcaid=self.id)
-                    if r:
-                        self.log("PCA %s connected" % self.id)
-                        self.PCAConnection = True
-                    else:
-                        self.handleDisconnection()
-            except zmq.error.ContextTerminated:
-                break
-            except zmq.Again:
-                self.handleDisconnection()
-                #reset Socket
-                socket.close()
-                socket = self.createCommandSocket()
-            except Exception as e:
-                self.log("Exception while sending Ping: %s" % str(e))
-                socket.close()
-                socket = self.createCommandSocket()
-            time.sleep(self.pingInterval)
+    def sendPing(self):
+        """send heartbeat/ping; the reply is handled by receivePing"""
+        self.pingTimer = None
+        if self.terminated:
+            return
+        try:
+            if self.pingSocket == None:
+                self.pingSocket = self.createCommandSocket()
+                self.reactor.register(self.pingSocket,self.receivePing)
+            self.pingSocket.send(codes.ping)
+        except zmq.error.ContextTerminated:
+            self.closePingSocket()
+            return
+        except Exception as e:
+            self.log("Exception while sending Ping: %s" % str(e))
+            self.closePingSocket()
+            self.pingTimer = self.reactor.callLater(self.pingInterval,self.sendPing)
+            return
+        self.pingTimer = self.reactor.callLater(self.pingTimeout/1000,self.pingTimedOut)
+
+    def receivePing(self,socket):
+        socket.recv()
+        self.pingTimer.cancel()
+        if not self.PCAConnection and not self.synchronising:
+            #synchronise on a worker thread, the reactor keeps serving the other partitions
+            self.synchronising = True
+            since = self.syncedSequence
+            self.reactor.runInBackground(lambda: ECS_tools.syncStateTable(self.stateMap,self.address,self.portCurrentState,timeout=self.receive_timeout,pcaid=self.id,since=since),self.synchronised)
+        self.pingTimer = self.reactor.callLater(self.pingInterval,self.sendPing)
+
+    def synchronised(self,r):
+        """result of the state table synchronisation after a reconnect"""
+        self.synchronising = False
+        if self.terminated:
+            return
+        if r != None:
+            self.syncedSequence = r
+            self.log("PCA %s connected" % self.id)
+            self.PCAConnection = True
+        else:
+            self.handleDisconnection()
+
+    def pingTimedOut(self):
+        self.pingTimer = None
+        self.handleDisconnection()
+        #reset Socket
+        self.closePingSocket()
+        self.pingTimer = self.reactor.callLater(self.pingInterval,self.sendPing)
+
+    def closePingSocket(self):
+        if self.pingSocket:
+            self.reactor.unregister(self.pingSocket)
+            self.pingSocket.close()
+            self.pingSocket = None
 
     def handleDisconnection(self):
         """handler function for a pca disconnection"""
@@ -1035,47 +997,61 @@ class PCAHandler:
             return False
         return True
 
-
-    def waitForUpdates(self):
-        """wait for updates on subscription socket"""
-        while True:
+    def receiveUpdates(self,socket):
+        """handle the updates waiting in the subscription socket"""
+        for i in range(self.reactor.messagesPerEvent):
             try:
-                m = self.socketSubscription.recv_multipart()
-            except zmq.error.ContextTerminated:
-                self.socketSubscription.close()
-                break
-            if len(m) != 3:
-                self.log("received malformed update: %s" % str(m))
-                continue
-            else:
+                m = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            if len(m) == 2 and m[0] == ECS_tools.binaryBatchTopic:
+                records = ECS_tools.decode_status_batch(m[1])
+                if records == None:
+                    self.log("received malformed batch update")
+                    continue
+                for id,sequence,state in records:
+                    self.handleUpdate(id,sequence,state)
+            elif len(m) == 3:
                 id,sequence,state = m
+                id = id.decode()
+                sequence = ECS_tools.intFromBytes(sequence)
+                if state not in {codes.reset,codes.removed}:
+                    state = stateObject(json.loads(state.decode()))
+                self.handleUpdate(id,sequence,state)
+            else:
+                self.log("received malformed update: %s" % str(m))
 
-
-            id = id.decode()
-            sequence = ECS_tools.intFromBytes(sequence)
-            if state == codes.reset:
-                self.stateMap.reset()
-                #reset code for Web Browser
-                state = "reset"
-            elif state == codes.removed:
+    def handleUpdate(self,id,sequence,state):
+        """apply a state update to the stateMap and forward it to the WebUI(s)"""
+        if state == codes.reset:
+            self.stateMap.reset()
+            #the PCA may have been restarted with a new epoch; the next synchronisation has to get the whole table
+            self.syncedSequence = None
+            #reset code for Web Browser
+            state = "reset"
+        else:
+            if state == codes.removed:
                 del self.stateMap[id]
                 #remove code for Web Browser
                 state = "remove"
             else:
-                state = json.loads(state.decode())
-                self.stateMap[id] = (sequence, stateObject(state))
-
-            isGlobalSystem = id in self.globalSystems
-            #send update to WebUI(s)
-            jsonWebUpdate = {"id" : id,
-                             "state" : state,
-                             "sequenceNumber" : sequence,
-                             "isGlobalSystem" : isGlobalSystem,
-                            }
-            if id == self.id and isinstance(state,dict):
-                jsonWebUpdate["buttons"] = PCAStates.UIButtonsForState(state["state"])
-            jsonWebUpdate = json.dumps(jsonWebUpdate)
-            self.webSocket.sendUpdate(jsonWebUpdate,self.id)
+                self.stateMap[id] = (sequence, state)
+                state = state.asJson()
+            #while disconnected updates might have been lost, so only advance while connected
+            if self.PCAConnection and self.syncedSequence != None and sequence > self.syncedSequence[1]:
+                self.syncedSequence = (self.syncedSequence[0],sequence)
+
+        isGlobalSystem = id in self.globalSystems
+        #send update to WebUI(s)
+        jsonWebUpdate = {"id" : id,
+                         "state" : state,
+                         "sequenceNumber" : sequence,
+                         "isGlobalSystem" : isGlobalSystem,
+                        }
+        if id == self.id and isinstance(state,dict):
+            jsonWebUpdate["buttons"] = PCAStates.UIButtonsForState(state["state"])
+        jsonWebUpdate = json.dumps(jsonWebUpdate)
+        self.webSocket.sendUpdate(jsonWebUpdate,self.id)
 
     def log(self,message):
         """spread log message through websocket"""
@@ -1083,16 +1059,27 @@ class PCAHandler:
         self.ecsLogfunction(message,origin=self.id)
         self.webSocket.sendLogUpdate(message,self.id)
 
-    def waitForLogUpdates(self):
-        """wait for new log messages from PCA"""
-        while True:
+    def receiveLogUpdates(self,socket):
+        """handle the log messages waiting in the log subscription socket"""
+        for i in range(self.reactor.messagesPerEvent):
             try:
-                m = self.socketSubLog.recv().decode()
-            except zmq.error.ContextTerminated:
-                self.socketSubLog.close()
-                break
+                m = socket.recv(zmq.NOBLOCK).decode()
+            except zmq.Again:
+                return
             self.log(m)
 
+    def close(self):
+        """unregister and close the sockets (reactor thread)"""
+        if self.pingTimer:
+            self.pingTimer.cancel()
+            self.pingTimer = None
+        self.closePingSocket()
+        for socket in (self.socketSubscription,self.socketSubLog):
+            self.reactor.unregister(socket)
+            socket.close()
+
     def terminatePCAHandler(self):
-        """cleanup on shutdown"""
-        self.context.term()
+        """cleanup on shutdown; the reactor closes the handler's sockets"""
+        self.terminated = True
+        self.sockets.term()
+        self.reactor.callSoon(self.close)
@@ -18,6 +18,10 @@ class ECSCodes:
     addPartition = b'\x50'
     deletePartition = b'\x51'
     remapDetector = b'\x52'
+    #batched detector changes: json list of detector data, json list of ids and json dictionary detector id -> partition id (null for unmapped)
+    addDetectors = b'\x1d'
+    removeDetectors = b'\x1e'
+    remapDetectors = b'\x1f'
     lock = b'\x53'
     unlock = b'\x54'
     check = b'\x38'
@@ -34,11 +38,21 @@ class ECSCodes:
     pcaAsksForConfig = b'\x05'
     pcaAsksForDetectorList = b'\x06'
     pcaAsksForDetectorStatus = b'\x22'
+    #config, detector list and global systems in one reply
+    pcaAsksForBootstrap = b'\x0b'
 
     detectorAsksForId = b'\x07'
     detectorAsksForPCA = b'\x25'
 
     GlobalSystemAsksForInfo = b'\x46'
+    #partitions, global system info and detector mapping in one reply
+    GlobalSystemAsksForBootstrap = b'\x1c'
+
+    #batch requests with a json list of ids; the reply is a json dictionary id -> data (null for unknown ids)
+    getDetectorsForIds = b'\x0e'
+    detectorsAskForPCA = b'\x0f'
+    #detector data and partition for each id e.g. for all detectors of a node
+    detectorsAskForBootstrap = b'\x16'
 
     getAllPCAs = b'\x08'
     getPartitionForId = b'\x23'
@@ -59,3 +73,13 @@ class ECSCodes:
     toggleAutoConfigure = b'\x21'
 
     subsystemMessage = b'\x55'
+
+    #subscription topic and first frame of batched state updates
+    stateBatch = b'\x1a'
+    #subscription topic prefix of batches in the binary format(followed by the codec id)
+    stateBatchBinary = b'\x1b'
+    #request for the whole state table in one message
+    stateSnapshot = b'\x0a'
+    #request for the changes since a sequence number and its reply
+    stateSnapshotSince = b'\x0c'
+    stateDelta = b'\x0d'
@@ -1,104 +1,678 @@
 import threading
-import copy
 import zmq
 from ECSCodes import ECSCodes
 codes = ECSCodes()
 import struct
 from DataObjects import stateObject
 import json
+import StateCodec
+import weakref
+import os
+import time
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, Counter
+from queue import Empty
+
+#process wide zmq Context (one set of I/O threads for all sockets of a process)
+sharedContext = None
+sharedContextLock = threading.Lock()
+
+def getContext(ioThreads=None):
+    """returns the process wide zmq Context; ioThreads is only used by the call that creates it"""
+    global sharedContext
+    with sharedContextLock:
+        if sharedContext == None:
+            sharedContext = zmq.Context(io_threads=ioThreads or 1)
+        return sharedContext
+
+def terminateContext():
+    """terminates the process wide zmq Context (only on process shutdown)"""
+    global sharedContext
+    with sharedContextLock:
+        context = sharedContext
+        sharedContext = None
+    if context != None:
+        context.term()
+
+class SocketFactory:
+    """creates sockets with default options on the shared zmq Context and keeps track of the ones it created"""
+    def __init__(self,options=None,context=None):
+        self.context = context or getContext()
+        self.options = options or {}
+        self.sockets = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.terminated = False
+
+    def socket(self,socketType,options=None):
+        """create a socket; raises ContextTerminated after term() like a terminated Context would"""
+        with self.lock:
+            if self.terminated:
+                raise zmq.error.ContextTerminated()
+            socket = self.context.socket(socketType)
+            for option,value in self.options.items():
+                socket.setsockopt(option,value)
+            if options:
+                for option,value in options.items():
+                    socket.setsockopt(option,value)
+            self.sockets.add(socket)
+            return socket
+
+    def openSockets(self):
+        """number of sockets created by this factory which are still open"""
+        with self.lock:
+            return len([s for s in self.sockets if not s.closed])
+
+    def term(self):
+        """stop handing out sockets; sockets in use are closed by the threads using them"""
+        #zmq sockets aren't threadsafe so they can't be closed here while another thread is blocking on them
+        with self.lock:
+            self.terminated = True
+
+class FanOutReport:
+    """aggregated result of a fan-out: ids of systems which succeeded, failed or didn't answer in time"""
+    def __init__(self):
+        self.successes = []
+        self.failures = []
+        self.timeouts = []
+        #exceptions raised by the called functions
+        self.errors = {}
+        #return values of the calls which returned
+        self.results = {}
+
+    def success(self):
+        return not self.failures and not self.timeouts
+
+    def __str__(self):
+        return "%d succeeded, %d failed, %d timed out" % (len(self.successes),len(self.failures),len(self.timeouts))
+
+class FanOut:
+    """calls submitted to a FanOutPool"""
+    def __init__(self,futures):
+        #id for each future
+        self.futures = futures
+        self.done = threading.Semaphore(0)
+        for future in futures:
+            future.add_done_callback(lambda f: self.done.release())
+
+    def wait(self,timeout):
+        """returns a FanOutReport as soon as all calls returned or after timeout seconds"""
+        deadline = time.time()+timeout
+        for i in range(len(self.futures)):
+            if not self.done.acquire(timeout=max(0,deadline-time.time())):
+                break
+        report = FanOutReport()
+        for future,id in self.futures.items():
+            if not future.done():
+                #the call still runs (or waits for a thread) and isn't dropped
+                report.timeouts.append(id)
+            elif future.exception():
+                report.failures.append(id)
+                report.errors[id] = future.exception()
+            else:
+                report.results[id] = future.result()
+                if future.result():
+                    report.successes.append(id)
+                else:
+                    report.failures.append(id)
+        return report
+
+class FanOutPool:
+    """reusable pool with a bounded number of threads for calling a function on many systems at once"""
+    def __init__(self,maxWorkers,name="fanout"):
+        self.maxWorkers = maxWorkers
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers,thread_name_prefix=name)
+
+    def timeoutFor(self,count,timeout):
+        """deadline for count calls which take at most timeout seconds each; calls beyond maxWorkers wait for a free thread"""
+        return timeout*((count-1)//self.maxWorkers+1)
+
+    def start(self,calls):
+        """submit a list of (id,function) and return a FanOut to wait for"""
+        futures = {}
+        for id,function in calls:
+            futures[self.executor.submit(function)] = id
+        return FanOut(futures)
+
+    def run(self,calls,timeout):
+        """call all functions and return a FanOutReport once all returned or timeout seconds passed"""
+        return self.start(calls).wait(timeout)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class TwoPhaseCommit:
+    """applies a change on many systems at once and undoes it on every system which applied it if one of them fails
+    the systems have no separate prepare step: the first phase applies the change in parallel under one deadline, the second phase keeps it or sends the undo to the systems which applied it"""
+    def __init__(self,pool,timeout,logfunction=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.log = logfunction
+        #(id,system,undo function) of the systems which applied a change
+        self.applied = []
+
+    def run(self,systems,apply,undo,rollbackOnFailure=True):
+        """call apply(system) for a dictionary id -> system in parallel; apply returns True on success
+        returns the FanOutReport of the change; unless rollbackOnFailure is False all changes of this coordinator are undone if a system failed or didn't answer in time"""
+        fanOut = self.pool.start([(id,lambda system=system: apply(system)) for id,system in systems.items()])
+        report = fanOut.wait(self.pool.timeoutFor(len(systems),self.timeout))
+        for id in report.successes:
+            self.applied.append((id,systems[id],undo))
+        if rollbackOnFailure and not report.success():
+            self.rollback()
+            #calls which timed out still run; undo them if they apply the change late
+            def undoLate(future,system):
+                if not future.cancelled() and not future.exception() and future.result():
+                    undo(system)
+            for future,id in fanOut.futures.items():
+                if id in report.timeouts:
+                    future.add_done_callback(lambda future,system=systems[id]: undoLate(future,system))
+        return report
+
+    def rollback(self):
+        """undo the changes on all systems which applied them (in parallel); returns the FanOutReport of the undo calls or None if there was nothing to undo"""
+        applied = self.applied
+        self.applied = []
+        if not applied:
+            return None
+        #a system which applied more than one change undoes them in reverse order
+        undoCalls = {}
+        for id,system,undo in reversed(applied):
+            undoCalls.setdefault(id,[]).append((system,undo))
+        def undoAll(calls):
+            success = True
+            for system,undo in calls:
+                if not undo(system):
+                    success = False
+            return success
+        report = self.pool.run([(id,lambda calls=calls: undoAll(calls)) for id,calls in undoCalls.items()],self.pool.timeoutFor(len(undoCalls),self.timeout*max(len(calls) for calls in undoCalls.values())))
+        if self.log:
+            for id in report.failures+report.timeouts:
+                self.log("rollback failed for %s" % id,True)
+        return report
+
+#names of the ECS codes for statistics (codes with the same value share an entry)
+codeNames = {}
+for name,value in sorted(vars(ECSCodes).items()):
+    if isinstance(value,bytes):
+        codeNames.setdefault(value,name)
+
+class RequestBroker:
+    """serves the requests of REQ clients on a bound ROUTER socket with a pool of worker threads
+    requests are queued in the broker and handed to idle workers over inproc DEALER sockets; handler(frames) returns the reply frame or a list of frames"""
+    #first message of a worker
+    workerReady = b"ready"
+
+    def __init__(self,frontend,handler,workers,sockets,logfunction=None,name="requestBroker"):
+        self.frontend = frontend
+        self.handler = handler
+        self.workers = workers
+        self.sockets = sockets
+        self.log = logfunction
+        self.name = name
+        self.backendAddress = "inproc://%s%d" % (name,id(self))
+        self.backend = self.sockets.socket(zmq.ROUTER)
+        self.backend.bind(self.backendAddress)
+        #requests waiting for a worker: (envelope,request frames,time received)
+        self.pending = deque()
+        #workers waiting for a request
+        self.idleWorkers = deque()
+        #worker -> (code,time received) of the request it is working on
+        self.inProgress = {}
+        #code -> [number of requests,total latency,maximum latency] (latency from receiving a request until its reply is sent)
+        self.latencies = {}
+        self.maxQueueDepth = 0
+        self.statisticsLock = threading.Lock()
+
+    def statistics(self):
+        """queue depth, busy workers and the latency in seconds per request code"""
+        with self.statisticsLock:
+            latencies = {}
+            for code,(count,total,maximum) in self.latencies.items():
+                latencies[codeNames.get(code,code.hex())] = {"requests":count, "averageLatency":total/count, "maxLatency":maximum}
+            return {
+                "queueDepth": len(self.pending),
+                "maxQueueDepth": self.maxQueueDepth,
+                "busyWorkers": len(self.inProgress),
+                "workers": self.workers,
+                "latency": latencies,
+            }
+
+    def worker(self):
+        try:
+            socket = self.sockets.socket(zmq.DEALER)
+        except zmq.error.ContextTerminated:
+            return
+        socket.connect(self.backendAddress)
+        try:
+            socket.send(self.workerReady)
+            while True:
+                frames = socket.recv_multipart()
+                #envelope of the client up to the empty delimiter frame
+                delimiter = frames.index(b"")
+                envelope,request = frames[:delimiter+1],frames[delimiter+1:]
+                try:
+                    reply = self.handler(request)
+                except Exception as e:
+                    #the client is still waiting for an answer
+                    if self.log:
+                        self.log("error handling request %s: %s" % (str(request),str(e)),True)
+                    reply = codes.error
+                if not isinstance(reply,list):
+                    reply = [reply]
+                socket.send_multipart(envelope+reply)
+        except zmq.error.ContextTerminated:
+            pass
+        finally:
+            socket.close()
+
+    def dispatch(self):
+        """hand pending requests to idle workers"""
+        while self.pending and self.idleWorkers:
+            worker = self.idleWorkers.popleft()
+            envelope,request,received = self.pending.popleft()
+            self.inProgress[worker] = (request[0] if request else b"",received)
+            self.backend.send_multipart([worker]+envelope+request)
+
+    def run(self):
+        """start the workers and broker requests until the Context is terminated"""
+        for i in range(self.workers):
+            threading.Thread(name="%sWorker%d" % (self.name,i),target=self.worker,daemon=True).start()
+        poller = zmq.Poller()
+        poller.register(self.frontend,zmq.POLLIN)
+        poller.register(self.backend,zmq.POLLIN)
+        try:
+            while True:
+                events = dict(poller.poll())
+                if self.backend in events:
+                    frames = self.backend.recv_multipart()
+                    worker = frames[0]
+                    if len(frames) > 2 or frames[1] != self.workerReady:
+                        #reply for a client
+                        self.frontend.send_multipart(frames[1:])
+                        code,received = self.inProgress.pop(worker)
+                        latency = time.time() - received
+                        with self.statisticsLock:
+                            entry = self.latencies.setdefault(code,[0,0.0,0.0])
+                            entry[0] += 1
+                            entry[1] += latency
+                            entry[2] = max(entry[2],latency)
+                    self.idleWorkers.append(worker)
+                if self.frontend in events:
+                    #take all waiting requests so the queue depth shows the real backlog
+                    while True:
+                        try:
+                            frames = self.frontend.recv_multipart(zmq.NOBLOCK)
+                        except zmq.Again:
+                            break
+                        try:
+                            delimiter = frames.index(b"")
+                        except ValueError:
+                            #not from a REQ socket
+                            continue
+                        self.pending.append((frames[:delimiter+1],frames[delimiter+1:],time.time()))
+                    with self.statisticsLock:
+                        self.maxQueueDepth = max(self.maxQueueDepth,len(self.pending))
+                self.dispatch()
+        except zmq.error.ContextTerminated:
+            pass
+        finally:
+            self.frontend.close()
+            self.backend.close()
+
+class Timer:
+    """handle of a function scheduled with Reactor.callLater"""
+    __slots__ = ("function","cancelled")
+    def __init__(self,function):
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Reactor:
+    """one thread which serves the sockets of many handlers with a zmq Poller and runs their timers from a heap
+    registered sockets and timers must only be used in the reactor thread; other threads hand work over with callSoon"""
+    #maximum number of messages read from one socket before the other sockets get their turn
+    messagesPerEvent = 100
+
+    def __init__(self,name="reactor",blockingWorkers=4,logfunction=None):
+        self.name = name
+        self.log = logfunction or print
+        self.poller = zmq.Poller()
+        #socket -> callback(socket)
+        self.handlers = {}
+        #heap of (time,sequence number,Timer)
+        self.timers = []
+        self.timerSequence = itertools.count()
+        #functions handed over by other threads
+        self.calls = deque()
+        context = getContext()
+        address = "inproc://%s%d" % (name,id(self))
+        self.wakeupReceiver = context.socket(zmq.PULL)
+        self.wakeupReceiver.bind(address)
+        self.wakeupSender = context.socket(zmq.PUSH)
+        self.wakeupSender.setsockopt(zmq.LINGER,0)
+        self.wakeupSender.connect(address)
+        self.wakeupLock = threading.Lock()
+        self.poller.register(self.wakeupReceiver,zmq.POLLIN)
+        #blocking work e.g. synchronising a state table after a reconnect
+        self.executor = ThreadPoolExecutor(max_workers=blockingWorkers,thread_name_prefix=name+"Worker")
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(name=self.name, target=self.run)
+        self.thread.start()
+
+    def register(self,socket,callback):
+        """call callback(socket) whenever socket has messages (reactor thread only)"""
+        self.handlers[socket] = callback
+        self.poller.register(socket,zmq.POLLIN)
+
+    def unregister(self,socket):
+        """stop serving socket (reactor thread only); the caller closes it"""
+        if self.handlers.pop(socket,None):
+            self.poller.unregister(socket)
+
+    def callLater(self,delay,function):
+        """run function after delay seconds (reactor thread only); returns a Timer"""
+        timer = Timer(function)
+        heapq.heappush(self.timers,(time.monotonic()+delay,next(self.timerSequence),timer))
+        return timer
+
+    def callSoon(self,function):
+        """run function in the reactor thread; may be called from any thread"""
+        self.calls.append(function)
+        with self.wakeupLock:
+            try:
+                self.wakeupSender.send(b"",zmq.NOBLOCK)
+            except (zmq.Again,zmq.error.ContextTerminated,zmq.error.ZMQError):
+                #the reactor is woken up anyway or isn't running anymore
+                pass
+
+    def runInBackground(self,function,callback):
+        """run a blocking function on a worker thread and callback(result) in the reactor thread"""
+        future = self.executor.submit(function)
+        future.add_done_callback(lambda f: self.callSoon(lambda: callback(f.result())))
+
+    def stop(self):
+        def stop():
+            self.running = False
+        self.callSoon(stop)
+
+    def call(self,function,*args):
+        try:
+            function(*args)
+        except zmq.error.ContextTerminated:
+            self.running = False
+        except Exception as e:
+            self.log("Exception in %s: %s" % (self.name,str(e)))
+
+    def run(self):
+        while self.running:
+            #wait until the next timer is due
+            while self.timers and self.timers[0][2].cancelled:
+                heapq.heappop(self.timers)
+            timeout = None
+            if self.timers:
+                timeout = max(0,(self.timers[0][0]-time.monotonic())*1000)
+            try:
+                events = dict(self.poller.poll(timeout))
+            except zmq.error.ContextTerminated:
+                break
+            for socket in events:
+                if socket is self.wakeupReceiver:
+                    try:
+                        while True:
+                            socket.recv(zmq.NOBLOCK)
+                    except zmq.Again:
+                        pass
+                    continue
+                #a previous callback might have removed the socket
+                callback = self.handlers.get(socket)
+                if callback:
+                    self.call(callback,socket)
+            while self.calls:
+                self.call(self.calls.popleft())
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                due, sequence, timer = heapq.heappop(self.timers)
+                if not timer.cancelled:
+                    self.call(timer.function)
+        #pending calls might still close or register sockets
+        while self.calls:
+            self.call(self.calls.popleft())
+        #sockets can't be closed by their owners once the reactor stopped
+        for socket in list(self.handlers):
+            socket.close()
+        self.handlers = {}
+        with self.wakeupLock:
+            self.wakeupSender.close()
+        self.wakeupReceiver.close()
+        self.executor.shutdown(wait=False)
+
+#process wide Reactor
+sharedReactor = None
+sharedReactorLock = threading.Lock()
+
+def getReactor(logfunction=None):
+    """returns the process wide Reactor; it is started by the first call(logfunction is only used by that call)"""
+    global sharedReactor
+    with sharedReactorLock:
+        if sharedReactor == None:
+            sharedReactor = Reactor(logfunction=logfunction)
+            sharedReactor.start()
+        return sharedReactor
+
+def terminateReactor(timeout=5):
+    """stops the process wide Reactor and closes the sockets still registered with it"""
+    global sharedReactor
+    with sharedReactorLock:
+        reactor = sharedReactor
+        sharedReactor = None
+    if reactor != None:
+        reactor.stop()
+        reactor.thread.join(timeout)
+
+class EventQueue:
+    """queue for handing events between threads of one process (unlike multiprocessing.Queue nothing is pickled)"""
+    def __init__(self):
+        self.queue = deque()
+        self.condition = threading.Condition(threading.Lock())
+        #metrics
+        self.putCount = 0
+        self.getCount = 0
+        self.maxDepth = 0
+
+    def put(self,item):
+        with self.condition:
+            self.queue.append(item)
+            self.putCount += 1
+            if len(self.queue) > self.maxDepth:
+                self.maxDepth = len(self.queue)
+            self.condition.notify()
+
+    def putMany(self,items):
+        """append a list of items at once"""
+        with self.condition:
+            self.queue.extend(items)
+            self.putCount += len(items)
+            if len(self.queue) > self.maxDepth:
+                self.maxDepth = len(self.queue)
+            self.condition.notify()
+
+    def get(self,block=True,timeout=None):
+        """remove and return the oldest item; raises queue.Empty if there is none (after timeout seconds)"""
+        with self.condition:
+            if block and not self.condition.wait_for(lambda: self.queue,timeout):
+                raise Empty
+            if not self.queue:
+                raise Empty
+            self.getCount += 1
+            return self.queue.popleft()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def drain(self,maxItems=None,timeout=None):
+        """waits for at least one item and returns everything queued (at most maxItems) in order; returns [] after timeout seconds"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue,timeout):
+                return []
+            if maxItems == None or maxItems >= len(self.queue):
+                items = list(self.queue)
+                self.queue.clear()
+            else:
+                items = [self.queue.popleft() for i in range(maxItems)]
+            self.getCount += len(items)
+            return items
+
+    def depth(self):
+        """number of queued items"""
+        return len(self.queue)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def metrics(self):
+        """current depth, highest depth and number of items put and taken out"""
+        with self.condition:
+            return {"depth":len(self.queue), "maxDepth":self.maxDepth, "put":self.putCount, "get":self.getCount}
+
 class MapWrapper:
-    """thread safe handling of Map"""
+    """thread safe handling of Map; readers get shared read-only snapshots which are only rebuilt after changes"""
     def __init__(self):
-        self.map = {}
-        self.semaphore = threading.Semaphore()
+        #live data, only touched while holding the lock
+        self.data = {}
+        #shallow copy of data that is never modified; None after a change
+        self.snapshot = {}
+        self.lock = threading.Lock()
+        #number of changes, can be used to detect changes between two reads
+        self.version = 0
+
+    @property
+    def map(self):
+        """current snapshot of the map (don't modify it)"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                if self.snapshot is None:
+                    self.snapshot = dict(self.data)
+                snapshot = self.snapshot
+        return snapshot
+
+    def changed(self):
+        """call with the lock held after changing data"""
+        self.snapshot = None
+        self.version += 1
 
     def __iter__(self):
-        return self.copy().values().__iter__()
+        return iter(self.map.values())
 
     def __len__(self):
-        self.semaphore.acquire()
-        try:
-            ret = len(self.map)
-            return ret
-        finally:
-            self.semaphore.release()
+        return len(self.map)
 
     def keyIterator(self):
-        return copy.deepcopy(list(self.map.keys()))
+        return list(self.map)
 
     def __getitem__(self, key):
         """get value for key returns None if key doesn't exist"""
-        self.semaphore.acquire()
-        try:
-            if key in self.map:
-                ret = self.map[key]
-            else:
-                ret = None
-            return ret
-        finally:
-            self.semaphore.release()
+        return self.data.get(key)
 
     def __delitem__(self,key):
-        self.semaphore.acquire()
-        try:
-            if key in self.map:
-                del self.map[key]
-        finally:
-            self.semaphore.release()
-
+        with self.lock:
+            if key in self.data:
+                del self.data[key]
+                self.changed()
 
     def __setitem__(self,key,value):
-        self.semaphore.acquire()
-        try:
-            self.map[key] = value
-        finally:
-            self.semaphore.release()
+        with self.lock:
+            self.data[key] = value
+            self.changed()
 
     def __str__(self):
-        self.semaphore.acquire()
-        try:
-            ret = self.map.__str__()
-            return ret
-        finally:
-            self.semaphore.release()
+        return self.map.__str__()
+
+    def items(self):
+        """returns a list of all (key,value) pairs without copying the values"""
+        return list(self.map.items())
 
     def copy(self):
-        """returns a deepcopy off all items for iteration"""
-        #create copy of statusMap so loop dosn't crash if there are changes on statusMap during the loop
-        #probably not the best solution
-        self.semaphore.acquire()
-        try:
-            mapCopy = copy.deepcopy(self.map)
-            return mapCopy
-        finally:
-            self.semaphore.release()
+        """returns a dictionary with all items for iteration (a shallow copy, the values are shared)"""
+        return dict(self.map)
 
     def __contains__(self, key):
-        self.semaphore.acquire()
-        try:
-            ret = key in self.map
-            return ret
-        finally:
-            self.semaphore.release()
+        return key in self.data
+
+    def update(self,items):
+        """sets many items at once; items is a dictionary or a list of (key,value) pairs"""
+        with self.lock:
+            self.data.update(items)
+            self.changed()
 
     def delMany(self,items):
         """deletes a given list of ids"""
-        self.semaphore.acquire()
-        try:
+        with self.lock:
             for i in items:
-                if i in self.map:
-                    del self.map[i]
-        finally:
-            self.semaphore.release()
+                if i in self.data:
+                    del self.data[i]
+            self.changed()
 
+    def reset(self,items=None):
+        """reset the map data (optionally to the given items)"""
+        with self.lock:
+            self.data = dict(items) if items else {}
+            self.changed()
 
-    def reset(self):
-        """reset the map data"""
-        self.semaphore.acquire()
-        try:
-            self.map = {}
-        finally:
-            self.semaphore.release()
+class CountingMap:
+    """thread safe Map which keeps count of how many keys have each value"""
+    def __init__(self):
+        self.map = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def __setitem__(self,key,value):
+        with self.lock:
+            if key in self.map:
+                self.counts[self.map[key]] -= 1
+            self.map[key] = value
+            self.counts[value] = self.counts.get(value,0) + 1
+
+    def __getitem__(self,key):
+        """get value for key returns None if key doesn't exist"""
+        with self.lock:
+            return self.map.get(key)
+
+    def __delitem__(self,key):
+        with self.lock:
+            if key in self.map:
+                self.counts[self.map[key]] -= 1
+                del self.map[key]
+
+    def __contains__(self,key):
+        with self.lock:
+            return key in self.map
+
+    def __len__(self):
+        with self.lock:
+            return len(self.map)
+
+    def count(self,value):
+        """number of keys with the given value"""
+        with self.lock:
+            return self.counts.get(value,0)
+
+    def allEqual(self,value):
+        """returns True if every key has the given value (also if the map is empty)"""
+        with self.lock:
+            return self.counts.get(value,0) == len(self.map)
+
+    def values(self):
+        with self.lock:
+            return list(self.map.values())
 
 def intToBytes(x):
     """convert an integer to a byte array"""
@@ -146,29 +720,250 @@ def receive_status(socket,pcaid=None):
 
     return [id,sequence,state]
 
-def getStateSnapshot(stateMap,address,port,timeout=2000,pcaid=None):
-    """get snapshot of State Table from a PCA this needs to happen to regard a PCA as connected"""
-    context = zmq.Context()
-    socketGetCurrentStateTable = context.socket(zmq.DEALER)
+#control codes can't be stored in json; they are sent by name inside of a batch
+batchCodeNames = {
+    codes.reset: "reset",
+    codes.removed: "removed",
+}
+batchCodesForName = dict((v,k) for k,v in batchCodeNames.items())
+
+#subscription topic for batches in the binary format of this codec version
+binaryBatchTopic = codes.stateBatchBinary + StateCodec.codecId
+
+#subscriptions installed for subscribers to everything: all first bytes except the ones of the batch topics
+singleMessageTopics = [bytes([b]) for b in range(256) if b not in (codes.stateBatch[0],codes.stateBatchBinary[0])]
+
+class Subscriptions:
+    """subscriptions of an XPUB socket in XPUB_MANUAL mode; every subscriber sends its own (un)subscribe so topics are counted and a topic is gone when its last subscriber left"""
+    def __init__(self,socket):
+        self.socket = socket
+        self.counts = Counter()
+
+    def update(self):
+        """read pending (un)subscription messages from the socket"""
+        while True:
+            try:
+                message = self.socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            #first byte is 1 for subscribe and 0 for unsubscribe followed by the topic
+            subscribed = message[0] == 1
+            topic = message[1:]
+            option = zmq.SUBSCRIBE if subscribed else zmq.UNSUBSCRIBE
+            #applies to the subscriber of the last received message (the socket filters per subscriber)
+            if topic == b'':
+                #everything except the batch topics (ids never start with their first bytes)
+                for singleTopic in singleMessageTopics:
+                    self.socket.setsockopt(option,singleTopic)
+            else:
+                self.socket.setsockopt(option,topic)
+            if subscribed:
+                self.counts[topic] += 1
+            elif self.counts[topic] > 1:
+                self.counts[topic] -= 1
+            else:
+                del self.counts[topic]
+
+    def __contains__(self,topic):
+        return topic in self.counts
+
+    def withPrefix(self,prefix):
+        """subscribed topics starting with prefix"""
+        return [topic for topic in self.counts if topic.startswith(prefix)]
+
+def wantsBinary(frame):
+    """True if a peer asked for the binary format with the same codec version"""
+    return frame == StateCodec.codecId
+
+def encode_records(records,binary=False):
+    """encode a list of (id,sequence,state) records for a batch, a snapshot or a delta"""
+    if binary:
+        try:
+            return StateCodec.encode(records)
+        except TypeError:
+            #values the codec can't represent are sent as json; the decoders accept both on every topic
+            pass
+    payload = []
+    for id,sequence,state in records:
+        if isinstance(state,stateObject):
+            state = state.asJson()
+        else:
+            state = batchCodeNames[state]
+        payload.append((id,sequence,state))
+    return json.dumps(payload).encode()
+
+def send_status_batch(socket,records,topic=codes.stateBatch):
+    """send a list of (id,sequence,state) records as one message on a specified socket
+    the payload is binary for the binary topic of this codec version and json for all other topics"""
+    #only two frames so subscribers for the single message format(id,sequence,state) can tell it apart
+    socket.send_multipart([topic,encode_records(records,topic == binaryBatchTopic)])
+
+def decode_status_batch(payload):
+    """decode the payload of a batch message(json or binary) into a list of [id,sequence,state] returns None on error"""
+    try:
+        if StateCodec.isBinary(payload):
+            return StateCodec.decode(payload)
+        records = json.loads(payload.decode())
+    except Exception as e:
+        print ("error decoding status batch: %s" % str(e))
+        return None
+    ret = []
+    for id,sequence,state in records:
+        if isinstance(state,dict):
+            state = stateObject(state)
+        else:
+            state = batchCodesForName[state]
+        ret.append([id,sequence,state])
+    return ret
+
+class SnapshotCache:
+    """serialized state table which is only rebuilt when the publisher sequence number has changed since the last request
+    and a bounded journal of the latest changes for resynchronising clients which already have an older table"""
+    def __init__(self,statusMap,journalSize=10000):
+        self.statusMap = statusMap
+        self.lock = threading.Lock()
+        #sequence number of the latest change of the statusMap
+        self.sequence = 0
+        #sequence and frames for each format(binary or json)
+        self.builtSequence = {}
+        self.frames = {}
+        #(sequence,id,state) for each change; state is codes.removed for removed entries
+        self.journal = deque(maxlen=journalSize)
+        #changes up to this sequence are no longer in the journal
+        self.journalStart = 0
+        #identifies this instance of the table; sequence numbers of a restarted PCA start again at 0
+        self.epoch = os.urandom(4)
+        #metrics
+        self.builds = 0
+        self.hits = 0
+        self.deltas = 0
+
+    def record(self,sequence,id,state):
+        """add a change of the statusMap to the journal"""
+        with self.lock:
+            if len(self.journal) == self.journal.maxlen:
+                self.journalStart = self.journal[0][0]
+            self.journal.append((sequence,id,state))
+
+    def reset(self,sequence):
+        """subscribers clear their table with a reset; older tables can't be resynchronised with changes"""
+        with self.lock:
+            self.journal.clear()
+            self.journalStart = sequence
+
+    def changed(self,sequence):
+        """tell the cache that the statusMap has been changed up to sequence (call after changing the statusMap)"""
+        self.sequence = sequence
+
+    def getFrames(self,binary=False):
+        """returns the frames [sequence,payload,epoch] of the current state table"""
+        with self.lock:
+            sequence = self.sequence
+            if self.builtSequence.get(binary) == sequence:
+                self.hits += 1
+                return self.frames[binary]
+            records = []
+            for id,(entrySequence,state) in self.statusMap.items():
+                records.append((id,entrySequence,state))
+            self.frames[binary] = [intToBytes(sequence),encode_records(records,binary),self.epoch]
+            self.builtSequence[binary] = sequence
+            self.builds += 1
+            return self.frames[binary]
+
+    def getDeltaFrames(self,epoch,since,binary=False):
+        """returns the frames [sequence,payload,epoch] with the latest change of every entry changed after since or None if the journal doesn't reach back that far"""
+        with self.lock:
+            if epoch != self.epoch or since < self.journalStart:
+                return None
+            changes = {}
+            for sequence,id,state in reversed(self.journal):
+                if sequence <= since:
+                    break
+                if id not in changes:
+                    changes[id] = (sequence,state)
+            records = [(id,sequence,state) for id,(sequence,state) in changes.items()]
+            self.deltas += 1
+            return [intToBytes(self.sequence),encode_records(records,binary),self.epoch]
+
+def send_snapshot(socket,origin,cache,binary=False):
+    """answer a state table request from origin(ROUTER identity) with the cached snapshot"""
+    socket.send_multipart([origin,codes.stateSnapshot]+cache.getFrames(binary))
+
+def send_snapshot_since(socket,origin,cache,epoch,since,binary=False):
+    """answer a "hello since" request with the changes after since or with the whole table if they are not in the journal anymore"""
+    frames = cache.getDeltaFrames(epoch,intFromBytes(since),binary)
+    if frames == None:
+        send_snapshot(socket,origin,cache,binary)
+    else:
+        socket.send_multipart([origin,codes.stateDelta]+frames)
+
+def decode_snapshot(payload):
+    """decode the payload of a snapshot(json or binary) into a list of [id,sequence,stateObject]"""
+    if StateCodec.isBinary(payload):
+        return StateCodec.decode(payload)
+    return [[id,sequence,stateObject(state)] for id,sequence,state in json.loads(payload.decode())]
+
+def syncStateTable(stateMap,address,port,timeout=2000,pcaid=None,since=None):
+    """get the State Table from a PCA; with since(the return value of an earlier call) only the changes after it are requested
+    returns (epoch,sequence) the table is synchronised to or None on error"""
+    if pcaid:
+        errorString = " receiving snapshot for %s" % pcaid
+    else:
+        errorString = " receiving snapshot"
+    socketGetCurrentStateTable = getContext().socket(zmq.DEALER)
     socketGetCurrentStateTable.setsockopt(zmq.RCVTIMEO, timeout)
     socketGetCurrentStateTable.setsockopt(zmq.LINGER,0)
     socketGetCurrentStateTable.connect("tcp://%s:%s" % (address,port))
-    socketGetCurrentStateTable.send(codes.hello)
-    while True:
-        ret = receive_status(socketGetCurrentStateTable,pcaid)
-        #receive_status returns None if something went wrong
-        if(ret == None):
-            socketGetCurrentStateTable.close()
-            return False
-        id, sequence, state = ret
-        if id != codes.done:
-            #print (id,sequence,state)
-            if id in stateMap:
-                if stateMap[id][0] < sequence:
-                    stateMap[id] = (sequence, state)
-            else:
+    try:
+        #the last frame asks for the binary format; older peers ignore it and answer in json
+        if since == None:
+            socketGetCurrentStateTable.send_multipart([codes.stateSnapshot,StateCodec.codecId])
+        else:
+            epoch, sinceSequence = since
+            socketGetCurrentStateTable.send_multipart([codes.stateSnapshotSince,epoch,intToBytes(sinceSequence),StateCodec.codecId])
+        code, tableSequence, payload, epoch = socketGetCurrentStateTable.recv_multipart()
+        if code == codes.stateSnapshot:
+            records = decode_snapshot(payload)
+        elif code == codes.stateDelta and since != None:
+            records = decode_status_batch(payload)
+            if records == None:
+                return None
+        else:
+            print ("wrong reply"+errorString)
+            return None
+    except zmq.Again:
+        print ("timeout"+errorString)
+        return None
+    except Exception as e:
+        print ("error"+errorString+": "+str(e))
+        return None
+    finally:
+        socketGetCurrentStateTable.close()
+    tableSequence = intFromBytes(tableSequence)
+    #sequence numbers of the stateMap entries belong to a previous instance of the PCA
+    restarted = since != None and since[0] != epoch
+    if code == codes.stateSnapshot and since != None:
+        #entries the client missed the removal of; newer entries came in with updates after the snapshot
+        ids = set(record[0] for record in records)
+        if isinstance(stateMap,MapWrapper):
+            keys = stateMap.keyIterator()
+        else:
+            keys = list(stateMap.keys())
+        for id in keys:
+            entry = stateMap[id]
+            if id not in ids and entry and (restarted or entry[0] <= tableSequence):
+                del stateMap[id]
+    for id, sequence, state in records:
+        if state == codes.removed:
+            if id in stateMap and stateMap[id][0] < sequence:
+                del stateMap[id]
+        elif id in stateMap and not restarted:
+            if stateMap[id][0] < sequence:
                 stateMap[id] = (sequence, state)
-        #id should be codes.done in final message
         else:
-            socketGetCurrentStateTable.close()
-            return True
+            stateMap[id] = (sequence, state)
+    return (epoch,tableSequence)
+
+def getStateSnapshot(stateMap,address,port,timeout=2000,pcaid=None):
+    """get snapshot of State Table from a PCA this needs to happen to regard a PCA as connected"""
+    return syncStateTable(stateMap,address,port,timeout,pcaid) != None
@@ -32,6 +32,16 @@ class GlobalSystemControler(BaseController):
                 requestSocket.connect("tcp://%s:%s" % (self.conf['ECAAddress'],self.conf['ECARequestPort']))
                 requestSocket.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
 
+                #everything in one request; older ECAs don't know it
+                requestSocket.send_multipart([codes.GlobalSystemAsksForBootstrap,type.encode()])
+                bootstrap = requestSocket.recv()
+                if bootstrap not in {codes.unknownCommand,codes.error,codes.idUnknown}:
+                    bootstrap = json.loads(bootstrap.decode())
+                    partitions = DataObjectCollection(bootstrap["partitions"],partitionDataObject)
+                    globalSystemInfo = globalSystemDataObject(bootstrap["globalSystem"])
+                    mapping = DataObjectCollection(bootstrap["mapping"],mappingDataObject)
+                    break
+
                 requestSocket.send_multipart([codes.getAllPCAs])
                 partitions = requestSocket.recv()
                 partitions = DataObjectCollection(json.loads(partitions.decode()),partitionDataObject)
@@ -182,6 +192,20 @@ class GlobalSystemControler(BaseController):
                     self.abortFunction(self.detectorMapping[detectorId])
                 self.detectorMapping[detectorId] = pcaId
             self.commandSocket.send(codes.ok)
+        elif command == codes.remapDetectors:
+            #json dictionary detector id -> partition id (null if the detector is unmapped)
+            mapping = json.loads(message[1].decode())
+            affected = set(pcaId for pcaId in mapping.values() if pcaId != None)
+            affected.update(self.detectorMapping[detectorId] for detectorId in mapping if detectorId in self.detectorMapping)
+            #abort every affected partition once
+            for pcaId in affected:
+                self.abortFunction(pcaId)
+            for detectorId,pcaId in mapping.items():
+                if pcaId == None:
+                    self.detectorMapping.pop(detectorId,None)
+                else:
+                    self.detectorMapping[detectorId] = pcaId
+            self.commandSocket.send(codes.ok)
         #transitions
         elif command.decode() == GlobalSystemTransitions.configure:
             conf = None
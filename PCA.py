@@ -3,7 +3,6 @@
 from Statemachine import Statemachine
 import csv
 from _thread import start_new_thread
-from multiprocessing import Queue
 import zmq
 from datetime import datetime
 import threading
@@ -19,7 +18,7 @@ from DataObjects import DataObjectCollection, detectorDataObject, partitionDataO
 import sys
 import PartitionComponents
 from PartitionComponents import DCS,TFC,QA,FLES
-from ECS_tools import MapWrapper
+from ECS_tools import MapWrapper, CountingMap, EventQueue
 import ECS_tools
 import time
 import zc.lockfile
@@ -49,7 +48,8 @@ class PCA:
         config = configparser.ConfigParser()
         config.read("init.cfg")
         conf = config["Default"]
-        self.context = zmq.Context()
+        #all sockets of the PCA and its components share one Context
+        self.context = ECS_tools.getContext(int(conf['zmqIOThreads']))
         self.receive_timeout = int(conf['receive_timeout'])
         self.ECSAdress = conf['ECAAddress']
         self.ECARequestPort = conf['ECARequestPort']
@@ -73,6 +73,8 @@ class PCA:
             codes.stop: self.stopRecording,
             codes.removeDetector: self.removeDetector,
             codes.addDetector: self.addDetector,
+            codes.removeDetectors: self.removeDetectors,
+            codes.addDetectors: self.addDetectors,
             codes.abort: self.abort,
             codes.check: checkConsistencyRequest,
             codes.lock: self.lockPartition,
@@ -81,8 +83,36 @@ class PCA:
             codes.subsystemMessage: self.handleSystemMessage
         }
 
+        #get config, detector list and global systems in one request
+        bootstrap = None
+        while True:
+            requestSocket = self.context.socket(zmq.REQ)
+            requestSocket.connect("tcp://%s:%s" % (conf['ECAAddress'],conf['ECARequestPort']))
+            requestSocket.setsockopt(zmq.RCVTIMEO, int(conf['receive_timeout']))
+            requestSocket.setsockopt(zmq.LINGER,0)
+
+            requestSocket.send_multipart([codes.pcaAsksForBootstrap, id.encode()])
+            try:
+                ret = requestSocket.recv()
+            except zmq.Again:
+                print("timeout getting configuration")
+                continue
+            except zmq.error.ContextTerminated:
+                break
+            finally:
+                requestSocket.close()
+            if ret == codes.idUnknown:
+                print("id %s is not in Database" % self.id)
+                sys.exit(1)
+            #older ECAs don't know the request; fall back to the single requests
+            if ret not in {codes.unknownCommand,codes.error}:
+                bootstrap = json.loads(ret.decode())
+            break
+
         #get your config
         configECS = None
+        if bootstrap:
+            configECS = partitionDataObject(bootstrap["partition"])
         while configECS == None:
             requestSocket = self.context.socket(zmq.REQ)
             requestSocket.connect("tcp://%s:%s" % (conf['ECAAddress'],conf['ECARequestPort']))
@@ -113,22 +143,36 @@ class PCA:
         self.transitionNumber = 0
         #the only one who may change the status Map, is the publisher thread
         self.statusMap = MapWrapper()
+        #serialized statusMap for state table requests
+        self.snapshotCache = ECS_tools.SnapshotCache(self.statusMap,int(conf['stateJournalSize']))
         self.sem = threading.Semaphore()
-        self.publishQueue = Queue()
+        #threads for partition-wide calls like readying or aborting all Detectors
+        self.fanOutPool = ECS_tools.FanOutPool(int(conf['fanOutWorkers']),"fanout")
+        self.fanOutTimeout = int(conf['fanOutTimeout'])
+        self.publishQueue = EventQueue()
         self.autoConfigure = False
         self.globalTag = False
         self.partitionLocked = False
 
-        #ZMQ Socket to publish new state Updates
-        self.socketPublish = self.context.socket(zmq.PUB)
+        #ZMQ Socket to publish new state Updates(XPUB to see which message formats the subscribers want)
+        self.socketPublish = self.context.socket(zmq.XPUB)
+        #subscriptions are applied by ECS_tools.Subscriptions so that subscribers to everything don't receive batches
+        self.socketPublish.setsockopt(zmq.XPUB_MANUAL,1)
         self.socketPublish.bind("tcp://*:%s" % configECS.portPublish)
+        #subscribers for the single message format subscribe to everything, batch subscribers to the batch topic or a binary batch topic(one per codec version)
+        self.subscriptions = ECS_tools.Subscriptions(self.socketPublish)
+        #maximum number of queue entries handled in one publish cycle
+        self.publishBatchSize = int(conf['publishBatchSize'])
+        #last published state for each id(used to drop unchanged updates)
+        self.lastPublished = {}
 
         #publish logmessages
         self.socketLogPublish = self.context.socket(zmq.PUB)
         self.socketLogPublish.bind("tcp://*:%s" % configECS.portLog)
 
         #Socket to wait for Updates From Detectors
-        self.socketDetectorUpdates = self.context.socket(zmq.REP)
+        #ROUTER so updates of many senders can be read and acknowledged without waiting for each other
+        self.socketDetectorUpdates = self.context.socket(zmq.ROUTER)
         self.socketDetectorUpdates.bind("tcp://*:%s" % configECS.portUpdates)
 
         #Socket to serve current statusMap
@@ -161,6 +205,8 @@ class PCA:
 
         #get your Detectorlist
         detList = None
+        if bootstrap:
+            detList = DataObjectCollection(bootstrap["detectors"],detectorDataObject)
         while detList == None:
             requestSocket = self.context.socket(zmq.REQ)
             requestSocket.connect("tcp://%s:%s" % (conf['ECAAddress'],conf['ECARequestPort']))
@@ -187,9 +233,16 @@ class PCA:
 
         self.stateMachine = Statemachine(conf["stateMachineCSV"],PCAStates.Idle)
 
-        #helper maps to determine global state
-        self.readyDetectors = {}
-        self.configuringDetectors = {}
+        #one heartbeat thread for all Detectors and Global Systems
+        self.heartbeat = PartitionComponents.HeartbeatScheduler(self.context)
+
+        #helper maps to determine global state(they count their values so checks don't need to iterate all detectors)
+        self.readyDetectors = CountingMap()
+        self.configuringDetectors = CountingMap()
+        #last mapped state for each detector
+        self.detectorMappedStates = CountingMap()
+        #needsReconfiguring flag for each detector
+        self.reconfiguringDetectors = CountingMap()
 
         start_new_thread(self.publisher,())
 
@@ -206,6 +259,9 @@ class PCA:
         }
         #get info from ECS
         for s in systemList:
+            if bootstrap:
+                res.append(globalSystemDataObject(bootstrap["globalSystems"][s]))
+                continue
             requestSocket = self.context.socket(zmq.REQ)
             requestSocket.connect("tcp://%s:%s" % (conf['ECAAddress'],conf['ECARequestPort']))
             requestSocket.setsockopt(zmq.RCVTIMEO, int(conf['receive_timeout']))
@@ -234,13 +290,13 @@ class PCA:
         #create Objects
         tfcData, dcsData, qaData, flesData = res
         self.globalSystems = {}
-        self.TFC = TFC(self.id,tfcData.address,tfcData.portCommand,"TFC",self.log,self.globalSystemTimeout,self.globalSystemReconnect)
+        self.TFC = TFC(self.id,tfcData.address,tfcData.portCommand,"TFC",self.log,self.globalSystemTimeout,self.globalSystemReconnect,self.heartbeat)
         self.globalSystems["TFC"] = self.TFC
-        self.DCS = DCS(self.id,dcsData.address,dcsData.portCommand,"DCS",self.log,self.globalSystemTimeout,self.globalSystemReconnect)
+        self.DCS = DCS(self.id,dcsData.address,dcsData.portCommand,"DCS",self.log,self.globalSystemTimeout,self.globalSystemReconnect,self.heartbeat)
         self.globalSystems["DCS"] = self.DCS
-        self.QA = QA(self.id,qaData.address,qaData.portCommand,"QA",self.log,self.globalSystemTimeout,self.globalSystemReconnect)
+        self.QA = QA(self.id,qaData.address,qaData.portCommand,"QA",self.log,self.globalSystemTimeout,self.globalSystemReconnect,self.heartbeat)
         self.globalSystems["QA"] = self.QA
-        self.FLES = FLES(self.id,flesData.address,flesData.portCommand,"FLES",self.log,self.globalSystemTimeout,self.globalSystemReconnect)
+        self.FLES = FLES(self.id,flesData.address,flesData.portCommand,"FLES",self.log,self.globalSystemTimeout,self.globalSystemReconnect,self.heartbeat)
         self.globalSystems["FLES"] = self.FLES
 
         #maps configure Functions to their corresponding PCA State
@@ -313,69 +369,138 @@ class PCA:
         """publishes all state changes inside the Queue, updates the PCA Statemap and checks current PCA State"""
         self.initdone.wait()
         while True:
-            id,state = self.publishQueue.get()
+            #collect everything that is currently inside the queue
+            burst = self.publishQueue.drain(self.publishBatchSize)
             if self.terminate.is_set():
                 break
-            self.sequence = self.sequence + 1
-            if state == codes.removed:
-                del self.statusMap[id]
-            elif state != codes.reset:
-                subSystemObject = None
-                if id in self.detectors:
-                    subSystemObject = self.detectors[id]
-                elif id in self.globalSystems:
-                    subSystemObject = self.globalSystems[id]
-                elif id != self.id:
-                    self.log("received update with unknown id: %s" % id,True)
+            #reset code which has to be published before the records
+            resetRecord = None
+            #latest record for each id
+            records = {}
+            for id,state in burst:
+                if id == False:
+                    #wakeup message from terminate
                     continue
-                if subSystemObject:
-                    oldstate = subSystemObject.getStateObject()
-                    subSystemObject.setState(state)
-                    #if Detector was never connected oldstate will be False (no log necessary)
-                    if oldstate and oldstate.unmappedState != state.unmappedState:
-                        self.log("%s Transition: %s -> %s" % (subSystemObject.name,oldstate.unmappedState,state.unmappedState))
-                self.statusMap[id] = (self.sequence,state)
-                self.checkGlobalState(id,state.state)
-            #print(id,self.sequence,state)
-            ECS_tools.send_status(self.socketPublish,id,self.sequence,state)
-
+                self.sequence = self.sequence + 1
+                if state == codes.reset:
+                    #subscribers will clear their table; earlier records of this burst are obsolete
+                    resetRecord = (id,self.sequence,state)
+                    records = {}
+                    self.lastPublished = {}
+                    self.snapshotCache.reset(self.sequence)
+                    continue
+                elif state == codes.removed:
+                    del self.statusMap[id]
+                    self.snapshotCache.record(self.sequence,id,state)
+                    if id in self.lastPublished:
+                        del self.lastPublished[id]
+                else:
+                    subSystemObject = None
+                    if id in self.detectors:
+                        subSystemObject = self.detectors[id]
+                    elif id in self.globalSystems:
+                        subSystemObject = self.globalSystems[id]
+                    elif id != self.id:
+                        self.log("received update with unknown id: %s" % id,True)
+                        continue
+                    if subSystemObject:
+                        oldstate = subSystemObject.getStateObject()
+                        subSystemObject.setState(state)
+                        #if Detector was never connected oldstate will be False (no log necessary)
+                        if oldstate and oldstate.unmappedState != state.unmappedState:
+                            self.log("%s Transition: %s -> %s" % (subSystemObject.name,oldstate.unmappedState,state.unmappedState))
+                    self.statusMap[id] = (self.sequence,state)
+                    self.snapshotCache.record(self.sequence,id,state)
+                    self.checkGlobalState(id,state.state)
+                #a newer update supersedes an older one for the same id(re-insert to keep the order of the last update)
+                if id in records:
+                    del records[id]
+                records[id] = (id,self.sequence,state)
+            self.snapshotCache.changed(self.sequence)
+            self.publishRecords(resetRecord,list(records.values()))
+
+    def publishRecords(self,resetRecord,records):
+        """publishes the records of one publish cycle; unchanged states are dropped"""
+        changedRecords = []
+        if resetRecord:
+            changedRecords.append(resetRecord)
+        for id,sequence,state in records:
+            if isinstance(state,stateObject):
+                stateString = state.asJsonString()
+                if self.lastPublished.get(id) == stateString:
+                    continue
+                self.lastPublished[id] = stateString
+            changedRecords.append((id,sequence,state))
+        if not changedRecords:
+            return
+        self.subscriptions.update()
+        if b'' in self.subscriptions:
+            for id,sequence,state in changedRecords:
+                ECS_tools.send_status(self.socketPublish,id,sequence,state)
+        if codes.stateBatch in self.subscriptions:
+            ECS_tools.send_status_batch(self.socketPublish,changedRecords)
+        for topic in self.subscriptions.withPrefix(codes.stateBatchBinary):
+            #subscribers with another codec version get json on their topic
+            ECS_tools.send_status_batch(self.socketPublish,changedRecords,topic=topic)
 
     def waitForUpdates(self):
-        """wait for updates from Detectors"""
+        """wait for updates from Detectors; reads and acknowledges every update waiting on the socket in one cycle"""
         while True:
             try:
-                message = self.socketDetectorUpdates.recv()
-                message = json.loads(message.decode())
-                id = message["id"]
-
-                if id in self.detectors:
-                    subSystemObject = self.detectors[id]
-                elif id in self.globalSystems:
-                    subSystemObject = self.globalSystems[id]
-                else:
-                    self.log("received message with unknown id: %s" % id,True)
-                    self.socketDetectorUpdates.send(codes.idUnknown)
-                    continue
-                self.socketDetectorUpdates.send(codes.ok)
-                if not subSystemObject.checkSequence(message["sequenceNumber"]):
-                    #update is obsolete
-                    continue
-
-                state = message["state"]
-                configTag = None
-                comment = None
-                if "tag" in message:
-                    configTag = message["tag"]
-                if "comment" in message:
-                    comment = message["comment"]
-                if (subSystemObject.stateMachine.currentState == state):
-                    pass
-                    #continue
-                self.publishQueue.put((id,stateObject([subSystemObject.getMappedStateForState(state),state,configTag,comment]),))
+                self.socketDetectorUpdates.poll()
+                events = []
+                while len(events) < self.publishBatchSize:
+                    try:
+                        message = self.socketDetectorUpdates.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    #REQ senders put an empty delimiter between their identity and the update, DEALER senders may not
+                    if len(message) > 2 and message[1] == b'':
+                        envelope = message[:2]
+                    else:
+                        envelope = message[:1]
+                    try:
+                        reply = self.readUpdateMessage(message[len(envelope)],events)
+                    except Exception as e:
+                        self.log("received malformed update: %s" % str(e),True)
+                        reply = codes.error
+                    self.socketDetectorUpdates.send_multipart(envelope+[reply])
+                if events:
+                    self.publishQueue.putMany(events)
             except zmq.error.ContextTerminated:
                 self.socketDetectorUpdates.close()
                 break
 
+    def readUpdateMessage(self,message,events):
+        """appends the events for an update or a batch (json list) of updates to events and returns the reply code"""
+        message = json.loads(message.decode())
+        if not isinstance(message,list):
+            message = [message]
+        reply = codes.ok
+        for update in message:
+            id = update["id"]
+            if id in self.detectors:
+                subSystemObject = self.detectors[id]
+            elif id in self.globalSystems:
+                subSystemObject = self.globalSystems[id]
+            else:
+                self.log("received message with unknown id: %s" % id,True)
+                reply = codes.idUnknown
+                continue
+            if not subSystemObject.checkSequence(update["sequenceNumber"]):
+                #update is obsolete
+                continue
+
+            state = update["state"]
+            configTag = None
+            comment = None
+            if "tag" in update:
+                configTag = update["tag"]
+            if "comment" in update:
+                comment = update["comment"]
+            events.append((id,stateObject([subSystemObject.getMappedStateForState(state),state,configTag,comment])))
+        return reply
+
     def waitForStateTableRequests(self):
         """waits for requests for entire State-Table"""
         while True:
@@ -385,12 +510,22 @@ class PCA:
 
                 origin = messsage[0]
                 request = messsage[1]
+                if request == codes.stateSnapshot:
+                    #whole table in one message; only serialized again if there were changes since the last request
+                    binary = len(messsage) > 2 and ECS_tools.wantsBinary(messsage[2])
+                    ECS_tools.send_snapshot(self.socketServeCurrentStatus,origin,self.snapshotCache,binary)
+                    continue
+                if request == codes.stateSnapshotSince and len(messsage) > 3:
+                    #changes since the given sequence number (or the whole table if they aren't in the journal anymore)
+                    binary = len(messsage) > 4 and ECS_tools.wantsBinary(messsage[4])
+                    ECS_tools.send_snapshot_since(self.socketServeCurrentStatus,origin,self.snapshotCache,messsage[2],messsage[3],binary)
+                    continue
                 if request != codes.hello:
                     self.log("wrong request in socketServeCurrentStatus \n",True)
                     continue
 
                 # send each Statusmap entry to origin
-                items = self.statusMap.copy().items()
+                items = self.statusMap.items()
                 for key, value in items:
                     #send identity of origin first
                     self.socketServeCurrentStatus.send(origin,zmq.SNDMORE)
@@ -429,7 +564,9 @@ class PCA:
                     d.setState(state,configTag,"found by consistency check")
                 if d.currentStateObject.configTag != configTag:
                     self.log("During System check Detector %s returned an unexpected configuration Tag: %s" % (d.id,configTag),True)
-                    d.currentStateObject.configTag = configTag
+                    current = d.currentStateObject
+                    #stateObjects cache their json string; replace instead of modifying
+                    d.currentStateObject = stateObject([current.state,current.unmappedState,configTag,current.comment])
 
     def addDetector(self,detector):
         """add Detector to Dictionary and pubish it's state"""
@@ -447,9 +584,12 @@ class PCA:
                 return False
             #get the config Section for the Detector type
             confSection = types.getConfsectionForType(detector.type)
-            det = typeClass(detector.id,detector.address,detector.portCommand,confSection,self.log,self.handleDetectorTimeout,self.handleDetectorReconnect)
-            self.detectors[det.id] = det
+            det = typeClass(detector.id,detector.address,detector.portCommand,confSection,self.log,self.handleDetectorTimeout,self.handleDetectorReconnect,self.heartbeat)
+            #counters have to be set before the publisher accepts updates for the detector
             self.readyDetectors[det.id]=False
+            self.detectorMappedStates[det.id] = CommonStates.ConnectionProblem
+            self.reconfiguringDetectors[det.id] = det.needsReconfiguring
+            self.detectors[det.id] = det
         except Exception as e:
             self.log("Exception while adding Detector %s: %s" %(detector.id,str(e)))
         finally:
@@ -470,6 +610,8 @@ class PCA:
             del self.detectors[id]
             del self.readyDetectors[id]
             del self.configuringDetectors[id]
+            del self.detectorMappedStates[id]
+            del self.reconfiguringDetectors[id]
             #this might take a few seconds dending on ping interval
             start_new_thread(det.terminate,())
         except Exception as e:
@@ -478,6 +620,25 @@ class PCA:
             self.sem.release()
         return codes.ok
 
+    def addDetectors(self,detectors):
+        """add a json list of Detectors with one command"""
+        if pcaStates.isActiveState(self.stateMachine.currentState):
+            return codes.busy
+        for d in json.loads(detectors):
+            if self.addDetector(detectorDataObject(d)) != codes.ok:
+                return codes.error
+        return codes.ok
+
+    def removeDetectors(self,ids):
+        """remove a json list of Detectors with one command; unknown ids are skipped"""
+        if pcaStates.isActiveState(self.stateMachine.currentState):
+            return codes.busy
+        for id in json.loads(ids):
+            ret = self.removeDetector(id)
+            if ret not in {codes.ok,codes.idUnknown}:
+                return ret
+        return codes.ok
+
     def globalSystemTimeout(self,id):
         """this function is triggered if a global System timesout"""
         self.publishQueue.put((id,stateObject([CommonStates.ConnectionProblem,CommonStates.ConnectionProblem])))
@@ -548,12 +709,9 @@ class PCA:
                             ready = False
                             break
                     else:
-                        #map if detector is ready for all detectors
-                        for id in self.detectors.keyIterator():
-                            d = self.detectors[id]
-                            dState = d.getMappedState()
-                            ready = (dState == MappedStates.Active and not d.needsReconfiguring) and ready
-                        if not ready:
+                        #all detectors need to be active and correctly configured
+                        if not self.detectorMappedStates.allEqual(MappedStates.Active) or self.reconfiguringDetectors.count(True) > 0:
+                            ready = False
                             break
                 if ready:
                     self.transition(PCATransitions.configure,nopublish=True)
@@ -605,6 +763,7 @@ class PCA:
         #Detector State changed
         elif id in self.detectors:
             det = self.detectors[id]
+            self.detectorMappedStates[id] = newState
             self.readyDetectors[id] = (newState == MappedStates.Active)
             #if configuring
             if self.stateMachine.currentState == PCAStates.Configuring_Detectors:
@@ -614,12 +773,12 @@ class PCA:
                     if det.getSystemConfig() and det.getStateObject().configTag != det.getSystemConfig().configId:
                         det.abort()
                     else:
-                        det.needsReconfiguring = False
+                        self.setDetectorNeedsReconfiguring(det,False)
                 self.configuringDetectors[id] = (newState == MappedStates.Configuring)
                 #no more configuring detectors
-                if not self.configuringDetectors[id] and not any(self.configuringDetectors.values()):
+                if not self.configuringDetectors[id] and self.configuringDetectors.count(True) == 0:
                     #all ready
-                    if all(self.readyDetectors.values()):
+                    if self.readyDetectors.allEqual(True):
                         self.transition(PCATransitions.success)
                         self.log("detector configure time"+str(time.time()-self.detector_configure_time_start))
                         if self.autoConfigure:
@@ -637,14 +796,14 @@ class PCA:
                 self.error_transition(PCATransitions.error_Detector)
             #detector is ready
             elif self.readyDetectors[id]:
-                det.needsReconfiguring = False
+                self.setDetectorNeedsReconfiguring(det,False)
                 self.configuringDetectors[id] = False
                 det = self.detectors[id]
                 #correctly configured?
                 if det.getSystemConfig() and det.getStateObject().configTag != det.getSystemConfig().configId:
                     det.abort()
                 #all detectors are ready
-                elif self.stateMachine.currentState in pcaStates.nextToConfigureSystems and "Detectors" in pcaStates.nextToConfigureSystems[self.stateMachine.currentState] and all(self.readyDetectors.values()):
+                elif self.stateMachine.currentState in pcaStates.nextToConfigureSystems and "Detectors" in pcaStates.nextToConfigureSystems[self.stateMachine.currentState] and self.readyDetectors.allEqual(True):
                     print(self.readyDetectors.values())
                     self.transition(PCATransitions.configure,nopublish=True)
                     self.transition(PCATransitions.success)
@@ -734,6 +893,11 @@ class PCA:
                 if self.FLES.getMappedState() == MappedStates.Recording:
                     self.FLES.stopRecording()
 
+    def setDetectorNeedsReconfiguring(self,detector,value):
+        """sets the needsReconfiguring flag of a Detector and keeps the reconfigure counter up to date"""
+        detector.needsReconfiguring = value
+        self.reconfiguringDetectors[detector.id] = value
+
     def transition(self,command,nopublish=False):
         """try to transition the global Statemachine"""
         oldstate = self.stateMachine.currentState
@@ -782,16 +946,21 @@ class PCA:
                 oldconfigTag = currentStateObject.configTag
                 sys.setSystemConfig(conf)
                 if oldconfigTag != conf.configId or currentStateObject.state == MappedStates.Unconfigured:
-                    sys.needsReconfiguring = True
+                    if name == "Detectors":
+                        self.setDetectorNeedsReconfiguring(sys,True)
+                    else:
+                        sys.needsReconfiguring = True
                     if lowest_in_hierarchie == None:
                         lowest_in_hierarchie = name
                     elif pcaStates.isLowerInHierarchie(name,lowest_in_hierarchie):
                         lowest_in_hierarchie = name
                 else:
-                    sys.needsReconfiguring = False
                     if conf.systemId in self.detectors:
+                        self.setDetectorNeedsReconfiguring(sys,False)
                         self.configuringDetectors[conf.systemId] = False
                         self.readyDetectors[conf.systemId] = True
+                    else:
+                        sys.needsReconfiguring = False
             if lowest_in_hierarchie == None:
                 self.log("nothing to be done for provided configuration list")
                 return codes.ok
@@ -803,7 +972,7 @@ class PCA:
                         d = self.detectors[id]
                         self.configuringDetectors[id] = True
                         self.readyDetectors[id] = False
-                        d.needsReconfiguring = True
+                        self.setDetectorNeedsReconfiguring(d,True)
                 else:
                     gs=self.globalSystems[sys]
                     gs.needsReconfiguring = True
@@ -866,56 +1035,48 @@ class PCA:
             return codes.ok
         return codes.error
 
-    def threadFunctionCall(self,id,function,retq):
-        """calls a function from Detector(id) und puts result in a given Queue"""
-        r = function()
-        if retq:
-            retq.put((id,r))
-
     def makeDetectorsReady(self):
         """tells all Detectors to get ready to start"""
         self.detector_configure_time_start = time.time()
-        threadArray = []
-        #Queue might be killed by garbage collection if one Thread returend False; if it is not set as class attribute
-        self.returnQueue = Queue()
+        calls = []
         self.sem.acquire()
         try:
             for id in self.detectors.keyIterator():
                 d = self.detectors[id]
                 if d.needsReconfiguring:
-                    t = threading.Thread(name='dready'+str(d.id), target=self.threadFunctionCall, args=(d.id, d.getReady,self.returnQueue))
-                    threadArray.append(t)
-                    t.start()
+                    calls.append((d.id,d.getReady))
+            fanOut = self.fanOutPool.start(calls)
         except Exception as e:
             self.log("Exception while readying: %s" %(str(e),))
             raise e
         finally:
             self.sem.release()
-        success = True
-        for t in threadArray:
-            id,res=self.returnQueue.get()
-            if not res:
-                d = self.detectors[id]
+        #calls beyond fanOutWorkers wait for a free thread
+        report = fanOut.wait(self.fanOutPool.timeoutFor(len(calls),self.fanOutTimeout))
+        for id in report.failures + report.timeouts:
+            d = self.detectors[id]
+            if d:
                 #put state of failed Detector in publish Queue to stop the configuring process
                 self.publishQueue.put((id,d.getStateObject()))
-                success = False
-        if success:
+        for id,e in report.errors.items():
+            self.log("Exception while readying Detector %s: %s" % (id,str(e)),True)
+        if report.success():
             return True
         else:
+            self.log("readying Detectors: %s" % report,True)
             return False
 
     def abort(self):
         """abort all Systems and Detectors"""
-        threadArray = []
-        returnQueue = Queue()
+        fanOut = None
         self.sem.acquire()
         try:
             self.globalTag=False
+            calls = []
             for id in self.detectors.keyIterator():
                 d = self.detectors[id]
-                t = threading.Thread(name='dabort'+str(d.id), target=self.threadFunctionCall, args=(d.id, d.abort, None))
-                threadArray.append(t)
-                t.start()
+                calls.append((d.id,d.abort))
+            fanOut = self.fanOutPool.start(calls)
             self.TFC.abort()
             self.DCS.abort()
             self.QA.abort()
@@ -924,8 +1085,16 @@ class PCA:
             self.log("Exception while aborting: %s" %(str(e),))
         finally:
             self.sem.release()
+        if fanOut:
+            #abort returns right away; the result is only logged
+            start_new_thread(self.logAbortReport,(fanOut,len(calls)))
         return codes.ok
 
+    def logAbortReport(self,fanOut,count):
+        report = fanOut.wait(self.fanOutPool.timeoutFor(count,self.fanOutTimeout))
+        if not report.success():
+            self.log("aborting Detectors: %s" % report,True)
+
     def log(self,logmessage,error=False):
         """log to console and logfile and publish log to external systems"""
         str=datetime.now().strftime("%Y-%m-%d %H:%M:%S")+":" + logmessage
@@ -947,11 +1116,12 @@ class PCA:
             d = self.detectors[id]
             d.terminate()
         self.terminate.set()
+        self.fanOutPool.shutdown()
         #force Queue.get to stop blocking
         self.publishQueue.put((False,False))
         self.socketLogPublish.close()
         self.socketPublish.close()
-        self.context.term()
+        ECS_tools.terminateContext()
         exit(0)
 
 if __name__ == "__main__":
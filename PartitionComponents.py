@@ -1,15 +1,16 @@
 from Statemachine import Statemachine
-import csv
+import ConfigCache
 from _thread import start_new_thread
 import zmq
 import logging
 from ECSCodes import ECSCodes
 codes = ECSCodes()
 from states import CommonStates,DCSStates,DCSTransitions, MappedStates, DetectorTransitions, FLESStates, FLESTransitions, QAStates, QATransitions, TFCStates, TFCTransitions,  GlobalSystemTransitions
-import configparser
 import time
 import ECS_tools
 import threading
+import heapq
+import itertools
 from DataObjects import stateObject
 import json
 try:
@@ -23,12 +24,254 @@ except ImproperlyConfigured:
     systemPath = ""
 
 
+class CommandRequest:
+    """a request waiting for its reply on a command channel"""
+    def __init__(self,requestId,frames):
+        self.requestId = requestId
+        self.frames = frames
+        self.reply = None
+        #exception for the requesting thread if there is no reply
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self,reply=None,error=None):
+        self.reply = reply
+        self.error = error
+        self.done.set()
+
+class HeartbeatScheduler:
+    """sends the periodic heartbeats and carries the command channels for many PartitionComponents from a single thread using one zmq Poller"""
+    def __init__(self,context):
+        self.context = context
+        #deadline heap with entries (deadline,token,component)
+        self.deadlines = []
+        self.counter = itertools.count()
+        #request ids start at 1 because an empty frame would be taken for the envelope delimiter
+        self.requestCounter = itertools.count(1)
+        #per component data: ping socket, token of the valid heap entry, wether a reply is pending, command socket and its outstanding requests
+        self.entries = {}
+        #changes from other threads; sockets may only be touched by the scheduler thread
+        self.pendingChanges = []
+        self.lock = threading.Lock()
+        self.wakeupAddress = "inproc://heartbeat%d" % id(self)
+        self.wakeupReceiver = self.context.socket(zmq.PULL)
+        self.wakeupReceiver.bind(self.wakeupAddress)
+        self.wakeupSender = self.context.socket(zmq.PUSH)
+        self.wakeupSender.setsockopt(zmq.LINGER,0)
+        self.wakeupSender.connect(self.wakeupAddress)
+        self.poller = zmq.Poller()
+        self.poller.register(self.wakeupReceiver, zmq.POLLIN)
+        #(component,isCommandSocket) for each socket
+        self.socketOwner = {}
+        self.terminated = False
+        self.thread = threading.Thread(name="heartbeat", target=self.run)
+        self.thread.start()
+
+    def register(self,component):
+        """start sending heartbeats to a component"""
+        self.queueChange("register",component)
+
+    def unregister(self,component):
+        """stop sending heartbeats to a component and close its sockets"""
+        self.queueChange("unregister",component)
+
+    def request(self,component,frames,timeout):
+        """send frames over the command channel of a component and return the reply frames; raises zmq.Again on timeout"""
+        #must not be called from the scheduler thread since it waits for the scheduler
+        request = CommandRequest(ECS_tools.intToBytes(next(self.requestCounter)),frames)
+        if not self.queueChange("request",component,request):
+            raise zmq.error.ContextTerminated()
+        if not request.done.wait(timeout/1000):
+            #reconnect policy: a request without reply means the controller is stuck or gone
+            self.queueChange("timeout",component,request)
+            raise zmq.Again()
+        if request.error:
+            raise request.error
+        return request.reply
+
+    def queueChange(self,action,component,request=None):
+        """queue a change and wake up the scheduler thread; returns False if the scheduler is terminated"""
+        self.lock.acquire()
+        try:
+            if self.terminated:
+                return False
+            self.pendingChanges.append((action,component,request))
+            self.wakeupSender.send(b'',zmq.NOBLOCK)
+            return True
+        except zmq.error.ZMQError:
+            #scheduler is already terminated
+            return False
+        finally:
+            self.lock.release()
+
+    def createSocket(self,component,socketType,isCommandSocket):
+        sock = self.context.socket(socketType)
+        sock.setsockopt(zmq.LINGER,0)
+        if isCommandSocket:
+            #back off when the controller is gone instead of retrying every 100ms
+            sock.setsockopt(zmq.RECONNECT_IVL_MAX,component.pingInterval*1000)
+        sock.connect(component.commandAddress)
+        self.poller.register(sock, zmq.POLLIN)
+        self.socketOwner[sock] = (component,isCommandSocket)
+        return sock
+
+    def createPingSocket(self,component):
+        return self.createSocket(component,zmq.REQ,False)
+
+    def closeSocket(self,sock):
+        self.poller.unregister(sock)
+        del self.socketOwner[sock]
+        sock.close()
+
+    def resetCommandSocket(self,entry,error):
+        """close the command socket of a component and fail its outstanding requests"""
+        if entry["commandSocket"]:
+            self.closeSocket(entry["commandSocket"])
+            entry["commandSocket"] = None
+        for request in entry["requests"].values():
+            request.finish(error=error)
+        entry["requests"] = {}
+
+    def schedule(self,component,delay):
+        """(re)schedule the next event of a component after delay seconds"""
+        entry = self.entries[component]
+        entry["token"] = next(self.counter)
+        heapq.heappush(self.deadlines,(time.time()+delay,entry["token"],component))
+
+    def sendRequest(self,component,request):
+        """send a request on the (persistent) command socket of a component"""
+        if component not in self.entries:
+            request.finish(error=zmq.error.ContextTerminated())
+            return
+        entry = self.entries[component]
+        if not entry["commandSocket"]:
+            entry["commandSocket"] = self.createSocket(component,zmq.DEALER,True)
+        try:
+            #the REP socket of the controller echoes the envelope [requestId,b''] with its reply
+            entry["commandSocket"].send_multipart([request.requestId,b'']+request.frames,zmq.NOBLOCK)
+            entry["requests"][request.requestId] = request
+        except zmq.error.ZMQError as e:
+            request.finish(error=e)
+
+    def applyChanges(self):
+        """apply changes queued by other threads"""
+        self.lock.acquire()
+        try:
+            changes = self.pendingChanges
+            self.pendingChanges = []
+        finally:
+            self.lock.release()
+        for action,component,request in changes:
+            if action == "register" and component not in self.entries:
+                self.entries[component] = {"socket":self.createPingSocket(component), "waiting":False, "token":None, "commandSocket":None, "requests":{}}
+                self.schedule(component,0)
+            elif action == "unregister" and component in self.entries:
+                entry = self.entries[component]
+                self.closeSocket(entry["socket"])
+                self.resetCommandSocket(entry,zmq.error.ContextTerminated())
+                del self.entries[component]
+            elif action == "request":
+                self.sendRequest(component,request)
+            elif action == "timeout" and component in self.entries:
+                entry = self.entries[component]
+                #only if the request wasn't answered in the meantime
+                if request.requestId in entry["requests"]:
+                    self.resetCommandSocket(entry,zmq.Again())
+
+    def handleDeadline(self,component):
+        """send a ping or handle a timeout if the last ping wasn't answered"""
+        entry = self.entries[component]
+        if entry["waiting"]:
+            entry["waiting"] = False
+            component.pingTimeout()
+            #reset socket
+            self.closeSocket(entry["socket"])
+            entry["socket"] = self.createPingSocket(component)
+            self.schedule(component,component.pingInterval)
+            return
+        try:
+            entry["socket"].send(codes.ping,zmq.NOBLOCK)
+            entry["waiting"] = True
+            self.schedule(component,component.receive_timeout/1000)
+        except zmq.error.ZMQError:
+            #unexpected error reset socket
+            self.closeSocket(entry["socket"])
+            entry["socket"] = self.createPingSocket(component)
+            self.schedule(component,component.pingInterval)
+
+    def receiveReply(self,component,sock):
+        """hand a reply on a command socket to the waiting request"""
+        message = sock.recv_multipart()
+        if len(message) < 2 or message[1] != b'':
+            return
+        request = self.entries[component]["requests"].pop(message[0],None)
+        #replies of requests which timed out are dropped
+        if request:
+            request.finish(reply=message[2:])
+
+    def run(self):
+        """scheduler loop"""
+        try:
+            while True:
+                now = time.time()
+                while self.deadlines and self.deadlines[0][0] <= now:
+                    deadline,token,component = heapq.heappop(self.deadlines)
+                    #skip entries of removed components or entries which have been rescheduled
+                    if component in self.entries and self.entries[component]["token"] == token:
+                        self.handleDeadline(component)
+                if self.deadlines:
+                    timeout = max(0,(self.deadlines[0][0]-time.time())*1000)
+                else:
+                    timeout = None
+                for sock,event in self.poller.poll(timeout):
+                    if sock == self.wakeupReceiver:
+                        while True:
+                            try:
+                                self.wakeupReceiver.recv(zmq.NOBLOCK)
+                            except zmq.Again:
+                                break
+                        self.applyChanges()
+                        continue
+                    owner = self.socketOwner.get(sock)
+                    if owner == None:
+                        #socket was closed by a change in this cycle
+                        continue
+                    component,isCommandSocket = owner
+                    if isCommandSocket:
+                        self.receiveReply(component,sock)
+                        continue
+                    sock.recv()
+                    if not self.entries[component]["waiting"]:
+                        continue
+                    self.entries[component]["waiting"] = False
+                    component.pingReceived()
+                    self.schedule(component,component.pingInterval)
+        except zmq.error.ContextTerminated:
+            #process is terminating; end loop
+            pass
+        finally:
+            self.lock.acquire()
+            try:
+                self.terminated = True
+                changes = self.pendingChanges
+                self.pendingChanges = []
+                self.wakeupSender.close()
+            finally:
+                self.lock.release()
+            for action,component,request in changes:
+                if action == "request":
+                    request.finish(error=zmq.error.ContextTerminated())
+            for entry in self.entries.values():
+                for request in entry["requests"].values():
+                    request.finish(error=zmq.error.ContextTerminated())
+            for sock in list(self.socketOwner):
+                sock.close()
+            self.wakeupReceiver.close()
+
 class PartitionComponent:
     """interface class to subsystems for pcas"""
-    def __init__(self,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
-        configParser = configparser.ConfigParser()
-        configParser.read(systemPath+"subsystem.cfg")
-        conf = configParser[confSection]
+    def __init__(self,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
+        conf = ConfigCache.getConfigSection(systemPath+"subsystem.cfg",confSection)
         self.logfunction = logfunction
         self.abort_bool = False
         self.currentStateObject = None
@@ -43,63 +286,49 @@ class PartitionComponent:
         self.pingInterval = int(conf["pingInterval"])
         self.commandAddress = ("tcp://%s:%s" % (address ,portCommand))
 
-        #zmq Context for Detector
-        self.zmqContext = zmq.Context()
 
 
-        #ping Thread will set Statemachine on connection
+        #heartbeat will set Statemachine on connection
         self.connected = None
+        #True while the state is fetched after a reconnect
+        self.connecting = False
         self.stateMachine = Statemachine(systemPath+conf["stateFile"],False)
 
-        self.mapper = {}
-        with open(systemPath+conf["mapFile"], 'r') as file:
-            reader = csv.reader(file, delimiter=',')
-            for row in reader:
-                if len(row) == 2:
-                    self.mapper[row[0]] = row[1]
-        start_new_thread(self.ping,())
-
-    def createPingSocket(self):
-        pingSocket = self.zmqContext.socket(zmq.REQ)
-        pingSocket.connect(self.commandAddress)
-        pingSocket.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-        pingSocket.setsockopt(zmq.LINGER,0)
-        return pingSocket
-
-    def ping(self):
-        """sends periodic heartbeats to the subsystem"""
-        pingSocket = self.createPingSocket()
-        while True:
-            try:
-                pingSocket.send(codes.ping)
-                pingSocket.recv()
-                if self.connected != True:
-                    self.logfunction("%s is connected" % self.name)
-                    ret = self.getStateFromSystem()
-                    if not ret:
-                        #sometimes when PCA and DC start both at once there is a timeout from getting state(maybe the socket isn't ready idk)
-                        continue
-                    state,configTag = ret
-                    self.connected = True
-                    self.reconnectFunction(stateObject([self.getMappedStateForState(state),state,configTag,None]))
-            except zmq.Again:
-                #timeout
-                if self.connected == True or self.connected == None:
-                    self.connected = False
-                    self.logfunction("timeout pinging %s" % self.name, True)
-                    self.timeoutFunction()
-                #reset socket
-                pingSocket.close()
-                pingSocket = self.createPingSocket()
-            except zmq.error.ContextTerminated:
-                #process is terminating; end loop
-                break
-            except zmq.error.ZMQError:
-                #unexpected error
-                #reset socket
-                pingSocket.close()
-                pingSocket = self.createPingSocket()
-            time.sleep(self.pingInterval)
+        self.mapper = ConfigCache.getMapping(systemPath+conf["mapFile"])
+        self.heartbeat = heartbeat
+        self.heartbeat.register(self)
+
+    def request(self,frames):
+        """send a request over the persistent command channel and return the reply frames; raises zmq.Again on timeout"""
+        return self.heartbeat.request(self,frames,self.receive_timeout)
+
+    def pingReceived(self):
+        """handler for an answered heartbeat (called by the HeartbeatScheduler)"""
+        if self.connected != True and not self.connecting:
+            #getting the state can take up to a timeout; don't block the heartbeat for the other systems
+            self.connecting = True
+            start_new_thread(self.connect,())
+
+    def connect(self):
+        """gets the current state after a (re)connect"""
+        try:
+            self.logfunction("%s is connected" % self.name)
+            ret = self.getStateFromSystem()
+            if not ret:
+                #sometimes when PCA and DC start both at once there is a timeout from getting state(maybe the socket isn't ready idk); retry on next heartbeat
+                return
+            state,configTag = ret
+            self.connected = True
+            self.reconnectFunction(stateObject([self.getMappedStateForState(state),state,configTag,None]))
+        finally:
+            self.connecting = False
+
+    def pingTimeout(self):
+        """handler for an unanswered heartbeat (called by the HeartbeatScheduler)"""
+        if self.connected == True or self.connected == None:
+            self.connected = False
+            self.logfunction("timeout pinging %s" % self.name, True)
+            self.timeoutFunction()
 
     def checkSequence(self,sequenceNumber):
         """returns True if given number bigger than the current one"""
@@ -151,10 +380,10 @@ class PartitionComponent:
 
 class Detector(PartitionComponent):
 
-    def __init__(self,id,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
+    def __init__(self,id,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
         self.id = id
         self.name = "Detector %s" % id
-        super().__init__(address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+        super().__init__(address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
 
     def reconnectFunction(self,state):
         """reconnect handler function"""
@@ -168,14 +397,6 @@ class Detector(PartitionComponent):
         """gets the system id"""
         return self.id
 
-    def createSendSocket(self):
-        """init or reset the send Socket"""
-        socketSender = self.zmqContext.socket(zmq.REQ)
-        socketSender.connect(self.commandAddress)
-        socketSender.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-        socketSender.setsockopt(zmq.LINGER,0)
-        return socketSender
-
     def transitionRequest(self,command,sendConfig=False):
         """request a transition from a Detector"""
         self.abort_bool = False
@@ -186,14 +407,13 @@ class Detector(PartitionComponent):
             self.logfunction("Transition %s is not possible for Detector %s in current state" % (command,self.id))
             return False
         try:
-            socketSender = self.createSendSocket()
             if sendConfig:
-                socketSender.send_multipart([command.encode(),self.config.asJsonString().encode()])
+                message = [command.encode(),self.config.asJsonString().encode()]
             else:
-                socketSender.send_multipart([command.encode()])
+                message = [command.encode()]
             #check if the command has arrived
             #receive status code
-            returnMessage = socketSender.recv()
+            returnMessage = self.request(message)[0]
             if returnMessage == codes.busy:
                 self.logfunction("Detector %s is busy" % self.id)
                 return False
@@ -203,21 +423,13 @@ class Detector(PartitionComponent):
         except zmq.error.ContextTerminated:
             self.logfunction("Detector "+str(self.id)+" was terminated during "+ command,True)
             return False
-        finally:
-            socketSender.close()
         return True
 
     def getStateFromSystem(self):
         """get's the state from the DetectorController eturns False when a Problem occurs. Use on startup or if there has been a crash or a connection Problem"""
         state = False
-        requestSocket = None
         try:
-            requestSocket = self.zmqContext.socket(zmq.REQ)
-            requestSocket.connect(self.commandAddress)
-            requestSocket.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-            requestSocket.setsockopt(zmq.LINGER,0)
-            requestSocket.send(codes.pcaAsksForDetectorStatus)
-            ret = requestSocket.recv_multipart()
+            ret = self.request([codes.pcaAsksForDetectorStatus])
             ret = list(map(lambda x:x.decode(),ret))
             configTag = None
             if len(ret) > 1:
@@ -229,13 +441,11 @@ class Detector(PartitionComponent):
             self.logfunction("timeout getting Detector Status for Detector %s" % (self.id) ,True)
         except Exception as e:
             self.logfunction("error getting Detector Status for Detector %s: %s" % (self.id,str(e)) ,True)
-        finally:
-            if requestSocket:
-                requestSocket.close()
 
     def terminate(self):
-        """ stops the ping thread"""
-        self.zmqContext.term()
+        """ stops the heartbeat and closes the sockets of the Detector"""
+        #the heartbeat closes the ping and command socket; outstanding requests fail with ContextTerminated
+        self.heartbeat.unregister(self)
         self.logfunction("Detector "+str(self.id)+" was terminated",True)
 
     def error(self):
@@ -294,10 +504,10 @@ class RICH(DetectorA):
 
 class GlobalSystemComponent(PartitionComponent):
     """generic class for global systems"""
-    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
+    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
         self.pcaId = pcaId
         self.name = "Unset Name"
-        super().__init__(address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+        super().__init__(address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
 
     def reconnectFunction(self,state):
         """reconnect handler function"""
@@ -318,19 +528,14 @@ class GlobalSystemComponent(PartitionComponent):
         if not self.stateMachine.checkIfPossible(command):
             self.logfunction("Transition %s is not possible for %s in current state" % (command,self.name))
             return False
-        socketSender = None
         try:
-            socketSender = self.zmqContext.socket(zmq.REQ)
-            socketSender.connect(self.commandAddress)
-            socketSender.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-            socketSender.setsockopt(zmq.LINGER,0)
             if sendConfig:
-                socketSender.send_multipart([command.encode(),self.pcaId.encode(),self.config.asJsonString().encode()])
+                message = [command.encode(),self.pcaId.encode(),self.config.asJsonString().encode()]
             else:
-                socketSender.send_multipart([command.encode(),self.pcaId.encode()])
+                message = [command.encode(),self.pcaId.encode()]
             #check if the command has arrived
             #receive status code
-            returnMessage = socketSender.recv()
+            returnMessage = self.request(message)[0]
             if returnMessage == codes.busy:
                 self.logfunction("%s is busy" % self.name)
                 return False
@@ -340,22 +545,13 @@ class GlobalSystemComponent(PartitionComponent):
         except zmq.error.ContextTerminated:
             self.logfunction(str(self.name)+" was terminated during "+ command,True)
             return False
-        finally:
-            if socketSender:
-                socketSender.close()
         return True
 
     def getStateFromSystem(self):
         """get current state from controller agent"""
         state = False
-        requestSocket = None
         try:
-            requestSocket = self.zmqContext.socket(zmq.REQ)
-            requestSocket.connect(self.commandAddress)
-            requestSocket.setsockopt(zmq.RCVTIMEO, self.receive_timeout)
-            requestSocket.setsockopt(zmq.LINGER,0)
-            requestSocket.send_multipart([codes.pcaAsksForDetectorStatus,self.pcaId.encode()])
-            ret = requestSocket.recv_multipart()
+            ret = self.request([codes.pcaAsksForDetectorStatus,self.pcaId.encode()])
             ret = list(map(lambda x:x.decode(),ret))
             configTag = None
             if len(ret) > 1:
@@ -368,9 +564,6 @@ class GlobalSystemComponent(PartitionComponent):
         except Exception as e:
             self.logfunction("error getting Status for %s" % (self.name,str(e)) ,True)
             raise e
-        finally:
-            if requestSocket:
-                requestSocket.close()
 
     def reset(self):
         """reset the system"""
@@ -380,8 +573,8 @@ class GlobalSystemComponent(PartitionComponent):
         return self.transitionRequest(GlobalSystemTransitions.reset)
 
 class DCS(GlobalSystemComponent):
-    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
-        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
+        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
         self.name = "DCS"
 
     def getReady(self):
@@ -395,8 +588,8 @@ class DCS(GlobalSystemComponent):
         return self.transitionRequest(DCSTransitions.abort)
 
 class TFC(GlobalSystemComponent):
-    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
-        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
+        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
         self.name = "TFC"
 
     def getReady(self):
@@ -410,8 +603,8 @@ class TFC(GlobalSystemComponent):
         return self.transitionRequest(TFCTransitions.abort)
 
 class QA(GlobalSystemComponent):
-    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
-        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
+        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
         self.name = "QA"
 
     def startRecording(self):
@@ -437,8 +630,8 @@ class QA(GlobalSystemComponent):
         return self.transitionRequest(QATransitions.abort)
 
 class FLES(GlobalSystemComponent):
-    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction):
-        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction)
+    def __init__(self,pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat):
+        super().__init__(pcaId,address,portCommand,confSection,logfunction,pcaTimeoutFunction,pcaReconnectFunction,heartbeat)
         self.name = "FLES"
 
     def startRecording(self):
@@ -0,0 +1,76 @@
+import threading
+import paramiko
+
+class SSHPool:
+    """keeps one ssh connection per host which is shared by all commands for that host and limits the number of commands running on a host at once"""
+    def __init__(self,maxPerHost=8,connectTimeout=10):
+        #sshd allows 10 sessions per connection by default (MaxSessions)
+        self.maxPerHost = maxPerHost
+        self.connectTimeout = connectTimeout
+        self.clients = {}
+        #per host: lock for (re)connecting and semaphore for running commands
+        self.hostLocks = {}
+        self.hostSlots = {}
+        self.lock = threading.Lock()
+
+    def hostState(self,host):
+        with self.lock:
+            if host not in self.hostLocks:
+                self.hostLocks[host] = threading.Lock()
+                self.hostSlots[host] = threading.BoundedSemaphore(self.maxPerHost)
+            return self.hostLocks[host],self.hostSlots[host]
+
+    def getClient(self,host):
+        """returns the connection to host; connects if there is none or it died"""
+        lock,slots = self.hostState(host)
+        with lock:
+            client = self.clients.get(host)
+            if client:
+                transport = client.get_transport()
+                if transport and transport.is_active():
+                    return client
+                client.close()
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            #login on client computers needs a rsa key
+            client.connect(host,timeout=self.connectTimeout)
+            #notice dead connections between commands
+            client.get_transport().set_keepalive(30)
+            self.clients[host] = client
+            return client
+
+    def drop(self,host,client):
+        lock,slots = self.hostState(host)
+        with lock:
+            if self.clients.get(host) is client:
+                del self.clients[host]
+        client.close()
+
+    def run(self,host,command,timeout=None):
+        """run a command on host and return (exit status,stdout); a broken connection is reconnected once, other errors and timeouts fail only this command"""
+        lock,slots = self.hostState(host)
+        with slots:
+            for attempt in range(2):
+                client = self.getClient(host)
+                try:
+                    stdin, stdout, stderr = client.exec_command(command,timeout=timeout)
+                    output = stdout.read().decode()
+                    return stdout.channel.recv_exit_status(),output
+                except TimeoutError:
+                    raise
+                except (paramiko.SSHException,EOFError,OSError):
+                    transport = client.get_transport()
+                    if transport and transport.is_active():
+                        #only this command failed(e.g. sshd rejected the session); the connection is still used by the other commands for host
+                        raise
+                    #connection was closed e.g. by a restart of the host
+                    self.drop(host,client)
+                    if attempt == 1:
+                        raise
+
+    def close(self):
+        with self.lock:
+            clients = list(self.clients.items())
+            self.clients = {}
+        for host,client in clients:
+            client.close()
@@ -0,0 +1,155 @@
+"""binary encoding for lists of state records (id,sequence,state)
+
+payload: codecId(4 bytes) varint(number of strings) strings varint(number of records) records
+string: varint(length) utf-8 bytes
+record: varint(id reference) varint(sequence) kind(1 byte) [4 state references for kind stateRecord]
+reference: 0 is None, 1 is False, 2 is True, 3..len(stateTable)+2 is a known state, everything above an entry of the string table of the payload
+values other than strings, None, False and True can't be encoded (encode raises TypeError)
+"""
+import hashlib
+import sys
+import states
+from ECSCodes import ECSCodes
+codes = ECSCodes()
+from DataObjects import stateObject
+
+#kind of a record
+stateRecord = 0
+resetRecord = 1
+removedRecord = 2
+
+def buildStateTable():
+    """all state names from the states module in a fixed order"""
+    names = set()
+    for className in dir(states):
+        cls = getattr(states,className)
+        if not isinstance(cls,type) or not className.endswith("States"):
+            continue
+        for attribute in dir(cls):
+            value = getattr(cls,attribute)
+            if not attribute.startswith("_") and isinstance(value,str):
+                names.add(value)
+    return sorted(names)
+
+#references of values which aren't strings e.g. the mapped state False of a system without a mapping
+constants = [None,False,True]
+stateTable = buildStateTable()
+stateCodes = dict((name,i+len(constants)) for i,name in enumerate(stateTable))
+firstStringReference = len(constants)+len(stateTable)
+#first byte is the codec version; it is never '[' so binary payloads can be told apart from json payloads
+codecId = b'\x02' + hashlib.sha1("\n".join(stateTable).encode()).digest()[:3]
+
+def isBinary(payload):
+    return payload[:1] != b'['
+
+def writeVarint(out,value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def readVarint(payload,position):
+    """returns (value,new position)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = payload[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value,position
+        shift += 7
+
+class Encoder:
+    """builds the string table of one payload"""
+    def __init__(self):
+        self.strings = []
+        self.stringIndex = {}
+
+    def reference(self,value):
+        if value is None:
+            return 0
+        if value is False:
+            return 1
+        if value is True:
+            return 2
+        if not isinstance(value,str):
+            raise TypeError("state codec can't encode %s" % type(value).__name__)
+        code = stateCodes.get(value)
+        if code:
+            return code
+        index = self.stringIndex.get(value)
+        if index == None:
+            index = len(self.strings)
+            self.stringIndex[value] = index
+            self.strings.append(value)
+        return firstStringReference + index
+
+def encode(records):
+    """encode a list of (id,sequence,state) where state is a stateObject, codes.reset or codes.removed; raises TypeError for values the codec can't represent"""
+    encoder = Encoder()
+    reference = encoder.reference
+    body = bytearray()
+    append = body.append
+    for id,sequence,state in records:
+        writeVarint(body,reference(id))
+        writeVarint(body,sequence)
+        if state == codes.reset:
+            append(resetRecord)
+        elif state == codes.removed:
+            append(removedRecord)
+        else:
+            append(stateRecord)
+            for value in (state.state,state.unmappedState,state.configTag,state.comment):
+                #most references fit into one byte
+                ref = reference(value)
+                if ref < 0x80:
+                    append(ref)
+                else:
+                    writeVarint(body,ref)
+    out = bytearray(codecId)
+    writeVarint(out,len(encoder.strings))
+    for string in encoder.strings:
+        string = string.encode()
+        writeVarint(out,len(string))
+        out += string
+    writeVarint(out,len(records))
+    out += body
+    return bytes(out)
+
+def decode(payload):
+    """decode a payload into a list of [id,sequence,state]; raises ValueError for payloads of another codec"""
+    if payload[:4] != codecId:
+        raise ValueError("unknown state codec %s" % payload[:4].hex())
+    position = 4
+    count,position = readVarint(payload,position)
+    values = constants + stateTable
+    for i in range(count):
+        length,position = readVarint(payload,position)
+        #ids and tags repeat in every message; keep one string object of each
+        values.append(sys.intern(payload[position:position+length].decode()))
+        position += length
+    count,position = readVarint(payload,position)
+    records = []
+    for i in range(count):
+        id,position = readVarint(payload,position)
+        sequence,position = readVarint(payload,position)
+        kind = payload[position]
+        position += 1
+        if kind == resetRecord:
+            state = codes.reset
+        elif kind == removedRecord:
+            state = codes.removed
+        else:
+            references = []
+            for j in range(4):
+                #most references fit into one byte
+                reference = payload[position]
+                if reference < 0x80:
+                    position += 1
+                else:
+                    reference,position = readVarint(payload,position)
+                references.append(values[reference])
+            state = stateObject(references)
+        records.append([values[id],sequence,state])
+    return records
@@ -1,5 +1,5 @@
-import csv
 import threading
+import ConfigCache
 
 
 class Statemachine:
@@ -15,18 +15,9 @@ class Statemachine:
 
         Graph is Dictionary with States as Keys and values as other Dictionarys with Keys as Transitions and values as Followup States
         """
-        self.graph = dict({})
-
+        #the graph is compiled once per file and shared by all Statemachines using it
+        self.graph = ConfigCache.getGraph(csvGraph)
         self.currentState = initState
-        #read Graph from csv file ---- | state | transition | next State |
-        with open(csvGraph, 'r') as file:
-            reader = csv.reader(file, delimiter=',')
-            for row in reader:
-                if len(row) == 3:
-                    if row[0] in self.graph:
-                        self.graph[row[0]][row[1]] = row[2]
-                    else:
-                        self.graph[row[0]] = dict({row[1]:row[2]})
 
     def transition(self,command):
         """transitions Statemachine with command returns True on success or False if command is not possible in current state"""
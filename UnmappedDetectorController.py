@@ -4,7 +4,6 @@ codes = ECSCodes()
 import ECS_tools
 import threading
 import zmq
-from multiprocessing import Queue
 import time
 from _thread import start_new_thread
 from DataObjects import stateObject
@@ -17,17 +16,22 @@ class UnmappedDetectorController:
     def __init__(self,detectorData,publishPort,updatePort,currentStatePort,logfunction,webSocket):
         self.detectors = ECS_tools.MapWrapper()
         self.statusMap = ECS_tools.MapWrapper()
+        #serialized statusMap for state table requests
+        self.snapshotCache = ECS_tools.SnapshotCache(self.statusMap)
         self.log=logfunction
         self.terminate = threading.Event()
         self.id = "unmapped"
-        self.context = zmq.Context()
+        #the ECA's process wide Context
+        self.context = ECS_tools.getContext()
         self.webSocket = webSocket
+        #one heartbeat thread for all Detectors
+        self.heartbeat = PartitionComponents.HeartbeatScheduler(self.context)
 
         #ZMQ Socket to publish new state Updates
         self.socketPublish = self.context.socket(zmq.PUB)
         #todo the connect takes a little time messages until then will be lost
         self.socketPublish.bind("tcp://*:%s" % publishPort)
-        self.publishQueue = Queue()
+        self.publishQueue = ECS_tools.EventQueue()
         self.sequence = 0
 
         #Socket to serve current statusMap
@@ -71,8 +75,13 @@ class UnmappedDetectorController:
             self.sequence = self.sequence + 1
             if state == codes.removed:
                 del self.statusMap[id]
+                self.snapshotCache.record(self.sequence,id,state)
+            elif state == codes.reset:
+                self.snapshotCache.reset(self.sequence)
             elif id != self.id:
                 self.statusMap[id] = (self.sequence,state)
+                self.snapshotCache.record(self.sequence,id,state)
+            self.snapshotCache.changed(self.sequence)
             ECS_tools.send_status(self.socketPublish,id,self.sequence,state)
             if state == codes.reset:
                 #reset code for Web Browser
@@ -129,12 +138,22 @@ class UnmappedDetectorController:
 
                 origin = messsage[0]
                 request = messsage[1]
+                if request == codes.stateSnapshot:
+                    #whole table in one message; only serialized again if there were changes since the last request
+                    binary = len(messsage) > 2 and ECS_tools.wantsBinary(messsage[2])
+                    ECS_tools.send_snapshot(self.socketServeCurrentStatus,origin,self.snapshotCache,binary)
+                    continue
+                if request == codes.stateSnapshotSince and len(messsage) > 3:
+                    #changes since the given sequence number (or the whole table if they aren't in the journal anymore)
+                    binary = len(messsage) > 4 and ECS_tools.wantsBinary(messsage[4])
+                    ECS_tools.send_snapshot_since(self.socketServeCurrentStatus,origin,self.snapshotCache,messsage[2],messsage[3],binary)
+                    continue
                 if request != codes.hello:
                     self.log("wrong request in socketServeCurrentStatus \n",True)
                     continue
 
                 # send each Statusmap entry to origin
-                items = self.statusMap.copy().items()
+                items = self.statusMap.items()
                 for key, value in items:
                     #send identity of origin first
                     self.socketServeCurrentStatus.send(origin,zmq.SNDMORE)
@@ -172,7 +191,7 @@ class UnmappedDetectorController:
         if not typeClass:
             return False
         confSection = types.getConfsectionForType(detector.type)
-        det = typeClass(detector.id,detector.address,detector.portCommand,confSection,self.log,self.handleDetectorTimeout,self.handleDetectorReconnect)
+        det = typeClass(detector.id,detector.address,detector.portCommand,confSection,self.log,self.handleDetectorTimeout,self.handleDetectorReconnect,self.heartbeat)
         self.detectors[det.id] = det
         return True
 
@@ -191,7 +210,9 @@ class UnmappedDetectorController:
     def terminateContoller(self):
         self.terminate.set()
         self.publishQueue.put((False,False))
-        self.context.term()
+        for id in self.detectors.keyIterator():
+            self.detectors[id].terminate()
+        #the publisher closes its socket itself; the blocking threads stop when the ECA terminates the shared Context
 
     def isDetectorConnected(self,detectorId):
         """returns True if detector is connected"""
@@ -9,6 +9,7 @@ import ssl
 from django.contrib.sessions.models import Session
 from django.contrib.auth.models import User
 from django.conf import settings
+from ECS_tools import EventQueue
 
 class WebSocket:
     """websockets for the web UI"""
@@ -32,6 +33,21 @@ class WebSocket:
         t=threading.Thread(target=f)
         t.start()
 
+        #a send blocks until every browser received the message; callers(e.g. the reactor thread of the PCAHandlers) only queue it
+        self.sendQueue = EventQueue()
+        self.sender = threading.Thread(name="webSocketSender",target=self.sendQueued,daemon=True)
+        self.sender.start()
+
+    def sendQueued(self):
+        """send the queued messages in order (sender thread)"""
+        loop = asyncio.new_event_loop()
+        while True:
+            for send,update,pcaId in self.sendQueue.drain():
+                try:
+                    loop.run_until_complete(send(update,pcaId))
+                except Exception as e:
+                    print("error sending websocket message: %s" % str(e))
+
     def addPCA(self,pcaId):
         """create new connections entry for a new pca"""
         self.openConnections[pcaId]=set()
@@ -68,9 +84,8 @@ class WebSocket:
 
 
     def sendUpdate(self,update,pcaId):
-        """send update to a websocket pca group"""
-        l = asyncio.new_event_loop()
-        l.run_until_complete(self.__async_sendUpdate(update,pcaId))
+        """send update to a websocket pca group (doesn't wait for the send)"""
+        self.sendQueue.put((self.__async_sendUpdate,update,pcaId))
 
     @asyncio.coroutine
     async def __async_send(self,user,message,lock):
@@ -96,9 +111,8 @@ class WebSocket:
             await asyncio.wait([self.__async_send(user,message,self.webSocketLocks[user]) for user in self.openConnections["ecs"]])
 
     def sendLogUpdate(self,update,pcaId):
-        """send logupdate to a pca group"""
-        l = asyncio.new_event_loop()
-        l.run_until_complete(self.__async_sendLogUpdate(update,pcaId))
+        """send logupdate to a pca group (doesn't wait for the send)"""
+        self.sendQueue.put((self.__async_sendLogUpdate,update,pcaId))
 
     async def __async_sendLogUpdate(self,logmessage,pcaId):
         """send logupdate to a pca group"""
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""throughput of ECS_tools.EventQueue compared to multiprocessing.Queue: one producer and one consumer thread handing over stateObjects
+
+usage: python benchmarkEventQueue.py [number of events]
+"""
+import sys
+import time
+import threading
+from multiprocessing import Queue
+from queue import Empty
+from ECS_tools import EventQueue
+from DataObjects import stateObject
+
+def produce(queue,events):
+    state = stateObject(["Ready","Ready","tag",None])
+    for i in range(events):
+        queue.put(("detector%d" % (i % 100),state))
+
+def benchmark(queue,events,consume):
+    producer = threading.Thread(target=produce,args=(queue,events))
+    start = time.perf_counter()
+    producer.start()
+    consume(queue,events)
+    producer.join()
+    return events/(time.perf_counter()-start)
+
+def consumeGet(queue,events):
+    for i in range(events):
+        queue.get()
+
+def consumeDrain(batchSize):
+    def consume(queue,events):
+        received = 0
+        while received < events:
+            received += len(queue.drain(batchSize))
+    return consume
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = [
+        ("multiprocessing.Queue get", benchmark(Queue(),events,consumeGet)),
+        ("EventQueue get", benchmark(EventQueue(),events,consumeGet)),
+        ("EventQueue drain(500)", benchmark(EventQueue(),events,consumeDrain(500))),
+    ]
+    print("%d events, one producer and one consumer thread" % events)
+    for name,rate in results:
+        print("  %-28s %9.0f events/s" % (name,rate))
@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+"""bytes on the wire and encode/decode time of the binary state codec compared to the json batch format
+
+usage: python benchmarkStateCodec.py [number of records]
+"""
+import sys
+import timeit
+import ECS_tools
+from DataObjects import stateObject
+
+def makeRecords(count):
+    """records like a PCA publishes them: a tag on 2/3 and a comment on 1/5 of the records"""
+    states = ["Ready","Running","Unconfigured","Configuring","Error"]
+    records = []
+    for i in range(count):
+        state = states[i % len(states)]
+        tag = "tag%d" % (i % 10) if i % 3 else None
+        comment = "comment %d" % i if i % 5 == 0 else None
+        records.append(("detector%d" % i,i+1,stateObject([state,state,tag,comment])))
+    return records
+
+def measure(records,binary,repeat=20):
+    payload = ECS_tools.encode_records(records,binary)
+    encode = min(timeit.repeat(lambda: ECS_tools.encode_records(records,binary),number=1,repeat=repeat))
+    decode = min(timeit.repeat(lambda: ECS_tools.decode_status_batch(payload),number=1,repeat=repeat))
+    return len(payload),encode,decode
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    records = makeRecords(count)
+    print("%d records" % count)
+    for name,binary in (("json",False),("binary",True)):
+        size,encode,decode = measure(records,binary)
+        print("  %-6s %6.1f bytes/record, encode %5.2fus, decode %5.2fus" % (name,size/count,encode/count*1e6,decode/count*1e6))
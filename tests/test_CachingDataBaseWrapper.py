@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+import DataBaseWrapper
+from ECSCodes import ECSCodes
+codes = ECSCodes()
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class CachingDataBaseWrapperTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataBaseFile = os.path.join(self.directory,"ECS_database.db")
+        shutil.copy(os.path.join(repository,"Django","ECS_GUI","ECS_database.db"),self.dataBaseFile)
+        self.oldDataBaseFile = DataBaseWrapper.dataBaseFile
+        DataBaseWrapper.dataBaseFile = self.dataBaseFile
+        self.database = DataBaseWrapper.CachingDataBaseWrapper(lambda *args: None)
+
+    def tearDown(self):
+        DataBaseWrapper.dataBaseFile = self.oldDataBaseFile
+        DataBaseWrapper.getConnectionPool(self.dataBaseFile).close()
+        shutil.rmtree(self.directory)
+
+    def testLookupsAreCached(self):
+        detector = self.database.getDetector("1")
+        self.assertIs(self.database.getDetector("1"),detector)
+        statistics = self.database.cacheStatistics()["getDetector"]
+        self.assertEqual((statistics["hits"],statistics["misses"]),(1,1))
+
+    def testUnknownIdsAreNotCached(self):
+        for i in range(10):
+            self.assertEqual(self.database.getDetector("unknown%d" % i),codes.idUnknown)
+            self.assertEqual(self.database.getPartition("unknown%d" % i),codes.idUnknown)
+        self.assertEqual(len(self.database.cache),0)
+
+    def testCacheIsBounded(self):
+        self.database.maxEntries = 3
+        for id in ("1","2","3"):
+            self.database.getDetector(id)
+        #a hit makes "1" the most recently used entry
+        self.database.getDetector("1")
+        self.database.getDetector("4")
+        self.assertEqual(list(self.database.cache),[("getDetector","3"),("getDetector","1"),("getDetector","4")])
+        self.assertEqual(len(self.database.replies),3)
+
+    def testResultLoadedDuringInvalidationIsNotStored(self):
+        def load():
+            #another thread changes the detector while it is loaded
+            self.database.invalidate([("getDetector","1")])
+            return "old value"
+        self.assertEqual(self.database.lookup("getDetector","1",load),"old value")
+        self.assertNotIn(("getDetector","1"),self.database.cache)
+
+    def testInvalidationsAreRepeatedAfterTransaction(self):
+        with self.database.transaction():
+            self.database.invalidate([("getDetector","1")],("getAllPartitions",))
+            #read by another thread before the commit
+            self.database.lookup("getDetector","1",lambda: "old value")
+            self.database.lookup("getAllPartitions",None,lambda: "old value")
+            self.assertIn(("getDetector","1"),self.database.cache)
+        self.assertNotIn(("getDetector","1"),self.database.cache)
+        self.assertNotIn(("getAllPartitions",None),self.database.cache)
+
+    def testMoveDetectorsInvalidatesAffectedLookups(self):
+        for pcaId in ("pca1","pca2","demo"):
+            self.database.getDetectorsForPartition(pcaId)
+        for detId in ("1","7","TRD"):
+            self.database.getPartitionForDetector(detId)
+        self.database.getDetector("1")
+        self.database.getAllUnmappedDetectors()
+        self.assertEqual(self.database.moveDetectors({"1":"pca2","3":None}),codes.ok)
+        cache = self.database.cache
+        #old and new partition, partition of the moved detectors and the unmapped detectors
+        for key in (("getDetectorsForPartition","pca1"),("getDetectorsForPartition","pca2"),("getPartitionForDetector","1"),("getAllUnmappedDetectors",None)):
+            self.assertNotIn(key,cache)
+        #not affected
+        for key in (("getDetectorsForPartition","demo"),("getPartitionForDetector","7"),("getPartitionForDetector","TRD"),("getDetector","1")):
+            self.assertIn(key,cache)
+        self.assertIn("1",[d.id for d in self.database.getDetectorsForPartition("pca2")])
+        self.assertNotIn("3",[d.id for d in self.database.getDetectorsForPartition("pca1")])
+        self.assertIn("3",[d.id for d in self.database.getAllUnmappedDetectors()])
+        self.assertEqual(self.database.getPartitionForDetector("1").id,"pca2")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import DataBaseWrapper
+import DataBaseMigrations
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+detectorCount = 10000
+partitionCount = 100
+
+class QueryPlanTest(unittest.TestCase):
+    """the lookups of a PCA have to stay index driven for installations with many detectors"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.dataBaseFile = os.path.join(cls.directory,"ECS_database.db")
+        shutil.copy(os.path.join(repository,"Django","ECS_GUI","ECS_database.db"),cls.dataBaseFile)
+        #the wrapper migrates the database (indexes and TagCompatibility) when it is created
+        cls.oldDataBaseFile = DataBaseWrapper.dataBaseFile
+        DataBaseWrapper.dataBaseFile = cls.dataBaseFile
+        cls.database = DataBaseWrapper.DataBaseWrapper(lambda *args: None)
+
+        connection = sqlite3.connect(cls.dataBaseFile)
+        globalSystems = [row[0] for row in connection.execute("SELECT id FROM GlobalSystems")]
+        connection.executemany("INSERT INTO Partition VALUES (?,?,?,?,?,?,?)",[("bigPca%d" % p,"pcaHost%d" % p,1,2,3,4,5) for p in range(partitionCount)])
+        connection.executemany("INSERT INTO Detector VALUES (?,?,?,?)",[("bigDetector%d" % i,"detectorHost%d" % i,"DetectorA",6000) for i in range(detectorCount)])
+        connection.executemany("INSERT INTO Mapping VALUES (?,?)",[("bigDetector%d" % i,"bigPca%d" % (i % partitionCount)) for i in range(detectorCount)])
+        connection.executemany("INSERT INTO Configurations VALUES (?,?,?)",[("config%d_%d" % (i,j),"bigDetector%d" % i,"{}") for i in range(detectorCount) for j in range(2)])
+        connection.executemany("INSERT INTO Configurations VALUES (?,?,?)",[("config_%s" % g,g,"{}") for g in globalSystems])
+        #bigTag<p> covers all systems of partition p
+        connection.executemany("INSERT INTO ConfigurationTag VALUES (?,?)",[("bigTag%d" % (i % partitionCount),"config%d_0" % i) for i in range(detectorCount)])
+        connection.executemany("INSERT INTO ConfigurationTag VALUES (?,?)",[("bigTag%d" % p,"config_%s" % g) for p in range(partitionCount) for g in globalSystems])
+        #rows were inserted next to the wrapper, so fill TagCompatibility again
+        DataBaseMigrations.createTagCompatibility(connection)
+        connection.commit()
+        cls.connection = connection
+
+    @classmethod
+    def tearDownClass(cls):
+        DataBaseWrapper.dataBaseFile = cls.oldDataBaseFile
+        cls.connection.close()
+        DataBaseWrapper.getConnectionPool(cls.dataBaseFile).close()
+        shutil.rmtree(cls.directory)
+
+    def plan(self,query):
+        parameters = ("bigPca1",) * query.count("?")
+        return [row[3] for row in self.connection.execute("EXPLAIN QUERY PLAN "+query,parameters).fetchall()]
+
+    def assertIndexDriven(self,query,indexes):
+        plan = self.plan(query)
+        for step in plan:
+            for table in ("Mapping","Configurations","ConfigurationTag"):
+                self.assertFalse(step.startswith("SCAN %s" % table) or step.startswith("SCAN m "),"%s in %s" % (step,plan))
+        for index in indexes:
+            self.assertTrue(any(index in step for step in plan),"%s not used in %s" % (index,plan))
+
+    def checkPlans(self):
+        self.assertEqual(self.database.checkQueryPlans(),[])
+        self.assertIndexDriven(DataBaseWrapper.detectorsForPartitionQuery,["Mapping_PartitionId"])
+        self.assertIndexDriven(DataBaseWrapper.configsForPCAQuery,["Mapping_PartitionId","Configurations_systemId"])
+        self.assertIndexDriven(DataBaseWrapper.pcaCompatibleTagsQuery,["SEARCH TagCompatibility USING PRIMARY KEY"])
+
+    def testQueryPlans(self):
+        self.checkPlans()
+
+    def testQueryPlansWithStatistics(self):
+        #ANALYZE gives the planner table sizes; it must still choose the indexes
+        self.connection.execute("ANALYZE")
+        try:
+            self.checkPlans()
+        finally:
+            self.connection.execute("DROP TABLE IF EXISTS sqlite_stat1")
+            self.connection.commit()
+
+    def testResults(self):
+        detectors = list(self.database.getDetectorsForPartition("bigPca1"))
+        self.assertEqual(len(detectors),detectorCount // partitionCount)
+        configs = [config for config in self.database.getConfigsForPCA("bigPca1") if config.systemId.startswith("bigDetector")]
+        self.assertEqual(len(configs),2 * len(detectors))
+        self.assertEqual(self.database.getPcaCompatibleTags("bigPca1"),{"bigTag1"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import os
+import shutil
+import tempfile
+import DataBaseWrapper
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class DataBaseWrapperTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.dataBaseFile = os.path.join(self.directory,"ECS_database.db")
+        shutil.copy(os.path.join(repository,"Django","ECS_GUI","ECS_database.db"),self.dataBaseFile)
+        self.oldDataBaseFile = DataBaseWrapper.dataBaseFile
+        DataBaseWrapper.dataBaseFile = self.dataBaseFile
+        self.database = DataBaseWrapper.DataBaseWrapper(lambda *args: None)
+
+    def tearDown(self):
+        DataBaseWrapper.dataBaseFile = self.oldDataBaseFile
+        DataBaseWrapper.getConnectionPool(self.dataBaseFile).close()
+        shutil.rmtree(self.directory)
+
+    def testDetectorsWithPartitions(self):
+        #"1" is mapped to pca1, "5" is unmapped
+        detectors = self.database.getDetectorsWithPartitions(["1","5","unknown"])
+        self.assertEqual(sorted(detectors),["1","5"])
+        detector,partition = detectors["1"]
+        self.assertEqual(detector.asArray(),self.database.getDetector("1").asArray())
+        self.assertEqual(partition.asArray(),self.database.getPartition("pca1").asArray())
+        detector,partition = detectors["5"]
+        self.assertEqual(detector.id,"5")
+        self.assertEqual(partition,None)
+
+    def testDetectorsWithPartitionsInChunks(self):
+        ids = ["unknown%d" % i for i in range(2000)] + ["1"]
+        self.assertEqual(list(self.database.getDetectorsWithPartitions(ids)),["1"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import json
+from DataObjects import DataObjectCollection, detectorDataObject, partitionDataObject, configObject, mappingDataObject
+
+class DataObjectTest(unittest.TestCase):
+    def testRowAndDictAreEqual(self):
+        for dataClass,row in (
+            (detectorDataObject,("det1","localhost","DetectorA",5000)),
+            (partitionDataObject,("pca1","localhost",1,2,3,4,5)),
+            (configObject,("cfg1","det1","{}")),
+            (mappingDataObject,("det1","pca1")),
+        ):
+            obj = dataClass(row)
+            self.assertEqual(obj.asArray(),list(row))
+            self.assertEqual(dataClass(obj.asJson()).asArray(),list(row))
+            self.assertEqual(dataClass(json.loads(obj.asJsonString())).asArray(),list(row))
+
+    def testJsonStringIsCached(self):
+        detector = detectorDataObject(("det1","localhost","DetectorA",5000))
+        self.assertIs(detector.asJsonString(),detector.asJsonString())
+        self.assertNotIn("jsonString",detector.asJson())
+
+    def testCollectionRoundTrip(self):
+        rows = [("pca1","localhost",1,2,3,4,5),("pca2","localhost",6,7,8,9,10)]
+        collection = DataObjectCollection(rows,partitionDataObject)
+        copy = DataObjectCollection(json.loads(collection.asJsonString()),partitionDataObject)
+        self.assertEqual([p.asArray() for p in copy],[list(row) for row in rows])
+
+if __name__ == '__main__':
+    unittest.main()
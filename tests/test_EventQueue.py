@@ -0,0 +1,50 @@
+import threading
+import unittest
+from queue import Empty
+from ECS_tools import EventQueue
+
+class EventQueueTest(unittest.TestCase):
+    def testPutAndGetKeepOrder(self):
+        queue = EventQueue()
+        for i in range(5):
+            queue.put(i)
+        self.assertEqual([queue.get() for i in range(5)],[0,1,2,3,4])
+
+    def testGetRaisesEmpty(self):
+        queue = EventQueue()
+        self.assertRaises(Empty,queue.get_nowait)
+        self.assertRaises(Empty,queue.get,True,0.01)
+
+    def testPutMany(self):
+        queue = EventQueue()
+        queue.put("a")
+        queue.putMany(["b","c"])
+        self.assertEqual(len(queue),3)
+        self.assertEqual(queue.drain(),["a","b","c"])
+
+    def testDrainRespectsMaxItems(self):
+        queue = EventQueue()
+        queue.putMany(range(10))
+        self.assertEqual(queue.drain(4),[0,1,2,3])
+        self.assertEqual(queue.drain(),[4,5,6,7,8,9])
+
+    def testDrainTimeout(self):
+        self.assertEqual(EventQueue().drain(timeout=0.01),[])
+
+    def testDrainWaitsForProducer(self):
+        queue = EventQueue()
+        timer = threading.Timer(0.05,queue.put,("late",))
+        timer.start()
+        self.assertEqual(queue.drain(timeout=5),["late"])
+        timer.join()
+
+    def testMetrics(self):
+        queue = EventQueue()
+        queue.putMany(range(6))
+        queue.get()
+        queue.drain(2)
+        self.assertEqual(queue.metrics(),{"depth":3, "maxDepth":6, "put":6, "get":3})
+        self.assertEqual(queue.depth(),3)
+
+if __name__ == "__main__":
+    unittest.main()
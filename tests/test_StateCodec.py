@@ -0,0 +1,47 @@
+import unittest
+import StateCodec
+import ECS_tools
+from ECSCodes import ECSCodes
+codes = ECSCodes()
+from DataObjects import stateObject
+
+def asTuples(records):
+    return [(id,sequence,state if state in (codes.reset,codes.removed) else tuple(state.asArray())) for id,sequence,state in records]
+
+class StateCodecTest(unittest.TestCase):
+    def roundTrip(self,records):
+        payload = StateCodec.encode(records)
+        self.assertTrue(StateCodec.isBinary(payload))
+        self.assertEqual(asTuples(StateCodec.decode(payload)),asTuples(records))
+
+    def testRoundTrip(self):
+        self.roundTrip([
+            ("pca1",1,codes.reset),
+            ("detector1",2,stateObject(["Ready","Ready","tag1",None])),
+            ("detector2",300,stateObject(["Unconfigured","myUnmappedState",None,"a comment"])),
+            ("detector3",70000,codes.removed),
+        ])
+
+    def testFalseMappedState(self):
+        #getMappedStateForState returns False for states without a mapping
+        self.roundTrip([("detector1",5,stateObject([False,"unknownState",None,None])),("detector2",6,stateObject([True,False,False,None]))])
+
+    def testManyStrings(self):
+        #references above 127 need more than one byte
+        self.roundTrip([("detector%d" % i,i,stateObject(["Ready","Ready","tag%d" % i,"comment%d" % i])) for i in range(300)])
+
+    def testUnsupportedValue(self):
+        self.assertRaises(TypeError,StateCodec.encode,[("detector1",1,stateObject(["Ready","Ready",3,None]))])
+
+    def testUnsupportedValueFallsBackToJson(self):
+        records = [("detector1",1,stateObject(["Ready","Ready",3,None]))]
+        payload = ECS_tools.encode_records(records,binary=True)
+        self.assertFalse(StateCodec.isBinary(payload))
+        self.assertEqual(asTuples(ECS_tools.decode_status_batch(payload)),asTuples(records))
+
+    def testForeignCodec(self):
+        payload = StateCodec.encode([("detector1",1,codes.removed)])
+        self.assertRaises(ValueError,StateCodec.decode,b'\x01\x00\x00\x00'+payload[4:])
+
+if __name__ == "__main__":
+    unittest.main()
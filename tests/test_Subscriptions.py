@@ -0,0 +1,70 @@
+import unittest
+import time
+import zmq
+import ECS_tools
+from ECSCodes import ECSCodes
+codes = ECSCodes()
+
+class SubscriptionsTest(unittest.TestCase):
+    def setUp(self):
+        self.context = zmq.Context()
+        self.publisher = self.context.socket(zmq.XPUB)
+        self.publisher.setsockopt(zmq.XPUB_MANUAL,1)
+        self.publisher.setsockopt(zmq.LINGER,0)
+        self.port = self.publisher.bind_to_random_port("tcp://127.0.0.1")
+        self.subscriptions = ECS_tools.Subscriptions(self.publisher)
+        self.subscribers = []
+
+    def tearDown(self):
+        for subscriber in self.subscribers:
+            subscriber.close(0)
+        self.publisher.close(0)
+        self.context.term()
+
+    def subscriber(self,topic):
+        subscriber = self.context.socket(zmq.SUB)
+        subscriber.connect("tcp://127.0.0.1:%d" % self.port)
+        subscriber.setsockopt(zmq.SUBSCRIBE,topic)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def waitFor(self,condition):
+        """read (un)subscriptions until condition is true"""
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            self.publisher.poll(50)
+            self.subscriptions.update()
+            if condition():
+                return
+        self.fail("subscriptions didn't arrive")
+
+    def receive(self,subscriber):
+        if subscriber.poll(1000):
+            return subscriber.recv()
+        return None
+
+    def testTopicStaysWhileASubscriberIsLeft(self):
+        first = self.subscriber(codes.stateBatch)
+        second = self.subscriber(codes.stateBatch)
+        self.waitFor(lambda: self.subscriptions.counts[codes.stateBatch] == 2)
+        self.subscribers.remove(first)
+        first.close(0)
+        self.waitFor(lambda: self.subscriptions.counts[codes.stateBatch] == 1)
+        self.assertIn(codes.stateBatch,self.subscriptions)
+        self.publisher.send(codes.stateBatch+b'data')
+        self.assertEqual(self.receive(second),codes.stateBatch+b'data')
+        self.subscribers.remove(second)
+        second.close(0)
+        self.waitFor(lambda: codes.stateBatch not in self.subscriptions)
+
+    def testSubscribersToEverythingDontGetBatches(self):
+        everything = self.subscriber(b'')
+        binary = self.subscriber(ECS_tools.binaryBatchTopic)
+        self.waitFor(lambda: b'' in self.subscriptions and self.subscriptions.withPrefix(codes.stateBatchBinary) == [ECS_tools.binaryBatchTopic])
+        self.publisher.send(ECS_tools.binaryBatchTopic+b'data')
+        self.publisher.send(b'detector1')
+        self.assertEqual(self.receive(everything),b'detector1')
+        self.assertEqual(self.receive(binary),ECS_tools.binaryBatchTopic+b'data')
+
+if __name__ == '__main__':
+    unittest.main()
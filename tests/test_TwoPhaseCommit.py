@@ -0,0 +1,102 @@
+import unittest
+import threading
+import time
+import ECS_tools
+
+class FakeSystem:
+    """records the changes applied to and undone on a system"""
+    def __init__(self,id,succeeds=True,delay=0,undoSucceeds=True):
+        self.id = id
+        self.succeeds = succeeds
+        self.delay = delay
+        self.undoSucceeds = undoSucceeds
+        self.calls = []
+        self.finished = threading.Event()
+
+def apply(change):
+    def function(system):
+        time.sleep(system.delay)
+        if system.succeeds:
+            system.calls.append(("apply",change))
+        system.finished.set()
+        return system.succeeds
+    return function
+
+def undo(change):
+    def function(system):
+        system.calls.append(("undo",change))
+        return system.undoSucceeds
+    return function
+
+class TwoPhaseCommitTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ECS_tools.FanOutPool(4,"test")
+        self.logged = []
+        self.commit = ECS_tools.TwoPhaseCommit(self.pool,0.5,lambda message,error=False: self.logged.append(message))
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def systems(self,*systems):
+        return dict((system.id,system) for system in systems)
+
+    def testSuccessIsKept(self):
+        a,b = FakeSystem("a"),FakeSystem("b")
+        report = self.commit.run(self.systems(a,b),apply(1),undo(1))
+        self.assertTrue(report.success())
+        self.assertEqual(sorted(report.successes),["a","b"])
+        self.assertEqual(a.calls,[("apply",1)])
+        self.assertEqual(b.calls,[("apply",1)])
+
+    def testPartialSuccessIsUndone(self):
+        a,b,c = FakeSystem("a"),FakeSystem("b"),FakeSystem("c",succeeds=False)
+        report = self.commit.run(self.systems(a,b,c),apply(1),undo(1))
+        self.assertFalse(report.success())
+        self.assertEqual(report.failures,["c"])
+        self.assertEqual(a.calls,[("apply",1),("undo",1)])
+        self.assertEqual(b.calls,[("apply",1),("undo",1)])
+        self.assertEqual(c.calls,[])
+        #nothing left to undo
+        self.assertEqual(self.commit.rollback(),None)
+
+    def testChangesAreUndoneInReverseOrderPerSystem(self):
+        a,b = FakeSystem("a"),FakeSystem("b")
+        self.commit.run(self.systems(a,b),apply(1),undo(1))
+        self.commit.run(self.systems(a),apply(2),undo(2))
+        b.succeeds = False
+        report = self.commit.run(self.systems(a,b),apply(3),undo(3))
+        self.assertEqual(report.failures,["b"])
+        self.assertEqual(a.calls,[("apply",1),("apply",2),("apply",3),("undo",3),("undo",2),("undo",1)])
+        self.assertEqual(b.calls,[("apply",1),("undo",1)])
+
+    def testNoRollbackOnFailure(self):
+        #e.g. forceDelete keeps the changes of the systems which applied them
+        a,b = FakeSystem("a"),FakeSystem("b",succeeds=False)
+        report = self.commit.run(self.systems(a,b),apply(1),undo(1),rollbackOnFailure=False)
+        self.assertEqual(report.failures,["b"])
+        self.assertEqual(a.calls,[("apply",1)])
+        #a later failure still undoes them
+        self.commit.rollback()
+        self.assertEqual(a.calls,[("apply",1),("undo",1)])
+
+    def testTimeoutIsUndoneWhenItAppliesLate(self):
+        a,slow = FakeSystem("a"),FakeSystem("slow",delay=1)
+        start = time.time()
+        report = self.commit.run(self.systems(a,slow),apply(1),undo(1))
+        self.assertLess(time.time()-start,0.9)
+        self.assertEqual(report.timeouts,["slow"])
+        self.assertEqual(a.calls,[("apply",1),("undo",1)])
+        self.assertTrue(slow.finished.wait(2))
+        #the undo is sent by the done callback of the late call
+        deadline = time.time()+2
+        while len(slow.calls) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(slow.calls,[("apply",1),("undo",1)])
+
+    def testFailedUndoIsLogged(self):
+        a,b = FakeSystem("a",undoSucceeds=False),FakeSystem("b",succeeds=False)
+        self.commit.run(self.systems(a,b),apply(1),undo(1))
+        self.assertEqual(self.logged,["rollback failed for a"])
+
+if __name__ == '__main__':
+    unittest.main()